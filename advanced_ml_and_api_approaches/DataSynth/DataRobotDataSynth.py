@@ -99,12 +99,12 @@ def build_generators(df):
     return generators
 
 
-def build_dataset(generators_config_df, rows_required):
+def build_dataset(generators_config_df, rows_required, seed):
     st.toast("Building Dataset - Running", icon="💪")
     generators = build_generators(generators_config_df)
     st.session_state["GeneratorsConfig"] = generators_config_df
-    st.session_state["Result"] = pd.DataFrame.from_dict(
-        generate_rows(generators, rows_required, None)
+    st.session_state["Result"] = generate_dataframe(
+        generators, rows_required, seed=seed, bar=st.progress(0.0)
     )
     st.toast("Building Dataset - Complete", icon="👌")
 
@@ -181,6 +181,14 @@ with st.expander("Configuration", expanded=True):
         step=100,
         disabled=True if "Result" in st.session_state else False,
     )
+    st.number_input(
+        "Seed",
+        key="Seed",
+        min_value=0,
+        value=st.session_state["Seed"] if "Seed" in st.session_state else 0,
+        step=1,
+        disabled=True if "Result" in st.session_state else False,
+    )
     st.button(
         "Build Dataset",
         key="BuildDatasetButton",
@@ -189,6 +197,7 @@ with st.expander("Configuration", expanded=True):
         kwargs={
             "generators_config_df": generators_df,
             "rows_required": st.session_state.RowsRequired,
+            "seed": st.session_state.Seed,
         },
         disabled=True if "Result" in st.session_state else False,
     )
@@ -1,8 +1,12 @@
+import datetime
 import random
+import re
 import string
 import uuid
 
 from faker import Faker
+import numpy as np
+import pandas as pd
 
 try:
     from tqdm import tqdm
@@ -193,6 +197,181 @@ def generate_name(null_probability=None):
     return fake.name()
 
 
+# Columnar generation
+# -------------------
+# column_<datatype> functions return a whole column of n values at once, drawn
+# from a numpy Generator, without nulls; Generator.column applies the null mask.
+
+# Faker based columns are sampled from a pool of this many generated values,
+# so they have at most this many distinct values; a column can set its own
+# size with the pool_size option
+faker_pool_size = 10000
+
+
+def _parse_list(values, name):
+    if isinstance(values, str):
+        try:
+            values = eval(values)
+        except Exception as e:
+            print(
+                f'{name} string "{values}" could not be converted to a list, it should be in form [a,b,c,d]'
+            )
+            print("The error is: ", e)
+    assert isinstance(values, list)
+    return values
+
+
+def column_bool(rng, n):
+    return rng.random(n) < 0.5
+
+
+def column_int(rng, n, min_value=0, max_value=100):
+    return rng.integers(int(min_value), int(max_value), n, endpoint=True)
+
+
+def column_float(rng, n, min_value=0.0, max_value=1.0):
+    return rng.uniform(min_value, max_value, n)
+
+
+def column_from_list(rng, n, values, weights=None):
+    values = _parse_list(values, "values")
+    probabilities = None
+    if weights:
+        weights = np.asarray(_parse_list(weights, "weights"), dtype=float)
+        assert len(weights) == len(values)
+        probabilities = weights / weights.sum()
+    choices = np.empty(len(values), dtype=object)
+    choices[:] = values
+    return choices[rng.choice(len(values), size=n, p=probabilities)]
+
+
+def column_str(rng, n, length=8, characters=string.ascii_lowercase):
+    assert isinstance(characters, str)
+    length = int(length)
+    characters = np.array(list(characters))
+    # n x length single characters, viewed as n strings of length characters
+    chars = characters[rng.integers(0, len(characters), (n, length))]
+    return chars.view(f"<U{length}").ravel() if length else np.full(n, "")
+
+
+def column_word(rng, n):
+    words = np.array(fake.get_words_list(), dtype=object)
+    return words[rng.integers(0, len(words), n)]
+
+
+def column_from_pool(rng, n, pool):
+    return pool[rng.integers(0, len(pool), n)]
+
+
+# Faker values too slow to generate per row, columns are sampled from a pool
+faker_value_functions = {
+    "text": lambda fake, length=20: fake.text(int(length)),
+    "name": lambda fake: fake.name(),
+}
+
+
+def faker_pool(rng, datatype, pool_size=None, **options):
+    """returns pool_size Faker values of datatype, seeded from rng"""
+    pool_size = faker_pool_size if pool_size is None else int(pool_size)
+    assert pool_size > 0, "pool_size must be positive"
+    pool_fake = Faker()
+    pool_fake.seed_instance(int(rng.integers(2**32)))
+    make_value = faker_value_functions[datatype]
+    pool = np.empty(pool_size, dtype=object)
+    pool[:] = [make_value(pool_fake, **options) for _ in range(pool_size)]
+    return pool
+
+
+# relative dates as Faker accepts them, e.g. "-10y", "+2w" or "-1y-6M"
+_relative_date = re.compile(
+    "".join(
+        rf"(?:(?P<{name}>[-+]\d+){symbol})?"
+        for name, symbol in [
+            ("years", "y"),
+            ("months", "M"),
+            ("weeks", "w"),
+            ("days", "d"),
+            ("hours", "h"),
+            ("minutes", "m"),
+            ("seconds", "s"),
+        ]
+    )
+    + "$"
+)
+
+
+def parse_date(value):
+    """
+    returns the date for a date, datetime, timedelta, number of days from today,
+    "today"/"now" or relative date string, the same way Faker's date_between reads them
+    """
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    today = datetime.date.today()
+    if isinstance(value, datetime.timedelta):
+        return today + value
+    if isinstance(value, int):
+        return today + datetime.timedelta(value)
+    if value in ("today", "now"):
+        return today
+    match = _relative_date.match(value) if isinstance(value, str) else None
+    if not match or not any(match.groupdict().values()):
+        raise ValueError(f"Invalid format for date {value!r}")
+    parts = {name: int(part) for name, part in match.groupdict().items() if part}
+    # Faker's lengths of a year and a month
+    days = 365.24 * parts.pop("years", 0) + 30.42 * parts.pop("months", 0)
+    return today + datetime.timedelta(days=parts.pop("days", 0) + days, **parts)
+
+
+def column_date(rng, n, start_date="-1y", end_date="today"):
+    start = np.datetime64(parse_date(start_date), "D")
+    end = np.datetime64(parse_date(end_date), "D")
+    days = rng.integers(0, (end - start).astype(int), n, endpoint=True)
+    return start + days
+
+
+_hex_bytes = np.array([f"{i:02x}" for i in range(256)])
+
+
+def column_uuid(rng, n):
+    data = np.frombuffer(rng.bytes(16 * n), dtype=np.uint8).reshape(n, 16).copy()
+    # version 4, RFC 4122 variant, as uuid.uuid4
+    data[:, 6] = (data[:, 6] & 0x0F) | 0x40
+    data[:, 8] = (data[:, 8] & 0x3F) | 0x80
+    digits = _hex_bytes[data].view("<U1").reshape(n, 32)
+    chars = np.full((n, 36), "-", dtype="<U1")
+    chars[:, [i for i in range(36) if i not in (8, 13, 18, 23)]] = digits
+    return chars.view("<U36").ravel()
+
+
+column_functions = {
+    "bool": column_bool,
+    "int": column_int,
+    "float": column_float,
+    "str": column_str,
+    "list": column_from_list,
+    "word": column_word,
+    "date": column_date,
+    "uuid": column_uuid,
+}
+
+# pandas dtypes of the generated columns, nullable so every chunk has the same schema
+column_dtypes = {
+    "bool": "boolean",
+    "int": "Int64",
+    "float": "Float64",
+    "str": "string",
+    "word": "string",
+    "text": "string",
+    "uuid": "string",
+    "name": "string",
+    "date": "datetime64[s]",
+    "id": "Int64",
+}
+
+
 def infer_datatype(**options):
     if "min_value" in options:
         if isinstance(options["min_value"], int):
@@ -219,6 +398,9 @@ class Generator:
         #     assert(options['null_probability'] <= 1.0 and options['null_probability'] >= 0.0)
         self.name = name if name else generate_str()
         self.datatype = datatype
+        # number of distinct Faker values the columns of text and name
+        # generators are sampled from, see faker_pool
+        self.pool_size = options.pop("pool_size", None)
         self.generate_function = {
             "bool": generate_bool,
             "int": generate_int,
@@ -251,6 +433,47 @@ class Generator:
         else:
             return self.generate_function(**self.options)
 
+    def pool(self, rng):
+        """returns the pool of values Faker based columns are sampled from, or None"""
+        if self.datatype not in faker_value_functions:
+            return None
+        options = {k: v for k, v in self.options.items() if k != "null_probability"}
+        return faker_pool(rng, self.datatype, self.pool_size, **options)
+
+    def column(self, n, rng, pool=None) -> pd.Series:
+        """
+        returns a column of n values as a pandas Series
+
+        parameters:
+        -----------
+        n : number of values
+        rng : numpy.random.Generator the values are drawn from
+        pool : (optional) pool returned by Generator.pool, reused across chunks
+        """
+        if self.datatype == "id":
+            start = self.id + self.id_increment
+            self.id += self.id_increment * n
+            return pd.Series(
+                np.arange(n, dtype=np.int64) * self.id_increment + start,
+                name=self.name,
+                dtype="Int64",
+            )
+
+        options = dict(self.options)
+        null_probability = options.pop("null_probability", None)
+        if self.datatype in faker_value_functions:
+            if pool is None:
+                pool = self.pool(rng)
+            values = column_from_pool(rng, n, pool)
+        else:
+            values = column_functions[self.datatype](rng, n, **options)
+        column = pd.Series(
+            values, name=self.name, dtype=column_dtypes.get(self.datatype, object)
+        )
+        if null_probability:
+            column[rng.random(n) < null_probability] = None
+        return column
+
 
 def generate_row(generators) -> dict:
     row = {}
@@ -259,6 +482,81 @@ def generate_row(generators) -> dict:
     return row
 
 
+def generate_chunks(generators, num_rows, chunk_size=100000, seed=None, bar=None):
+    """
+    yields DataFrames of up to chunk_size rows, num_rows in total
+
+    Each generator draws from its own random stream derived from seed, so the
+    same seed and generators always produce the same data.
+
+    parameters:
+    -----------
+    generators : list of Generator
+    num_rows : total number of rows
+    chunk_size : (default=100000) rows per chunk
+    seed : (optional) seed of the run
+    bar : (optional) streamlit progress bar, updated after every chunk
+    """
+    seed_sequence = np.random.SeedSequence(seed)
+    rngs = [np.random.default_rng(s) for s in seed_sequence.spawn(len(generators))]
+    pools = [generator.pool(rng) for generator, rng in zip(generators, rngs)]
+    if bar:
+        bar.progress(0.0)
+    row_count = 0
+    while row_count < num_rows:
+        n = min(chunk_size, num_rows - row_count)
+        chunk = pd.concat(
+            [
+                generator.column(n, rng, pool)
+                for generator, rng, pool in zip(generators, rngs, pools)
+            ],
+            axis=1,
+        )
+        chunk.index = pd.RangeIndex(row_count, row_count + n)
+        row_count += n
+        yield chunk
+        if bar:
+            bar.progress(row_count / num_rows)
+
+
+def generate_dataframe(generators, num_rows, chunk_size=100000, seed=None, bar=None):
+    """returns a DataFrame of num_rows rows, see generate_chunks"""
+    chunks = list(generate_chunks(generators, num_rows, chunk_size, seed, bar))
+    if not chunks:
+        return pd.DataFrame(columns=[generator.name for generator in generators])
+    return pd.concat(chunks)
+
+
+def write_dataset(generators, num_rows, path, chunk_size=100000, seed=None, bar=None):
+    """
+    writes num_rows rows to a Parquet (.parquet) or CSV file, chunk by chunk
+    as they are generated, so the whole dataset is never held in memory
+
+    parameters:
+    -----------
+    path : output file, Parquet if it ends with .parquet, CSV otherwise
+    """
+    chunks = generate_chunks(generators, num_rows, chunk_size, seed, bar)
+    if str(path).endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for chunk in chunks:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table.cast(writer.schema))
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+    return path
+
+
 def generate_rows(generators, num_rows, bar=None) -> None:
     row_count = 0
     if bar:
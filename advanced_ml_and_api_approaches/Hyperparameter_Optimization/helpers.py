@@ -1,6 +1,9 @@
 import asyncio
 from datetime import datetime
 import itertools
+import json
+import os
+import random
 import re
 from sys import displayhook
 import time
@@ -74,26 +77,15 @@ def _delete_models(models: List[dr.models.model.Model]):
     jobs = compute(*jobs)
 
 
-def _sort_models(
-    project: dr.models.project.Project,
-    models: List[dr.models.model.Model],
-    partition: str = "validation",
-    metric: str = None,
-) -> List[dr.Model]:
+def _metric_ascending(project: dr.models.project.Project, metric: str) -> bool:
     """
-    Sorts supplied models by a requested metric and partition
+    Returns True if lower values of the metric are better
 
     project: DataRobot project
-    models: list of DataRobot models
-    partition: string representing which partition to use (see dr.models.model.Model.metrics)
     metric: metric to sort by
 
     """
 
-    # If metric isn't specified, set to project metric
-    if metric is None:
-        metric = project.metric
-
     # If unsupervised project, manually create metrics dict
     if project.unsupervised_mode:
         metrics = {
@@ -109,65 +101,172 @@ def _sort_models(
         metrics = project.get_metrics(feature_name=project.target)
 
     # Capture direction
-    ascending = [
+    return [
         x for x in metrics["metric_details"] if x["metric_name"].startswith(metric)
     ][0]["ascending"]
 
-    # Ensuring we only have models where keys have a value
-    models_with_score = [
-        model for model in models if model.metrics[metric][partition] is not None
-    ]
 
-    # Return sorted models
-    return sorted(
-        models_with_score,
-        key=lambda model: model.metrics[metric][partition],
-        reverse=(not ascending),
-    )
+def _grid_neighbours(combo: dict, advanced_tuning_grid: dict) -> List[dict]:
+    """
+    Returns the combinations of the grid that differ from combo by a single hyperparameter
 
+    """
 
-def _model_cleanup(
-    project: dr.models.project.Project,
-    model_job_ids: List[str],
-    partition: str = "validation",
-    metric: str = None,
+    neighbours = []
+    for key, values in advanced_tuning_grid.items():
+        for value in values:
+            if value != combo[key]:
+                neighbours.append({**combo, key: value})
+    return neighbours
+
+
+def _sample_combos(
+    advanced_tuning_grid: dict,
+    results: List[dict],
+    n_iter: int = None,
     max_n_models_to_keep: int = 5,
+    random_state: int = None,
 ):
     """
-    Sorts supplied models by a requested metric and partition and will keep at most max_n_models_to_keep tuned models
+    Yields the hyperparameter combinations to try next, without repeating the ones in results
 
-    project: DataRobot project
-    partition: string representing which partition to use (see dr.models.model.Model.metrics)
-    metric: metric to sort by
-    max_n_models_to_keep: maximum number of models to keep
+    Without n_iter, every combination of the grid is yielded in grid order. With n_iter, at most n_iter
+    combinations are tried: the first half is sampled at random from the grid, then each sample is a
+    neighbour (see _grid_neighbours) of one of the max_n_models_to_keep best models so far, so the
+    search focuses on the promising part of the grid. results is read again at every step.
 
     """
 
-    # Pull updated jobs
-    model_jobs = [
-        dr.models.job.Job.get(project_id=project.id, job_id=x) for x in model_job_ids
-    ]
+    keys, values = zip(*advanced_tuning_grid.items())
+    grid = [dict(zip(keys, v)) for v in itertools.product(*values)]
+
+    def tried():
+        return {json.dumps(r["hyperparameters"], sort_keys=True) for r in results}
+
+    if n_iter is None:
+        seen = tried()
+        for combo in grid:
+            if json.dumps(combo, sort_keys=True) not in seen:
+                yield combo
+        return
+
+    rng = random.Random(random_state)
+    n_random = max(1, n_iter // 2)
+    while len(results) < n_iter:
+        seen = tried()
+        candidates = []
+        if len(results) >= n_random:
+            best = [r for r in results if r["rank"] is not None]
+            best = sorted(best, key=lambda r: r["rank"])[:max_n_models_to_keep]
+            candidates = [
+                neighbour
+                for r in best
+                for neighbour in _grid_neighbours(
+                    r["hyperparameters"], advanced_tuning_grid
+                )
+                if json.dumps(neighbour, sort_keys=True) not in seen
+            ]
+        if not candidates:
+            candidates = [c for c in grid if json.dumps(c, sort_keys=True) not in seen]
+        if not candidates:
+            return
+        yield rng.choice(candidates)
 
-    # Find the models that were successful
-    model_jobs = [
-        x for x in model_jobs if x.status == dr.enums.ASYNC_PROCESS_STATUS.COMPLETED
-    ]
-    models = [x.get_result_when_complete(max_wait=60 * 60 * 24) for x in model_jobs]
-    print(f"{len(models)} completed successfully!")
 
-    # Sorting models
-    sorted_models = _sort_models(
-        project=project, models=models, partition=partition, metric=metric
-    )
+def _start_tuning_job(
+    model: dr.models.model.Model,
+    tuning_parameters: List[dict],
+    hyperparameter_combo: dict,
+) -> str:
+    """
+    Starts an advanced tuning session for one hyperparameter combination
+
+    Returns the id of the tuning job, or None if the combination was already run and aborted
+
+    """
+
+    try:
+        # Start tuning
+        tune = model.start_advanced_tuning_session()
+
+        # Go through each hyperparameter
+        for key in hyperparameter_combo.keys():
+            # Get id from parameter name
+            # This allows you to tune, even when a parameter name is shared
+            param_ids = [
+                x["parameter_id"]
+                for x in tuning_parameters
+                if x["parameter_name"] == key
+            ]
+
+            # Cycle through parameter IDs (in case there's multiple for a parameter name
+            for param_id in param_ids:
+                tune.set_parameter(
+                    parameter_name=key,
+                    parameter_id=param_id,
+                    value=hyperparameter_combo[key],
+                )
+
+        # Execute tuning job
+        return str(tune.run().id)
+
+    # If job was already ran, collect the job id
+    except dr.errors.JobAlreadyRequested as error:
+        if error.json["previousJob"]["status"] == "ABORTED":
+            print(
+                f"Combination {hyperparameter_combo} did not complete successfully. Consider running this combination via the GUI."
+            )
+            return None
 
-    # Finding models to delete (if more than <max_n_models_to_keep>)
-    n_models = len(sorted_models)
-    if n_models > max_n_models_to_keep:
-        # Deleting models
-        models_to_delete = sorted_models[(max_n_models_to_keep - n_models) :]
-        print(f"Deleting {len(models_to_delete)} of {n_models} models...")
-        _delete_models(models_to_delete)
-        print("Model deletion finished!")
+        return str(error.json["previousJob"]["id"])
+
+
+def _save_checkpoint(checkpoint_path: str, state: dict):
+    """
+    Atomically writes the search state to checkpoint_path
+
+    """
+
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2, default=str)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def _load_checkpoint(checkpoint_path: str, model_id: str, advanced_tuning_grid: dict):
+    """
+    Reads the results of a previous search from checkpoint_path, if it searched the same model and grid
+
+    """
+
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return []
+
+    with open(checkpoint_path) as f:
+        state = json.load(f)
+
+    if state["model_id"] != model_id or json.dumps(
+        state["advanced_tuning_grid"], sort_keys=True, default=str
+    ) != json.dumps(advanced_tuning_grid, sort_keys=True, default=str):
+        raise ValueError(
+            f"{checkpoint_path} belongs to another search, remove it or pass another checkpoint_path"
+        )
+
+    print(f"Resuming search from {checkpoint_path}...")
+    return state["results"]
+
+
+def _rank_results(results: List[dict], ascending: bool):
+    """
+    Ranks the completed results by score, best first, and returns them in that order
+
+    """
+
+    scored = [r for r in results if r["score"] is not None]
+    scored = sorted(scored, key=lambda r: r["score"], reverse=(not ascending))
+    for rank, r in enumerate(scored):
+        r["rank"] = rank
+    return scored
 
 
 @retry(
@@ -181,9 +280,16 @@ def tuning_hyperparameters(
     partition: str = "validation",
     metric: str = None,
     max_n_models_to_keep: int = 5,
-):
+    max_jobs_in_flight: int = 4,
+    n_iter: int = None,
+    checkpoint_path: str = None,
+    poll_interval: float = 30,
+    max_wait: float = 60 * 60 * 24,
+    random_state: int = None,
+) -> pd.DataFrame:
     """
-    Brute force builds a model for each hyperparameter combination with the ability to delete worst performing models
+    Searches the hyperparameter grid with a bounded number of tuning jobs in flight, deleting worst performing models
+    as results arrive
     Note that if a hyperparameter is shared among tasks, the passed value will be applied to all hyperparameters with a matching name
 
     model: a DataRobot models
@@ -191,77 +297,134 @@ def tuning_hyperparameters(
     partition: string representing which partition to use (see dr.models.model.Model.metrics)
     metric: metric to sort by
     max_n_models_to_keep: maximum number of models to keep
+    max_jobs_in_flight: maximum number of tuning jobs queued or running at once
+    n_iter: maximum number of combinations to try, sampled adaptively (see _sample_combos). Defaults to the full grid
+    checkpoint_path: JSON file where the results are saved as they arrive; an interrupted search with the same
+        model and grid resumes from it
+    poll_interval: seconds between checks of the project queue
+    max_wait: maximum seconds to wait for the search
+    random_state: seed of the sampler
+
+    Returns a dataframe with the hyperparameters, job, model, score and rank of every combination tried
 
     """
 
     # Get project ID
     project = dr.Project.get(model.project_id)
 
-    # Create list of every possible combination
-    keys, values = zip(*advanced_tuning_grid.items())
-    hyperparameter_combos = [dict(zip(keys, v)) for v in itertools.product(*values)]
+    # If metric isn't specified, set to project metric
+    if metric is None:
+        metric = project.metric
+    ascending = _metric_ascending(project, metric)
+
+    n_combos = int(np.prod([len(v) for v in advanced_tuning_grid.values()]))
     print(
-        f"Number of hyperparameter combinations to evaluate: {len(hyperparameter_combos)}"
+        f"Number of hyperparameter combinations to evaluate: {n_combos if n_iter is None else min(n_iter, n_combos)}"
     )
 
     # Pull tuning parameters to pass to model later
     tuning_parameters = model.get_advanced_tuning_parameters()["tuning_parameters"]
 
-    # For each hyperparameter combo, try running the model
-    model_job_ids = []
-    for hyperparameter_combo in hyperparameter_combos:
-        try:
-            # Start tuning
-            tune = model.start_advanced_tuning_session()
-
-            # Go through each hyperparameter
-            for key in hyperparameter_combo.keys():
-                # Get id from parameter name
-                # This allows you to tune, even when a parameter name is shared
-                param_ids = [
-                    x["parameter_id"]
-                    for x in tuning_parameters
-                    if x["parameter_name"] == key
-                ]
-
-                # Cycle through parameter IDs (in case there's multiple for a parameter name
-                for param_id in param_ids:
-                    tune.set_parameter(
-                        parameter_name=key,
-                        parameter_id=param_id,
-                        value=hyperparameter_combo[key],
-                    )
-
-            # Execute tuning job
-            model_job_ids.append(str(tune.run().id))
-
-            # Sleep to prevent too many API requests at once
-            time.sleep(1)
-
-        # If job was already ran, collect the job id
-        except dr.errors.JobAlreadyRequested as error:
-            if error.json["previousJob"]["status"] == "ABORTED":
-                print(
-                    f"Combination {hyperparameter_combo} did not complete successfully. Consider running this combination via the GUI."
-                )
-
-            else:
-                model_job_ids.append(error.json["previousJob"]["id"])
+    results = _load_checkpoint(checkpoint_path, model.id, advanced_tuning_grid)
+    _rank_results(results, ascending)
+
+    def checkpoint():
+        if checkpoint_path is not None:
+            _save_checkpoint(
+                checkpoint_path,
+                {
+                    "model_id": model.id,
+                    "advanced_tuning_grid": advanced_tuning_grid,
+                    "results": results,
+                },
+            )
+
+    tuned_models = {}
+
+    def prune():
+        # Deleting the completed models that are not among the best <max_n_models_to_keep>
+        ranked = _rank_results(results, ascending)
+        dominated = [r for r in ranked[max_n_models_to_keep:] if not r["deleted"]]
+        _delete_models(
+            [
+                tuned_models.get(r["model_id"])
+                or dr.Model.get(project=project.id, model_id=r["model_id"])
+                for r in dominated
+            ]
+        )
+        for r in dominated:
+            r["deleted"] = True
 
-    print(f"Waiting for {len(model_job_ids)} models...")
-    model_jobs = [
-        dr.models.job.Job.get(project_id=project.id, job_id=x) for x in model_job_ids
-    ]
-    [x.wait_for_completion(max_wait=60 * 60 * 24) for x in model_jobs]
-
-    # Cleaning things up
-    _model_cleanup(
-        project=project,
-        model_job_ids=model_job_ids,
-        partition=partition,
-        metric=metric,
+    combos = _sample_combos(
+        advanced_tuning_grid,
+        results,
+        n_iter=n_iter,
         max_n_models_to_keep=max_n_models_to_keep,
+        random_state=random_state,
     )
+    in_flight = {r["job_id"]: r for r in results if r["status"] == "running"}
+    deadline = time.time() + max_wait
+
+    while True:
+        # Keep up to <max_jobs_in_flight> tuning jobs in the queue
+        while len(in_flight) < max_jobs_in_flight:
+            hyperparameter_combo = next(combos, None)
+            if hyperparameter_combo is None:
+                break
+            job_id = _start_tuning_job(model, tuning_parameters, hyperparameter_combo)
+            result = {
+                "hyperparameters": hyperparameter_combo,
+                "job_id": job_id,
+                "model_id": None,
+                "score": None,
+                "rank": None,
+                "status": "running" if job_id is not None else "aborted",
+                "deleted": False,
+            }
+            results.append(result)
+            if job_id is not None:
+                in_flight[job_id] = result
+            checkpoint()
+
+        if not in_flight:
+            break
+        if time.time() > deadline:
+            print(f"Stopped waiting for {len(in_flight)} models after {max_wait}s")
+            break
+
+        time.sleep(poll_interval)
+
+        # A single request tells which of our jobs left the queue
+        queued = {str(job.id) for job in project.get_model_jobs()}
+        for job_id in [x for x in in_flight if x not in queued]:
+            result = in_flight.pop(job_id)
+            job = dr.models.job.Job.get(project_id=project.id, job_id=job_id)
+            if job.status != dr.enums.ASYNC_PROCESS_STATUS.COMPLETED:
+                result["status"] = job.status
+                continue
+            tuned_model = job.get_result()
+            tuned_models[tuned_model.id] = tuned_model
+            result["model_id"] = tuned_model.id
+            result["score"] = tuned_model.metrics[metric][partition]
+            result["status"] = "completed"
+
+        prune()
+        checkpoint()
+
+    n_completed = sum(r["status"] == "completed" for r in results)
+    n_deleted = sum(r["deleted"] for r in results)
+    print(f"{n_completed} completed successfully!")
+    print(f"Deleted {n_deleted} of {n_completed} models")
+
+    return pd.DataFrame(
+        [
+            {
+                **r["hyperparameters"],
+                **{k: v for k, v in r.items() if k != "hyperparameters"},
+            }
+            for r in results
+        ]
+    ).sort_values("rank", ignore_index=True)
 
 
 ######## Bayeisan Optimization ###########
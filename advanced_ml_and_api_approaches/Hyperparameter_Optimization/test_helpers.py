@@ -0,0 +1,213 @@
+"""
+tuning_hyperparameters against a fake DataRobot project
+
+FakeProject stands in for the project, the base model, its tuning sessions,
+the tuning jobs and the tuned models. A job stays in the project queue for a
+few polls, time.sleep advances the poll clock instead of sleeping, and every
+combination of the grid gets a distinct score, so the tests check the bound
+on jobs in flight, the deletion of dominated models, checkpoint resume and
+the n_iter sampler without a DataRobot project. Run with `python -m pytest`
+from this folder.
+"""
+
+import itertools
+import json
+import random
+from types import SimpleNamespace
+
+import datarobot as dr
+import pytest
+
+import helpers
+
+GRID = {
+    "subsample": [0.5, 0.7, 1.0],
+    "colsample_bytree": [0.4, 0.6, 0.8, 1.0],
+    "max_depth": [4, 6, 8, 10],
+}
+COMBOS = [dict(zip(GRID, values)) for values in itertools.product(*GRID.values())]
+
+
+def key(combo):
+    return json.dumps(combo, sort_keys=True)
+
+
+class Interrupted(Exception):
+    pass
+
+
+class FakeProject:
+    def __init__(self, polls_per_job=3):
+        self.id = "project"
+        self.metric = "RMSE"
+        self.target = "y"
+        self.unsupervised_mode = False
+        self.polls_per_job = polls_per_job
+        self.clock = 0
+        self.interrupt_at = None
+        self.jobs = {}
+        self.models = {}
+        self.deleted = []
+        self.max_in_flight = 0
+        rng = random.Random(0)
+        self.scores = dict(
+            zip(map(key, COMBOS), rng.sample(range(len(COMBOS)), len(COMBOS)))
+        )
+
+    def sleep(self, seconds):
+        self.clock += 1
+        if self.clock == self.interrupt_at:
+            raise Interrupted
+
+    def queued(self):
+        return [job for job in self.jobs.values() if self.clock < job["done_at"]]
+
+    def get_metrics(self, feature_name):
+        return {"metric_details": [{"metric_name": "RMSE", "ascending": True}]}
+
+    def get_model_jobs(self):
+        return [SimpleNamespace(id=int(job["id"])) for job in self.queued()]
+
+    def run(self, combo):
+        job_id = str(len(self.jobs) + 1)
+        self.jobs[job_id] = {
+            "id": job_id,
+            "combo": dict(combo),
+            "done_at": self.clock + self.polls_per_job,
+        }
+        self.max_in_flight = max(self.max_in_flight, len(self.queued()))
+        return SimpleNamespace(id=int(job_id))
+
+    def get_job(self, project_id, job_id):
+        job = self.jobs[job_id]
+        completed = self.clock >= job["done_at"]
+        return SimpleNamespace(
+            status="COMPLETED" if completed else "INPROGRESS",
+            get_result=lambda: self.model(job),
+        )
+
+    def model(self, job):
+        model_id = "model-" + job["id"]
+        if model_id not in self.models:
+            self.models[model_id] = SimpleNamespace(
+                id=model_id,
+                combo=job["combo"],
+                metrics={"RMSE": {"validation": self.scores[key(job["combo"])]}},
+                delete=lambda: self.deleted.append((model_id, len(self.jobs))),
+            )
+        return self.models[model_id]
+
+    def base_model(self):
+        def start_advanced_tuning_session():
+            combo = {}
+            return SimpleNamespace(
+                set_parameter=lambda parameter_name, parameter_id, value: (
+                    combo.__setitem__(parameter_name, value)
+                ),
+                run=lambda: self.run(combo),
+            )
+
+        return SimpleNamespace(
+            id="base-model",
+            project_id=self.id,
+            start_advanced_tuning_session=start_advanced_tuning_session,
+            get_advanced_tuning_parameters=lambda: {
+                "tuning_parameters": [
+                    {"parameter_name": name, "parameter_id": name + "-id"}
+                    for name in GRID
+                ]
+            },
+        )
+
+    def kept(self):
+        deleted = {model_id for model_id, _ in self.deleted}
+        return sorted(
+            self.scores[key(model.combo)]
+            for model_id, model in self.models.items()
+            if model_id not in deleted
+        )
+
+
+@pytest.fixture
+def project(monkeypatch):
+    fake = FakeProject()
+    monkeypatch.setattr(dr.Project, "get", lambda project_id: fake)
+    monkeypatch.setattr(dr.models.job.Job, "get", fake.get_job)
+    monkeypatch.setattr(
+        dr.Model, "get", lambda project, model_id: fake.models[model_id]
+    )
+    monkeypatch.setattr(helpers.time, "sleep", fake.sleep)
+    return fake
+
+
+def test_full_grid_keeps_jobs_in_flight_bounded_and_prunes_as_it_goes(project):
+    results = helpers.tuning_hyperparameters(
+        project.base_model(), GRID, max_n_models_to_keep=5, max_jobs_in_flight=3
+    )
+
+    assert len(project.jobs) == len(COMBOS)
+    assert project.max_in_flight == 3
+    assert sorted(results["subsample"].value_counts()) == [16, 16, 16]
+    assert results["rank"].tolist()[:5] == [0, 1, 2, 3, 4]
+    assert results["score"].tolist()[:5] == [0, 1, 2, 3, 4]
+    # only the 5 best models are left, the first ones were deleted long before
+    # the last jobs were submitted
+    assert project.kept() == [0, 1, 2, 3, 4]
+    assert len(project.deleted) == len(COMBOS) - 5
+    assert min(submitted for _, submitted in project.deleted) < len(COMBOS) // 2
+
+
+def test_interrupted_search_resumes_from_the_checkpoint(project, tmp_path):
+    checkpoint_path = str(tmp_path / "search.json")
+    project.interrupt_at = 6
+
+    with pytest.raises(Interrupted):
+        helpers.tuning_hyperparameters(
+            project.base_model(), GRID, checkpoint_path=checkpoint_path
+        )
+    with open(checkpoint_path) as f:
+        state = json.load(f)
+    assert any(r["status"] == "running" for r in state["results"])
+    assert any(r["status"] == "completed" for r in state["results"])
+
+    results = helpers.tuning_hyperparameters(
+        project.base_model(), GRID, checkpoint_path=checkpoint_path
+    )
+
+    # every combination ran exactly once across both calls
+    assert len(project.jobs) == len(COMBOS)
+    assert len({key(job["combo"]) for job in project.jobs.values()}) == len(COMBOS)
+    assert len(results) == len(COMBOS)
+    assert project.kept() == [0, 1, 2, 3, 4]
+
+    with pytest.raises(ValueError, match="belongs to another search"):
+        helpers.tuning_hyperparameters(
+            project.base_model(), {"max_depth": [4]}, checkpoint_path=checkpoint_path
+        )
+
+
+def test_n_iter_samples_distinct_combinations_near_the_best(project):
+    results = helpers.tuning_hyperparameters(
+        project.base_model(), GRID, n_iter=16, max_jobs_in_flight=2, random_state=0
+    )
+
+    tried = [
+        job["combo"]
+        for job in sorted(project.jobs.values(), key=lambda j: int(j["id"]))
+    ]
+    assert len(results) == len(tried) == 16
+    assert len(set(map(key, tried))) == 16
+    # after the random half, every combination is a neighbour of an earlier one
+    for i, combo in enumerate(tried[8:], start=8):
+        assert any(
+            sum(combo[name] != earlier[name] for name in GRID) == 1
+            for earlier in tried[:i]
+        ), combo
+
+
+def test_sample_combos_skips_tried_combinations_in_grid_order():
+    results = [{"hyperparameters": COMBOS[1]}, {"hyperparameters": COMBOS[3]}]
+
+    combos = list(helpers._sample_combos(GRID, results))
+
+    assert combos == [c for i, c in enumerate(COMBOS) if i not in (1, 3)]
@@ -0,0 +1,78 @@
+"""
+Benchmark the PDP/ICE scoring grid builder
+
+Builds the one-way and two-way synthetic scoring grids of
+PartialDependencePlot._create_scoring_data on a synthetic frame for
+k = 10, 50 and 100 levels, and reports the build time, the number of rows
+in the grid, the rows left to score once duplicates are removed, and the
+memory used by the grid. No DataRobot connection is needed.
+
+Usage:
+    python benchmark_pdp_and_ice.py [--rows 100000] [--sample 1000]
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from pdp_and_ice import PartialDependencePlot
+
+
+def make_frame(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "loan_amnt": rng.integers(1, 400, n_rows) * 100,
+            "int_rate": rng.choice(np.round(np.linspace(5, 25, 200), 2), n_rows),
+            "grade": rng.choice(list("ABCDEFG"), n_rows),
+            "annual_inc": rng.lognormal(11, 0.5, n_rows).round(-2),
+            "purpose": rng.choice(
+                ["debt_consolidation", "credit_card", "car", "medical", "other"],
+                n_rows,
+            ),
+            "dti": rng.uniform(0, 40, n_rows).round(1),
+        }
+    )
+
+
+def make_pdp(df, sample, k):
+    # bypass __init__, which looks the model and project up in DataRobot
+    pdp = PartialDependencePlot.__new__(PartialDependencePlot)
+    pdp.df, pdp.sample, pdp.k = df, sample, k
+    return pdp
+
+
+def benchmark(pdp, feature_1, feature_2=None, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        grid = pdp._create_scoring_data(pdp.df, feature_1, feature_2)
+        best = min(best, time.perf_counter() - start)
+    columns = [c for c in grid.columns if c not in ("index", "feature")]
+    unique = pd.util.hash_pandas_object(grid[columns], index=False).nunique()
+    return best, len(grid), unique, grid.memory_usage(deep=True).sum() / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--sample", type=int, default=1000)
+    args = parser.parse_args()
+
+    df = make_frame(args.rows)
+    print(f"{args.rows} rows, {args.sample} sampled rows per grid")
+    print("k    grid                 build s   rows      to score  MiB")
+    for k in [10, 50, 100]:
+        pdp = make_pdp(df, args.sample, k)
+        for name, features in [
+            ("one-way loan_amnt", ("loan_amnt",)),
+            ("two-way loan_amnt", ("loan_amnt", "int_rate")),
+        ]:
+            seconds, rows, unique, mib = benchmark(pdp, *features)
+            print(f"{k:<4} {name:<20} {seconds:<9.3f} {rows:<9} {unique:<9} {mib:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from io import StringIO
+from io import BytesIO
 import os
 import random as rd
 import re
@@ -48,6 +48,8 @@ def get_column_name_mappings(project_id) -> list:
 
 
 def get_batch_predictions(df, deployment_id):
+    # No output path: the results are streamed into memory instead of a shared
+    # file, so concurrent runs don't overwrite each other's predictions
     job = dr.BatchPredictionJob.score(
         deployment_id,
         intake_settings={
@@ -56,15 +58,18 @@ def get_batch_predictions(df, deployment_id):
         },
         output_settings={
             "type": "localFile",
-            "path": "./predicted.csv",
         },
         max_explanations=0,
     )
 
-    preds = job.get_result_when_complete()
-    s = str(preds, "utf-8")
-    s = StringIO(s)
-    return pd.read_csv(s)
+    # download() gives up on jobs that haven't started within its timeout, so
+    # wait for queued jobs to finish before streaming the results
+    job.wait_for_completion()
+
+    buffer = BytesIO()
+    job.download(buffer)
+    buffer.seek(0)
+    return pd.read_csv(buffer)
 
 
 def get_realtime_predictions(df, deployment_id):
@@ -136,6 +141,9 @@ class PartialDependencePlot:
         List of features used in the model.
     scores: pd.DataFrame
         Dataframe containing scores.
+    prediction_cache: dict
+        Predictions of the synthetic rows already scored, keyed by model or
+        deployment ID and indexed by row hash.
     deployment_id: str or None
         DataRobot deployment ID.
 
@@ -145,8 +153,12 @@ class PartialDependencePlot:
         Create a synthetic scoring dataset.
     _score_data:
         Score data using DataRobot API.
+    _score_data_with_cache:
+        Score only the synthetic rows that are not in the prediction cache.
     create_and_score_data:
         Create synthetic data and score it using DataRobot API.
+    create_and_score_features:
+        Create synthetic data for several features and score it in a single job.
     get_features:
         Get informative features from DataRobot project.
     get_feature_impact:
@@ -198,39 +210,67 @@ class PartialDependencePlot:
         ]
         self.features = []
         self.scores = pd.DataFrame()
+        self.prediction_cache = {}
         self.deployment_id = deployment_id
 
+    def _get_levels(self, df: pd.DataFrame, feature: str) -> np.ndarray:
+        """
+        Return the top k most common values of a feature
+
+        Returns:
+        --------
+        np.ndarray
+            The levels used to build the synthetic grid.
+        """
+        return df[feature].value_counts().iloc[0 : self.k].index.values
+
     def _create_scoring_data(
         self,
         df: pd.DataFrame,
         feature_1: str,
+        feature_2: str = None,
     ):
         """
         Create a synthetic scoring dataset
 
+        The grid is the cross product of the sampled rows and the levels of
+        `feature_1` (and of `feature_2` for a two-way grid), built in a single
+        vectorized pass. Rows are ordered level by level, as before, and the
+        original row index is kept in the `index` column for ICE curves.
+
         Returns:
         --------
         pd.DataFrame
             The synthetic scoring dataset.
         """
-        scoring_data = pd.DataFrame()
         sampled_rows = df.sample(n=min(self.df.shape[0], self.sample), replace=False)
+        sampled_rows = sampled_rows.reset_index()
+        n_rows = sampled_rows.shape[0]
+
+        grid_values = {feature_1: self._get_levels(df, feature_1)}
+        if feature_2 is not None:
+            levels_2 = self._get_levels(df, feature_2)
+            levels_1 = grid_values[feature_1]
+            grid_values = {
+                feature_1: np.repeat(levels_1, len(levels_2)),
+                feature_2: np.tile(levels_2, len(levels_1)),
+            }
+        n_levels = len(grid_values[feature_1])
+
+        # repeat every sampled row once per level combination
+        positions = np.tile(np.arange(n_rows), n_levels)
+        scoring_data = sampled_rows.take(positions).reset_index(drop=True)
+        for feature, values in grid_values.items():
+            scoring_data[feature] = pd.Series(
+                np.repeat(values, n_rows), dtype=df[feature].dtype
+            )
 
-        # find unique values
-        unique_values = df[feature_1].unique()
-        size = min(len(unique_values), self.k)
-
-        # grab the top k most common values
-        levels = df[feature_1].value_counts().iloc[0:size].index.values
-
-        # create a copy for each unique value
-        for l in levels:
-            temp = sampled_rows.copy()
-            temp[feature_1] = l
-            temp["feature"] = feature_1
-            scoring_data = scoring_data.append(temp)
+        # constant column, stored as a categorical to keep the grid small
+        scoring_data["feature"] = pd.Categorical(
+            np.repeat(feature_1, scoring_data.shape[0])
+        )
 
-        return scoring_data.reset_index()
+        return scoring_data
 
     def _score_data(
         self,
@@ -266,18 +306,97 @@ class PartialDependencePlot:
 
         return preds
 
+    def _score_data_with_cache(
+        self,
+        df: pd.DataFrame,
+        deployment_id: str,
+    ):
+        """
+        Score a synthetic dataset, sending only rows that haven't been scored yet
+
+        Rows are identified by a hash of their model inputs, so repeated rows
+        within a grid and across grids of different features are scored once
+        per model.
+
+        Returns:
+        --------
+        pd.DataFrame
+            The dataframe containing scores and the synthetic dataset.
+        """
+        columns = [c for c in df.columns if c not in ("index", "feature")]
+        row_hashes = pd.util.hash_pandas_object(df[columns], index=False).values
+        unique_hashes, first, inverse = np.unique(
+            row_hashes, return_index=True, return_inverse=True
+        )
+
+        cache_key = deployment_id if deployment_id is not None else self.model.id
+        cache = self.prediction_cache.get(cache_key, pd.DataFrame())
+        missing = ~np.isin(unique_hashes, cache.index)
+
+        if missing.any():
+            new_data = df.iloc[first[missing]].reset_index(drop=True)
+            new_preds = self._score_data(new_data, deployment_id)
+            pred_columns = new_preds.columns.difference(new_data.columns)
+            new_preds = new_preds[pred_columns].set_axis(
+                unique_hashes[missing], axis="index"
+            )
+            cache = pd.concat([cache, new_preds])
+            self.prediction_cache[cache_key] = cache
+
+        preds = cache.loc[unique_hashes[inverse]].reset_index(drop=True)
+        return pd.concat([preds, df.reset_index(drop=True)], axis=1)
+
     def create_and_score_data(
         self,
         df: pd.DataFrame,
         feature_1: str,
         deployment_id: str,
+        feature_2: str = None,
     ):
-        scoring_data = self._create_scoring_data(df, feature_1)
-        preds = self._score_data(scoring_data, deployment_id)
+        scoring_data = self._create_scoring_data(df, feature_1, feature_2)
+        preds = self._score_data_with_cache(scoring_data, deployment_id)
         preds.sort_values(by=feature_1, inplace=True)
 
         return preds
 
+    def create_and_score_features(self, features: list):
+        """
+        Create the synthetic datasets of several features and score them together
+
+        The grids of all features that haven't been scored yet are combined
+        into one scoring payload, so plotting many features takes a single
+        upload and prediction job instead of one per feature.
+
+        Parameters:
+        -----------
+        features: list
+            Features to be scored.
+
+        Returns:
+        --------
+        pd.DataFrame
+            The dataframe containing the scores of all scored features.
+        """
+        features = [f for f in dict.fromkeys(features) if f not in self.features]
+        if not features:
+            return self.scores
+
+        scoring_data = pd.concat(
+            [self._create_scoring_data(self.df, f) for f in features],
+            ignore_index=True,
+        )
+        scoring_data["feature"] = pd.Categorical(scoring_data["feature"])
+        preds = self._score_data_with_cache(scoring_data, self.deployment_id)
+
+        # Keep track of the features already scored
+        self.scores = pd.concat(
+            [self.scores]
+            + [preds.loc[preds["feature"] == f, :].sort_values(by=f) for f in features]
+        )
+        self.features.extend(features)
+
+        return self.scores
+
     def get_feature_impact(self, n=None):
         """
         Get feature impact scores from the DataRobot model.
@@ -360,16 +479,11 @@ class PartialDependencePlot:
         two_way_pdp = pd.DataFrame()
 
         # Don't re-score rows if we don't need to
-        if feature_1 in self.features:
-            preds = self.scores.loc[self.scores["feature"] == feature_1, :].copy()
-
-        else:
+        if feature_1 not in self.features:
             # Create scoring dataset and make predictions
-            preds = self.create_and_score_data(self.df, feature_1, self.deployment_id)
+            self.create_and_score_features([feature_1])
 
-            # Keep track of the features already scored
-            self.scores = self.scores.append(preds)
-            self.features.append(feature_1)
+        preds = self.scores.loc[self.scores["feature"] == feature_1, :].copy()
 
         n = min(n, preds.shape[0])
         title = ""
@@ -507,7 +621,7 @@ class PartialDependencePlot:
                     ]
                 else:
                     preds_temp = preds.loc[preds[feature_2] == f, :]
-                ice_curves = ice_curves.append(preds_temp)
+                ice_curves = pd.concat([ice_curves, preds_temp])
 
                 m = min(n, preds_temp.shape[0])
                 for i in preds_temp["index"].unique()[0:m]:
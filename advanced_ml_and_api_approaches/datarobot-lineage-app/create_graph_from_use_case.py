@@ -1,9 +1,10 @@
 import argparse
-import copy
+from concurrent.futures import Future, ThreadPoolExecutor
 import itertools
+import json
 import os
 from pathlib import Path
-import pprint
+import threading
 
 import datarobot as dr
 from dotenv import load_dotenv
@@ -28,13 +29,58 @@ parser.add_argument(
 parser.add_argument(
     "--edge-output-file", help="json output of edges", default="dr_edges.json"
 )
+parser.add_argument(
+    "--max-workers",
+    help="maximum number of concurrent requests to DataRobot",
+    type=int,
+    default=8,
+)
+
+
+class Memo:
+    """
+    Request-scoped memo of the API calls made with `client`: every distinct
+    key is fetched once, even when several threads ask for it at the same
+    time, and later callers get the same result (or the same exception) back.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.lock = threading.Lock()
+        self.futures = {}
+
+    def __call__(self, key, fn, *args, **kwargs):
+        with self.lock:
+            future = self.futures.get(key)
+            owner = future is None
+            if owner:
+                future = self.futures[key] = Future()
+        if owner:
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+
+def get_json(memo, path, **params):
+    return memo(
+        (path, tuple(sorted(params.items()))),
+        lambda: memo.client.get(path, params=params or None).json(),
+    )
+
 
-client = dr.Client()
+def get_dataset(memo, dataset_id):
+    return memo(("Dataset", dataset_id), dr.Dataset.get, dataset_id)
 
 
-def get_datastore_node(datastore_id, use_case_id):
+def get_project(memo, pid):
+    return memo(("Project", pid), dr.Project.get, pid)
+
+
+def get_datastore_node(memo, datastore_id, use_case_id):
     try:
-        resp = client.get(f"externalDataStores/{datastore_id}").json()
+        resp = get_json(memo, f"externalDataStores/{datastore_id}")
         node = dict(
             assetId=datastore_id,
             label="datastore",
@@ -54,9 +100,9 @@ def get_datastore_node(datastore_id, use_case_id):
     return node
 
 
-def get_datasource_node(datasource_id, datastore_id, use_case_id):
+def get_datasource_node(memo, datasource_id, datastore_id, use_case_id):
     try:
-        resp = client.get(f"externalDataSources/{datasource_id}").json()
+        resp = get_json(memo, f"externalDataSources/{datasource_id}")
         name = resp["canonicalName"]
         datastore_id = (
             resp["params"]["dataStoreId"] if datastore_id is None else datastore_id
@@ -65,7 +111,7 @@ def get_datasource_node(datasource_id, datastore_id, use_case_id):
             assetId=datasource_id,
             name=name,
             label="datasource",
-            parents=[get_datastore_node(datastore_id, use_case_id)],
+            parents=[get_datastore_node(memo, datastore_id, use_case_id)],
             url=os.path.join(URL, "account", "data-connections"),
         )
     except Exception as e:
@@ -79,18 +125,18 @@ def get_datasource_node(datasource_id, datastore_id, use_case_id):
     return node
 
 
-def get_recipe_node(recipe_id, use_case_id):
-    resp = client.get(f"recipes/{recipe_id}").json()
+def get_recipe_node(memo, recipe_id, use_case_id):
+    resp = get_json(memo, f"recipes/{recipe_id}")
     inputs = resp["inputs"]
     parents = []
     for input in inputs:
         if input["inputType"] == "datasource":
             node = get_datasource_node(
-                input["dataSourceId"], input["dataStoreId"], use_case_id
+                memo, input["dataSourceId"], input["dataStoreId"], use_case_id
             )
         elif input["inputType"] == "dataset":
             node = get_dataset_node(
-                input["datasetId"], input["datasetVersionId"], use_case_id
+                memo, input["datasetId"], input["datasetVersionId"], use_case_id
             )
         parents.append(node)
     url = os.path.join(URL, "usecases", use_case_id, "wrangler", recipe_id)
@@ -99,26 +145,24 @@ def get_recipe_node(recipe_id, use_case_id):
     )
 
 
-def get_dataset_node(dataset_id, dataset_version_id=None, use_case_id=None):
+def get_dataset_node(memo, dataset_id, dataset_version_id=None, use_case_id=None):
     try:
         if dataset_version_id:
             pass
         else:
             print("no version id provided!! using latest version as default")
-            dataset = dr.Dataset.get(dataset_id)
+            dataset = get_dataset(memo, dataset_id)
             dataset_version_id = dataset.version_id
 
-        dataset = client.get(
-            f"datasets/{dataset_id}/versions/{dataset_version_id}"
-        ).json()
+        dataset = get_json(memo, f"datasets/{dataset_id}/versions/{dataset_version_id}")
         recipe_id = dataset.get("recipeId")
         datasource_id = dataset.get("dataSourceId")
         data_engine_query_id = dataset.get("dataEngineQueryId")
         parents = []
         if recipe_id is not None:
-            parents.append(get_recipe_node(recipe_id, use_case_id))
+            parents.append(get_recipe_node(memo, recipe_id, use_case_id))
         if datasource_id is not None:
-            parents.append(get_datasource_node(datasource_id, None, use_case_id))
+            parents.append(get_datasource_node(memo, datasource_id, None, use_case_id))
         if data_engine_query_id is not None:
             parents.append(
                 dict(label="dataEngineQueries", assetId=data_engine_query_id)
@@ -143,16 +187,16 @@ def get_dataset_node(dataset_id, dataset_version_id=None, use_case_id=None):
     return dataset_node
 
 
-def get_vectordatabase_node(vdb_id, use_case_id):
+def get_vectordatabase_node(memo, vdb_id, use_case_id):
     try:
-        vdb = dr.genai.VectorDatabase.get(vdb_id)
+        vdb = memo(("VectorDatabase", vdb_id), dr.genai.VectorDatabase.get, vdb_id)
         try:
-            dataset = dr.Dataset.get(vdb.dataset_id)
+            dataset = get_dataset(memo, vdb.dataset_id)
             dataset_version_id = (
                 dataset.version_id
             )  ## dataset version id is not available from vdb.
             dataset_node = get_dataset_node(
-                dataset.id, dataset_version_id, use_case_id=use_case_id
+                memo, dataset.id, dataset_version_id, use_case_id=use_case_id
             )
             url = os.path.join(URL, "usecases", use_case_id, "vector-databases", vdb.id)
             vdb_node = dict(
@@ -174,9 +218,9 @@ def get_vectordatabase_node(vdb_id, use_case_id):
         return None
 
 
-def get_project_node(pid, use_case_id):
+def get_project_node(memo, pid, use_case_id):
     try:
-        project = dr.Project.get(pid)
+        project = get_project(memo, pid)
         catalog_id = project.catalog_id
         label = "useCases" if catalog_id is None else "datasets"
         id = catalog_id if catalog_id else use_case_id
@@ -189,7 +233,7 @@ def get_project_node(pid, use_case_id):
             url=os.path.join(URL, "projects", project.id),
             datasouce="registry" if catalog_id else "local",
             parents=[
-                get_dataset_node(id, versionId, use_case_id),
+                get_dataset_node(memo, id, versionId, use_case_id),
                 #  dict(label="useCases", id = use_case_id)
             ],
         )
@@ -216,13 +260,12 @@ def get_model_node(dr_model, project_node):
         return None
 
 
-def get_model_nodes(pid, use_case_id):
+def get_model_nodes(memo, pid, use_case_id):
     try:
-        project = dr.Project.get(pid)
-        project_node = get_project_node(pid, use_case_id)
-        model_nodes = [
-            get_model_node(model, project_node) for model in project.get_model_records()
-        ]
+        project = get_project(memo, pid)
+        project_node = get_project_node(memo, pid, use_case_id)
+        model_records = memo(("ModelRecords", pid), project.get_model_records)
+        model_nodes = [get_model_node(model, project_node) for model in model_records]
         return model_nodes
     except Exception as e:
         print(e)
@@ -230,6 +273,7 @@ def get_model_nodes(pid, use_case_id):
 
 
 def get_custom_model_version_node(
+    memo,
     custom_model_id,
     custom_model_version_id=None,
     custom_model_version_label=None,
@@ -237,9 +281,9 @@ def get_custom_model_version_node(
 ):
     try:
         if custom_model_version_label:
-            custom_model_versions = client.get(
-                f"customModels/{custom_model_id}/versions"
-            ).json()
+            custom_model_versions = get_json(
+                memo, f"customModels/{custom_model_id}/versions"
+            )
             custom_model_version = [
                 cm
                 for cm in custom_model_versions["data"]
@@ -272,10 +316,10 @@ def get_custom_model_version_node(
         return None
 
 
-def get_registered_model_node(reg_model_id, reg_model_version_id, use_case_id):
-    reg_model_version = client.get(
-        f"registeredModels/{reg_model_id}/versions/{reg_model_version_id}"
-    ).json()
+def get_registered_model_node(memo, reg_model_id, reg_model_version_id, use_case_id):
+    reg_model_version = get_json(
+        memo, f"registeredModels/{reg_model_id}/versions/{reg_model_version_id}"
+    )
     url = os.path.join(
         URL,
         "registry",
@@ -287,9 +331,9 @@ def get_registered_model_node(reg_model_id, reg_model_version_id, use_case_id):
     )
     try:
         custom_model_id = reg_model_version["sourceMeta"]["customModelDetails"]["id"]
-        custom_model_versions = client.get(
-            f"customModels/{custom_model_id}/versions"
-        ).json()
+        custom_model_versions = get_json(
+            memo, f"customModels/{custom_model_id}/versions"
+        )
         custom_model_version = [
             cm
             for cm in custom_model_versions["data"]
@@ -297,7 +341,7 @@ def get_registered_model_node(reg_model_id, reg_model_version_id, use_case_id):
             == reg_model_version["sourceMeta"]["customModelDetails"]["versionLabel"]
         ].pop()
         custom_model_node = get_custom_model_version_node(
-            custom_model_id, custom_model_version["id"]
+            memo, custom_model_id, custom_model_version["id"]
         )
         node = dict(
             assetId=reg_model_id,
@@ -311,8 +355,13 @@ def get_registered_model_node(reg_model_id, reg_model_version_id, use_case_id):
     except Exception as e:
         project_id = reg_model_version["sourceMeta"]["projectId"]
         ## need to fix this so it returns an actual model node in the parents
-        dr_model = dr.Model.get(project_id, reg_model_version["modelId"])
-        project_node = get_project_node(project_id, use_case_id)
+        dr_model = memo(
+            ("Model", project_id, reg_model_version["modelId"]),
+            dr.Model.get,
+            project_id,
+            reg_model_version["modelId"],
+        )
+        project_node = get_project_node(memo, project_id, use_case_id)
         model_node = get_model_node(dr_model, project_node)
         node = dict(
             assetId=reg_model_id,
@@ -325,22 +374,22 @@ def get_registered_model_node(reg_model_id, reg_model_version_id, use_case_id):
         return node
 
 
-def get_deployment_node(dep_id, use_case_id):
+def get_deployment_node(memo, dep_id, use_case_id):
     try:
-        dep = dr.Deployment.get(dep_id)
+        dep = memo(("Deployment", dep_id), dr.Deployment.get, dep_id)
         cm = dep.model.get("custom_model_image")
         mp = dep.model_package
         reg_model_id = mp["registered_model_id"]
         reg_model_name = mp["name"]
         try:
-            reg_model_versions = client.get(
-                f"registeredModels/{reg_model_id}/versions"
-            ).json()["data"]
+            reg_model_versions = get_json(
+                memo, f"registeredModels/{reg_model_id}/versions"
+            )["data"]
             reg_model_version = [
                 v for v in reg_model_versions if v["name"] == reg_model_name
             ].pop()
             reg_model_node = get_registered_model_node(
-                reg_model_id, reg_model_version["id"], use_case_id
+                memo, reg_model_id, reg_model_version["id"], use_case_id
             )
         except Exception as e:
             print(e)
@@ -364,10 +413,10 @@ def get_llm_node(llm_id):
     return llm_node
 
 
-def get_llm_blueprint_nodes(playground_id, use_case_id):
-    llm_blueprints = client.get(
-        "genai/llmBlueprints/", params={"playgroundId": playground_id}
-    ).json()["data"]
+def get_llm_blueprint_nodes(memo, playground_id, use_case_id):
+    llm_blueprints = get_json(memo, "genai/llmBlueprints/", playgroundId=playground_id)[
+        "data"
+    ]
     temp = []
     for llm_bp in llm_blueprints:
         url = os.path.join(
@@ -385,7 +434,7 @@ def get_llm_blueprint_nodes(playground_id, use_case_id):
             name=llm_bp["name"],
             url=url,
             parents=[
-                get_vectordatabase_node(llm_bp["vectorDatabaseId"], use_case_id),
+                get_vectordatabase_node(memo, llm_bp["vectorDatabaseId"], use_case_id),
                 get_llm_node(llm_bp["llmId"]),
                 dict(
                     assetId=playground_id,
@@ -406,9 +455,6 @@ def get_llm_blueprint_nodes(playground_id, use_case_id):
     return temp
 
 
-import pprint
-
-
 def define_id(node, parents):
     node_id = node["assetId"]
     parents = [p for p in parents if p]
@@ -425,58 +471,108 @@ def define_id(node, parents):
         pass
 
 
-if __name__ == "__main__":
-    args = parser.parse_args()
-
-    use_case_id = args.use_case_id
-    node_output_file = args.node_output_file
-    edge_output_file = args.edge_output_file
-
-    applications = client.get(f"useCases/{use_case_id}/applications").json()
-    customApplications = client.get(f"useCases/{use_case_id}/customApplications").json()
-    data = client.get(f"useCases/{use_case_id}/data").json()
-    datasets = client.get(f"useCases/{use_case_id}/datasets").json()
-    deployments = client.get(f"useCases/{use_case_id}/deployments").json()
-    notebooks = client.get(f"useCases/{use_case_id}/notebooks").json()
-    playgrounds = client.get(f"useCases/{use_case_id}/playgrounds").json()
-    projects = client.get(f"useCases/{use_case_id}/projects").json()
-    registeredModels = client.get(f"useCases/{use_case_id}/registeredModels").json()
-    vector_databases = client.get(f"useCases/{use_case_id}/vectorDatabases").json()
-    shared_roles = client.get(f"useCases/{use_case_id}/sharedRoles").json()
-    recipes = {"data": []}
-    for d in data["data"]:
-        if d["entityType"] == "RECIPE":
-            resp = client.get(f"recipes/{d['entityId']}").json()
-            recipes["data"].append(resp)
-
-    dataset_nodes = [
-        get_dataset_node(d["datasetId"], d["versionId"], use_case_id)
-        for d in datasets["data"]
-    ]
-    recipe_nodes = [
-        get_recipe_node(r["recipeId"], use_case_id) for r in recipes["data"]
-    ]
-    deployment_nodes = [
-        get_deployment_node(d["id"], use_case_id) for d in deployments["data"]
-    ]
-    vdb_nodes = [
-        get_vectordatabase_node(d["id"], use_case_id) for d in vector_databases["data"]
-    ]
-    project_nodes = [
-        get_project_node(d["projectId"], use_case_id) for d in projects["data"]
-    ]
-    model_nodes = [
-        get_model_nodes(d["projectId"], use_case_id) for d in projects["data"]
-    ]
-    registered_model_nodes = []
-    for m in registeredModels["data"]:
-        for v in m["versions"]:
-            registered_model_nodes.append(
-                get_registered_model_node(m["id"], v["id"], use_case_id)
+def define_ids(nodes):
+    """
+    define_id for every node and all of its ancestors in a single pass,
+    visiting each node object once.
+    """
+    visited = set()
+    stack = list(reversed(nodes))
+    while stack:
+        node = stack.pop()
+        if id(node) in visited:
+            continue
+        visited.add(id(node))
+        define_id(node, [])
+        parents = [p for p in node.get("parents", []) if p and p.get("assetId")]
+        stack.extend(reversed(parents))
+
+
+USE_CASE_ASSETS = [
+    "data",
+    "datasets",
+    "deployments",
+    "playgrounds",
+    "projects",
+    "registeredModels",
+    "vectorDatabases",
+]
+
+
+def build_graph(use_case_id, max_workers=8, client=None):
+    """
+    Crawl a use case and return its (nodes, edges).
+
+    Asset fetches run on a pool of `max_workers` threads. Every API call goes
+    through a memo that is created for this call of build_graph and passed to
+    the get_* helpers, so assets shared between several parents are only
+    requested once. `client` defaults to dr.Client().
+    """
+    memo = Memo(dr.Client() if client is None else client)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        listings = dict(
+            zip(
+                USE_CASE_ASSETS,
+                executor.map(
+                    lambda asset: get_json(memo, f"useCases/{use_case_id}/{asset}"),
+                    USE_CASE_ASSETS,
+                ),
             )
-    llm_bp_llm_nodes = [
-        get_llm_blueprint_nodes(d["id"], use_case_id) for d in playgrounds["data"]
-    ]
+        )
+        recipes = {
+            "data": list(
+                executor.map(
+                    lambda d: get_json(memo, f"recipes/{d['entityId']}"),
+                    [
+                        d
+                        for d in listings["data"]["data"]
+                        if d["entityType"] == "RECIPE"
+                    ],
+                )
+            )
+        }
+
+        # Submitted in the order nodes appear in the output; each future
+        # resolves to a list of nodes
+        def single(fn, *args):
+            return executor.submit(lambda: [fn(memo, *args)])
+
+        futures = []
+        futures += [
+            single(get_dataset_node, d["datasetId"], d["versionId"], use_case_id)
+            for d in listings["datasets"]["data"]
+        ]
+        futures += [
+            single(get_recipe_node, r["recipeId"], use_case_id) for r in recipes["data"]
+        ]
+        futures += [
+            single(get_vectordatabase_node, d["id"], use_case_id)
+            for d in listings["vectorDatabases"]["data"]
+        ]
+        futures += [
+            single(get_project_node, d["projectId"], use_case_id)
+            for d in listings["projects"]["data"]
+        ]
+        futures += [
+            executor.submit(get_model_nodes, memo, d["projectId"], use_case_id)
+            for d in listings["projects"]["data"]
+        ]
+        futures += [
+            single(get_registered_model_node, m["id"], v["id"], use_case_id)
+            for m in listings["registeredModels"]["data"]
+            for v in m["versions"]
+        ]
+        futures += [
+            single(get_deployment_node, d["id"], use_case_id)
+            for d in listings["deployments"]["data"]
+        ]
+        futures += [
+            executor.submit(get_llm_blueprint_nodes, memo, d["id"], use_case_id)
+            for d in listings["playgrounds"]["data"]
+        ]
+        nodes = list(itertools.chain.from_iterable(f.result() for f in futures))
+
     playground_nodes = [
         dict(
             assetId=p["id"],
@@ -486,110 +582,69 @@ if __name__ == "__main__":
             ),
             parents=[],
         )
-        for p in playgrounds["data"]
+        for p in listings["playgrounds"]["data"]
     ]
-    model_nodes = list(itertools.chain(*model_nodes))
-    llm_bp_llm_nodes = list(itertools.chain(*llm_bp_llm_nodes))
-
-    nodes = []
-    nodes.extend(dataset_nodes)
-    nodes.extend(recipe_nodes)
-    nodes.extend(vdb_nodes)
-    nodes.extend(project_nodes)
-    nodes.extend(model_nodes)
-    nodes.extend(registered_model_nodes)
-    nodes.extend(deployment_nodes)
-    nodes.extend(llm_bp_llm_nodes)
     nodes.extend(playground_nodes)
 
     nodes = [n for n in nodes if n]
-
-    for i, node in enumerate(nodes):
-        define_id(node, node.get("parents", []))
-        nodes[i] = node
-
-    for node in nodes:
-        if node.get("versionId"):
-            pass
-        else:
-            try:
-                del node["versionId"]
-            except:
-                pass
-    for node in nodes:
-        for parent in node.get("parents", []):
-            if parent:
-                if parent.get("parentVersionId"):
-                    pass
-                else:
-                    try:
-                        del parent["parentVersionId"]
-                    except:
-                        pass
+    define_ids(nodes)
 
     for node in nodes:
         parents = node.get("parents", [])
         parents = [p for p in parents if p is not None]
         parents = [p for p in parents if p.get("assetId") is not None]
         node["parents"] = parents
-
-    # print( f"length of datasets in node list is { len([d for d in nodes if d['label'] == 'datasets'])}")
-    node_ids = [n["id"] for n in nodes]
-
-    for node in nodes:
         node["color"] = "red"
 
-    def add_parents_as_nodes(node, parents):
+    # Ancestors become nodes too, the first time their id is seen
+    node_ids = {n["id"] for n in nodes}
+    visited = set()
+
+    def add_parents_as_nodes(parents):
         for parent in parents:
-            if parent is not None:
-                if id := parent.get("id"):
-                    if id in node_ids:
-                        # print("parent already in node id list")
-                        # print(parent)
-                        pass
-                    else:
-                        # print("parent NOT already in node id list")
-                        # print(parent)
-                        nodes.append(parent)
-                        node_ids.append(id)
-                add_parents_as_nodes(parent, parent.get("parents", []))
-
-    nodes_copy = copy.deepcopy(nodes)
-
-    for node in nodes_copy:
-        add_parents_as_nodes(node, node.get("parents", []))
+            if parent is None or id(parent) in visited:
+                continue
+            visited.add(id(parent))
+            if (parent_id := parent.get("id")) and parent_id not in node_ids:
+                nodes.append(parent)
+                node_ids.add(parent_id)
+            add_parents_as_nodes(parent.get("parents", []))
+
+    for node in list(nodes):
+        add_parents_as_nodes(node.get("parents", []))
 
     edges = []
     for node in nodes:
-        parents = node.get("parents", [])
-        parents = [] if parents is None else parents
-        for parent in parents:
+        for parent in node.get("parents") or []:
             try:
                 edges.append({"from": parent["id"], "to": node["id"]})
-            except Exception as e:
+            except (KeyError, TypeError):
                 pass
 
-    for node in nodes:
-        if node["assetId"] == "66683da40019e72defbc4dce":
-            pprint.pprint(node)
+    # Only keep one level of parents on each node in the output
+    def without_grandparents(parent):
+        if isinstance(parent, dict):
+            return {k: v for k, v in parent.items() if k != "parents"}
+        return parent
+
+    nodes = [
+        (
+            {**node, "parents": [without_grandparents(p) for p in node["parents"]]}
+            if node.get("parents")
+            else dict(node)
+        )
+        for node in nodes
+    ]
+    return nodes, edges
 
-    # nodes_deep_copy = []
-    for i, node in enumerate(nodes):
-        nodes[i] = copy.deepcopy(node)
-    for node in nodes:
-        parents = node.get("parents", [])
-        for parent in parents:
-            try:
-                del parent["parents"]
-            except Exception as e:
-                pass
 
-    import json
+if __name__ == "__main__":
+    args = parser.parse_args()
 
-    with open(os.path.join(script_path, node_output_file), "w") as f:
-        f.write(json.dumps(nodes))
+    nodes, edges = build_graph(args.use_case_id, max_workers=args.max_workers)
 
-    import json
+    with open(os.path.join(script_path, args.node_output_file), "w") as f:
+        f.write(json.dumps(nodes))
 
-    with open(os.path.join(script_path, edge_output_file), "w") as f:
+    with open(os.path.join(script_path, args.edge_output_file), "w") as f:
         f.write(json.dumps(edges))
@@ -0,0 +1,113 @@
+"""
+build_graph against recorded DataRobot responses
+
+recorded_use_case/responses.json holds the REST responses and the SDK objects
+of a small use case: datasets, recipes sharing datasources, projects with
+models, registered model versions, deployments and playgrounds, plus assets
+that fail to load. RecordedAPI serves them as the REST client and in place of
+the SDK getters, raises a 404 for anything that was not recorded and counts
+every fetch. dr_nodes.json and dr_edges.json next to the responses were
+written by the serial crawler that build_graph replaced. Run with
+`python -m pytest` from this folder.
+"""
+
+from collections import Counter
+import json
+from pathlib import Path
+import threading
+import time
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+import datarobot as dr
+import pytest
+
+from create_graph_from_use_case import build_graph
+
+RECORDED = Path(__file__).parent / "recorded_use_case"
+
+
+class RecordedAPI:
+    def __init__(self, recorded, latency=0.0):
+        self.recorded = recorded
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.fetches = Counter()
+
+    def fetch(self, kind, key):
+        with self.lock:
+            self.fetches[kind, key] += 1
+        time.sleep(self.latency)
+        try:
+            return self.recorded[kind][key]
+        except KeyError:
+            raise dr.errors.ClientError(f"404 client error: {kind} {key}", 404)
+
+    def get(self, path, params=None):
+        if params:
+            path += "?" + urlencode(params)
+        data = self.fetch("rest", path)
+        return SimpleNamespace(json=lambda: data)
+
+    def sdk_object(self, kind, key):
+        return SimpleNamespace(**self.fetch(kind, key))
+
+    def project(self, pid):
+        project = self.sdk_object("Project", pid)
+        project.get_model_records = lambda: [
+            SimpleNamespace(**self.recorded["Model"][model_id])
+            for model_id in self.fetch("ModelRecords", pid)
+        ]
+        return project
+
+
+@pytest.fixture
+def api(monkeypatch):
+    api = RecordedAPI(json.loads((RECORDED / "responses.json").read_text()))
+    monkeypatch.setattr(dr.Dataset, "get", lambda i: api.sdk_object("Dataset", i))
+    monkeypatch.setattr(dr.Project, "get", api.project)
+    monkeypatch.setattr(dr.Model, "get", lambda pid, i: api.sdk_object("Model", i))
+    monkeypatch.setattr(dr.Deployment, "get", lambda i: api.sdk_object("Deployment", i))
+    monkeypatch.setattr(
+        dr.genai.VectorDatabase, "get", lambda i: api.sdk_object("VectorDatabase", i)
+    )
+    return api
+
+
+def as_json(value):
+    return json.loads(json.dumps(value))
+
+
+def test_graph_matches_the_recorded_output(api):
+    nodes, edges = build_graph("uc1", client=api)
+
+    assert as_json(nodes) == json.loads((RECORDED / "dr_nodes.json").read_text())
+    assert as_json(edges) == json.loads((RECORDED / "dr_edges.json").read_text())
+    assert (len(nodes), len(edges)) == (46, 45)
+
+
+def test_every_asset_is_fetched_once(api):
+    api.latency = 0.01
+
+    build_graph("uc1", max_workers=8, client=api)
+
+    assert api.fetches
+    assert max(api.fetches.values()) == 1
+    # shared by several recipes, datasets and registered models
+    for shared in [
+        ("rest", "externalDataStores/store0"),
+        ("rest", "externalDataSources/src1"),
+        ("Project", "p0"),
+        ("VectorDatabase", "vdb0"),
+    ]:
+        assert api.fetches[shared] == 1, shared
+
+
+def test_each_graph_starts_with_an_empty_memo(api):
+    first = build_graph("uc1", client=api)
+    fetches = api.fetches.copy()
+
+    second = build_graph("uc1", client=api)
+
+    assert as_json(second) == as_json(first)
+    assert api.fetches == fetches + fetches
@@ -0,0 +1,98 @@
+"""
+Benchmark graph parsing and batching of the GIN custom task on CPU
+
+Generates small synthetic fraud graphs (2-12 nodes, 1-20 edges, 100k by
+default) as JSON rows and times, for the previous path and the current one:
+turning the graph column into per-row graph data (a pickled DGLGraph per row,
+then graph_2_dgl's edge arrays from parse_edge_lists), and building the
+batched graphs of every DataLoader batch (dgl.batch over the unpickled
+graphs, then build_batched_graph). Every batch is checked to have the same
+structure on both paths.
+
+Usage:
+    python benchmark_custom.py [--graphs 100000] [--batch-size 1024]
+"""
+
+import argparse
+import json
+import pickle
+import random
+import time
+
+import dgl
+import pandas as pd
+import torch
+
+from custom import build_batched_graph, graph_2_dgl
+
+
+def make_graphs(n_graphs, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n_graphs):
+        n_nodes = rng.randint(2, 12)
+        edges = [
+            [rng.randrange(n_nodes), rng.randrange(n_nodes)]
+            for _ in range(rng.randint(1, 20))
+        ]
+        rows.append(json.dumps({"vertices": list(range(n_nodes)), "edges": edges}))
+    return pd.DataFrame({"graph": rows})
+
+
+def previous_graph(row):
+    """The previous per-row conversion of graph_2_dgl"""
+    edges = json.loads(row).get("edges", [])
+    num_nodes = max(max(u, v) for u, v in edges) + 1 if edges else 0
+    src, dst = zip(*edges) if edges else ([], [])
+    g = dgl.graph((torch.tensor(src), torch.tensor(dst)), num_nodes=num_nodes)
+    return pickle.dumps(g)
+
+
+def same_structure(expected, batched):
+    return all(
+        torch.equal(a, b)
+        for a, b in [
+            *zip(expected.edges(), batched.edges()),
+            (expected.batch_num_nodes(), batched.batch_num_nodes()),
+            (expected.batch_num_edges(), batched.batch_num_edges()),
+        ]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--graphs", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    data = make_graphs(args.graphs)
+    print(f"{args.graphs} graphs, batches of {args.batch_size}")
+
+    start = time.perf_counter()
+    pickled = data["graph"].apply(previous_graph).tolist()
+    previous_parse = time.perf_counter() - start
+
+    start = time.perf_counter()
+    edges = graph_2_dgl(data.copy(), "graph")["dgl_graph"].tolist()
+    parse = time.perf_counter() - start
+
+    previous_batch = batch = 0.0
+    for first in range(0, args.graphs, args.batch_size):
+        start = time.perf_counter()
+        expected = dgl.batch(
+            [pickle.loads(g) for g in pickled[first : first + args.batch_size]]
+        )
+        previous_batch += time.perf_counter() - start
+
+        start = time.perf_counter()
+        batched = build_batched_graph(edges[first : first + args.batch_size])
+        batch += time.perf_counter() - start
+        assert same_structure(expected, batched)
+
+    print("step             previous s  current s")
+    print(f"parse            {previous_parse:<11.2f} {parse:.2f}")
+    print(f"batch            {previous_batch:<11.2f} {batch:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,14 +15,13 @@ Authors
     - Timothy Whittaker <timothy.whittaker@datarobot.com>
 """
 
-
 import json
 from pathlib import Path
-import pickle
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from GIN_model import GIN
 import dgl
+import numpy as np
 import pandas as pd
 import torch
 from torch.utils.data import DataLoader
@@ -33,9 +32,74 @@ from torch.utils.data import DataLoader
 DGL_COLUMN_NAME = "dgl_graph"
 
 
+# an "edges" list of integer (u, v) pairs, e.g. "edges": [[0, 1], [1, 2]]
+EDGES_PATTERN = r'"edges"\s*:\s*(\[\s*(?:\[\s*-?\d+\s*,\s*-?\d+\s*\]\s*,?\s*)*\])'
+
+
+def _parse_edge_list_json(row: str) -> np.ndarray:
+    try:
+        graph_dict = json.loads(row)  # Ensure valid JSON
+        edges = graph_dict.get("edges", [])
+        if not isinstance(edges, list):
+            raise ValueError("Invalid edges format. Expected a list of (u, v) tuples.")
+        return np.array(edges, dtype=np.int64).reshape(-1, 2)
+    except Exception as e:
+        raise ValueError(f"Error processing graph row: {e}")
+
+
+def parse_edge_lists(graphs: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parses the edge lists of a column of JSON graphs into CSR-style arrays.
+
+    Edge lists are extracted from the whole column at once with a regular
+    expression; rows it does not match are parsed with json.
+
+    Parameters
+    ----------
+    graphs : pd.Series
+        Column of JSON strings, each with an "edges" list of (u, v) pairs.
+
+    Returns
+    -------
+    np.ndarray
+        Edge offsets of shape (n_graphs + 1,); the edges of graph i are
+        edges[offsets[i]:offsets[i + 1]].
+    np.ndarray
+        Concatenated (u, v) node ids of all graphs, of shape (n_edges, 2).
+
+    Raises
+    ------
+    ValueError
+        If the data format is invalid.
+    """
+    graphs = graphs.astype(str).reset_index(drop=True)
+    edge_text = graphs.str.extract(EDGES_PATTERN, expand=False)
+    matched = edge_text.notna().to_numpy()
+
+    num_edges = np.zeros(len(graphs), dtype=np.int64)
+    num_edges[matched] = edge_text[matched].str.count(r"\[").to_numpy() - 1
+    numbers = " ".join(edge_text[matched]).translate(str.maketrans("[],", "   "))
+    matched_edges = np.fromstring(numbers, dtype=np.int64, sep=" ")
+
+    fallback = {i: _parse_edge_list_json(graphs[i]) for i in np.flatnonzero(~matched)}
+    for i, edges in fallback.items():
+        num_edges[i] = len(edges)
+
+    offsets = np.concatenate([[0], np.cumsum(num_edges)])
+    edges = np.empty((offsets[-1], 2), dtype=np.int64)
+    if fallback:
+        row_of_edge = np.repeat(matched, num_edges)
+        edges[row_of_edge] = matched_edges.reshape(-1, 2)
+        for i, row_edges in fallback.items():
+            edges[offsets[i] : offsets[i + 1]] = row_edges
+    else:
+        edges[:] = matched_edges.reshape(-1, 2)
+    return offsets, edges
+
+
 def graph_2_dgl(df: pd.DataFrame, graph_col: str) -> pd.DataFrame:
     """
-    Converts a DataFrame with JSON-like graph data into a DataFrame with serialized DGL graphs.
+    Converts a DataFrame with JSON-like graph data into a DataFrame with graph edge arrays.
 
     Parameters
     ----------
@@ -47,7 +111,9 @@ def graph_2_dgl(df: pd.DataFrame, graph_col: str) -> pd.DataFrame:
     Returns
     -------
     pd.DataFrame
-        DataFrame with a new column 'dgl_graph' containing Pickle-serialized DGLGraph objects.
+        DataFrame with a new column 'dgl_graph' holding, for each graph, an
+        (n_edges, 2) array of its edges. The arrays are views into one
+        contiguous buffer; `build_batched_graph` turns them into DGL graphs.
 
     Raises
     ------
@@ -59,30 +125,78 @@ def graph_2_dgl(df: pd.DataFrame, graph_col: str) -> pd.DataFrame:
             f"Missing required column '{graph_col}'. Available columns: {list(df.columns)}."
         )
 
-    def process_row(row: str) -> bytes:
-        try:
-            graph_dict = json.loads(row)  # Ensure valid JSON
-            edges = graph_dict.get("edges", [])
-            if not isinstance(edges, list):
-                raise ValueError(
-                    "Invalid edges format. Expected a list of (u, v) tuples."
-                )
+    offsets, edges = parse_edge_lists(df[graph_col])
+    df[DGL_COLUMN_NAME] = pd.Series(
+        np.split(edges, offsets[1:-1]), index=df.index, dtype=object
+    )
+
+    return df.drop(columns=[graph_col])
+
+
+def node_features(src: np.ndarray, dst: np.ndarray, num_nodes: int) -> torch.Tensor:
+    """
+    Computes the node features, the degree (in + out) of each node.
+
+    Parameters
+    ----------
+    src, dst : np.ndarray
+        Source and destination node ids of the edges.
+    num_nodes : int
+        Total number of nodes.
 
-            num_nodes = max(max(u, v) for u, v in edges) + 1 if edges else 0
-            src, dst = zip(*edges) if edges else ([], [])
+    Returns
+    -------
+    torch.Tensor
+        Node features of shape (num_nodes, 1).
+    """
+    degree = np.bincount(src, minlength=num_nodes) + np.bincount(
+        dst, minlength=num_nodes
+    )
+    return torch.from_numpy(degree.astype(np.float32)).reshape(-1, 1)
 
-            g = dgl.graph((torch.tensor(src), torch.tensor(dst)), num_nodes=num_nodes)
-            g.ndata["attr"] = torch.rand(
-                num_nodes, 1
-            )  # TODO: Replace with actual node features if available
 
-            return pickle.dumps(g)
-        except Exception as e:
-            raise ValueError(f"Error processing graph row: {e}")
+def build_batched_graph(graph_edges: List[np.ndarray]) -> dgl.DGLGraph:
+    """
+    Builds one batched DGL graph directly from the edge arrays of several graphs.
 
-    df[DGL_COLUMN_NAME] = df[graph_col].apply(process_row)
+    Node ids of each graph are shifted by the number of nodes of the graphs
+    before it. A graph has max(u, v) + 1 nodes, or none if it has no edges.
 
-    return df.drop(columns=[graph_col])
+    Parameters
+    ----------
+    graph_edges : list of np.ndarray
+        Edge arrays of shape (n_edges, 2), as stored by `graph_2_dgl`.
+
+    Returns
+    -------
+    dgl.DGLGraph
+        The batched graph, with node features in ndata["attr"].
+    """
+    num_edges = np.fromiter(
+        map(len, graph_edges), dtype=np.int64, count=len(graph_edges)
+    )
+    edges = (
+        np.concatenate(graph_edges).reshape(-1, 2)
+        if num_edges.sum()
+        else np.empty((0, 2), dtype=np.int64)
+    )
+
+    num_nodes = np.zeros(len(graph_edges), dtype=np.int64)
+    non_empty = num_edges > 0
+    if non_empty.any():
+        starts = (np.cumsum(num_edges) - num_edges)[non_empty]
+        num_nodes[non_empty] = np.maximum.reduceat(edges.max(axis=1), starts) + 1
+
+    node_offsets = np.repeat(np.cumsum(num_nodes) - num_nodes, num_edges)
+    src = edges[:, 0] + node_offsets
+    dst = edges[:, 1] + node_offsets
+    total_nodes = int(num_nodes.sum())
+
+    g = dgl.graph((torch.from_numpy(src), torch.from_numpy(dst)), num_nodes=total_nodes)
+    g.set_batch_num_nodes(torch.from_numpy(num_nodes))
+    g.set_batch_num_edges(torch.from_numpy(num_edges))
+    g.ndata["attr"] = node_features(src, dst, total_nodes)
+    return g
 
 
 def graph_column_selector(dataframe: pd.DataFrame, graph_column_type: Any) -> str:
@@ -131,14 +245,14 @@ def graph_column_selector(dataframe: pd.DataFrame, graph_column_type: Any) -> st
     raise ValueError("No suitable graph column found.")
 
 
-def collate(samples: List[Any]) -> Tuple[dgl.DGLGraph, torch.Tensor]:
+def collate(samples: List[Any]) -> Tuple[dgl.DGLGraph, Optional[torch.Tensor]]:
     """
-    Collate function for DGL graphs, handling both labeled and unlabeled data.
+    Collate function for graph edge arrays, handling both labeled and unlabeled data.
 
     Parameters
     ----------
     samples : list
-        A list of tuples (graph, label) for labeled data or a list of graphs for unlabeled data.
+        A list of tuples (edges, label) for labeled data or a list of edge arrays for unlabeled data.
 
     Returns
     -------
@@ -152,11 +266,11 @@ def collate(samples: List[Any]) -> Tuple[dgl.DGLGraph, torch.Tensor]:
 
     if isinstance(samples[0], tuple):  # Labeled data
         graphs, labels = map(list, zip(*samples))
-        batched_graph = dgl.batch(graphs)
+        batched_graph = build_batched_graph(graphs)
         batched_labels = torch.tensor(labels)
         return batched_graph, batched_labels
     else:  # Unlabeled data
-        return dgl.batch(samples), None
+        return build_batched_graph(samples), None
 
 
 # Section: DataRobot Custom Models Hooks
@@ -205,7 +319,7 @@ def transform(data: pd.DataFrame, model: Any) -> pd.DataFrame:
     Returns
     -------
     pd.DataFrame
-        Transformed DataFrame with a serialized DGL graph column.
+        Transformed DataFrame with a graph edge array column.
     """
     graph_column = graph_column_selector(
         data, "str"
@@ -222,7 +336,7 @@ def fit(
     Parameters
     ----------
     X : pd.DataFrame
-        DataFrame containing the input data with serialized DGL graphs.
+        DataFrame containing the input data with graph edge arrays.
     y : pd.Series
         Series containing the labels for the input data.
     output_dir : str
@@ -236,10 +350,7 @@ def fit(
         If the output directory does not exist or is not a directory.
     """
     # Create datasets and dataloaders
-    train_dataset = [
-        (pickle.loads(graph_pickle), label)
-        for graph_pickle, label in zip(X[DGL_COLUMN_NAME], y)
-    ]
+    train_dataset = list(zip(X[DGL_COLUMN_NAME], y))
     train_loader = DataLoader(
         train_dataset, batch_size=8, shuffle=True, collate_fn=collate
     )
@@ -279,7 +390,7 @@ def score(data: pd.DataFrame, model: Any, **kwargs: Dict[str, Any]) -> pd.DataFr
     Parameters
     ----------
     data : pd.DataFrame
-        DataFrame containing the input data with serialized DGL graphs.
+        DataFrame containing the input data with graph edge arrays.
     model : Any
         The trained model object.
     **kwargs : dict
@@ -290,16 +401,14 @@ def score(data: pd.DataFrame, model: Any, **kwargs: Dict[str, Any]) -> pd.DataFr
     pd.DataFrame
         DataFrame with two columns representing the probabilities for each class.
     """
-    # Select the column containing serialized DGL graphs
+    # Select the column containing the graph edge arrays
     dgl_column = "dgl_graph"
 
-    # Create dataset for prediction (no labels)
-    prediction_dataset = [
-        pickle.loads(graph_pickle)
-        for graph_pickle in data[dgl_column]  # Deserialize each graph
-    ]
+    # Create dataset for prediction (no labels). The model is in eval mode, so
+    # the batch size does not change the predictions, only the speed.
+    prediction_dataset = list(data[dgl_column])
     prediction_loader = DataLoader(
-        prediction_dataset, batch_size=8, shuffle=False, collate_fn=collate
+        prediction_dataset, batch_size=1024, shuffle=False, collate_fn=collate
     )
 
     # Make the prediction
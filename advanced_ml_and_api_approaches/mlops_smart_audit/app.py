@@ -1,4 +1,3 @@
-import concurrent.futures
 import json
 import math
 import os
@@ -8,12 +7,16 @@ import pandas as pd
 import requests
 import streamlit as st
 
+from deployment_audit import AUDIT_TTL, AuditStore, audit_deployments
+
 # --------------------------------------------------
 # ENV VARS & CLIENT INIT
 # --------------------------------------------------
 DATAROBOT_API_TOKEN = os.environ["DATAROBOT_API_TOKEN"]
 DATAROBOT_ENDPOINT = os.environ["DATAROBOT_ENDPOINT"]
 client = dr.Client(token=DATAROBOT_API_TOKEN, endpoint=DATAROBOT_ENDPOINT)
+# Per-deployment audit results, reused across reruns and app restarts
+audit_store = AuditStore()
 
 
 # Enable or disable LLM-based capabilities
@@ -185,387 +188,6 @@ def get_all_deployments(deployment_id=None):
             return []
 
 
-def data_drift(deployment_id):
-    """
-    Checks whether data drift tracking (target or feature) is enabled.
-    """
-    try:
-        deployment = dr.Deployment.get(deployment_id)
-        drift_settings = deployment.get_drift_tracking_settings()
-        target_drift_enabled = drift_settings.get("target_drift", {}).get(
-            "enabled", False
-        )
-        feature_drift_enabled = drift_settings.get("feature_drift", {}).get(
-            "enabled", False
-        )
-        return target_drift_enabled or feature_drift_enabled
-    except Exception:
-        return False
-
-
-def accuracy_monitoring(deployment_id):
-    """
-    Checks whether accuracy monitoring is configured for the deployment by looking
-    at the association ID settings.
-    """
-    try:
-        deployment = dr.Deployment.get(deployment_id)
-        association_id_settings = deployment.get_association_id_settings()
-        columns_set = association_id_settings.get("column_names", [])
-        required_in_requests = association_id_settings.get(
-            "required_in_prediction_requests", False
-        )
-        return bool(columns_set or required_in_requests)
-    except Exception:
-        return False
-
-
-def notifications(deployment_id):
-    """
-    Checks whether at least one notification policy exists for the deployment.
-    """
-    try:
-        url = f"entityNotificationPolicies/deployment/{deployment_id}/"
-        params = {"offset": 0, "limit": 100}
-        response = client.get(url, params=params)
-        # If status code is 200 and "data" array is non-empty, there is at least one notification policy
-        if response.status_code == 200:
-            data = response.json().get("data", [])
-            return len(data) > 0
-        return False
-    except Exception:
-        return False
-
-
-def monitoring_job(deployment_id):
-    """
-    Function to check if there is a monitoring job for a deployment
-    """
-    monitoring_jobs = dr.BatchMonitoringJobDefinition.list()
-    return any(
-        getattr(job, "batch_monitoring_job", {}).get("deployment_id") == deployment_id
-        for job in monitoring_jobs
-    )
-
-
-def challenger_model(deployment_id):
-    """
-    Checks if there is at least one challenger model attached to the deployment.
-    """
-    try:
-        url = f"deployments/{deployment_id}/challengers/"
-        response = client.get(url)
-        if response.status_code == 200:
-            data = response.json().get("data", [])
-            return len(data) > 0
-        return False
-    except Exception:
-        return False
-
-
-def retraining_policy(deployment_id):
-    """
-    Checks if there is a retraining policy for the deployment.
-    """
-    try:
-        url = f"deployments/{deployment_id}/retrainingPolicies/"
-        response = client.get(url)
-        if response.status_code == 200:
-            count = response.json().get("count", 0)
-            return count > 0
-        return False
-    except Exception:
-        return False
-
-
-def custom_metric(deployment_id):
-    """
-    Checks if there is at least one custom metric attached to the deployment.
-    """
-    try:
-        url = f"deployments/{deployment_id}/customMetrics/"
-        response = client.get(url)
-        if response.status_code == 200:
-            data = response.json().get("data", [])
-            return len(data) > 0
-        return False
-    except Exception:
-        return False
-
-
-def segment_analysis(deployment_id):
-    """
-    Checks if segment analysis is enabled for the deployment.
-    """
-    try:
-        deployment = dr.Deployment.get(deployment_id)
-        segment_analysis_settings = deployment.get_segment_analysis_settings()
-        return segment_analysis_settings.get("enabled", False)
-    except Exception:
-        return False
-
-
-def humility(deployment_id):
-    """
-    Checks if humility is enabled for the deployment.
-    """
-    try:
-        url = f"deployments/{deployment_id}/"
-        response = client.get(url)
-        if response.status_code == 200:
-            settings = response.json().get("settings", {})
-            return settings.get("humbleAiEnabled", False)
-        return False
-    except Exception:
-        return False
-
-
-def fairness(deployment_id):
-    """
-    Checks if fairness/bias monitoring is enabled for the deployment.
-    """
-    try:
-        deployment = dr.Deployment.get(deployment_id)
-        fairness_settings = deployment.get_bias_and_fairness_settings()
-        if fairness_settings is None:
-            return False
-        protected_features = fairness_settings.get("protected_features", [])
-        fairness_metric_set = fairness_settings.get("fairness_metric_set", None)
-        return bool(protected_features or fairness_metric_set)
-    except Exception:
-        return False
-
-
-def compliance_report(deployment_id):
-    """
-    Checks if a MODEL_COMPLIANCE document has been generated (i.e., previously created)
-    for the currently active model package used by the given deployment.
-
-    It calls the /api/v2/automatedDocuments endpoint, filtering by:
-      - entityId = model_package['id']
-
-    Returns True if one or more matching documents exist, otherwise False.
-    """
-    try:
-        # Get the deployment object
-        deployment = dr.Deployment.get(deployment_id)
-        # Retrieve the "model package" ID (the model in the registry)
-        model_id = deployment.model_package.get("id")
-        if not model_id:
-            return False
-        # Build the endpoint URL (note the /api/v2/automatedDocuments path)
-        url = "automatedDocuments"
-
-        # Include filters in query parameters:
-        # - entityId=<model_id> (the model for which compliance documents are generated)
-        # - offset=0
-        # - limit=100 (or however many you need)
-        params = {"entityId": model_id, "offset": 0, "limit": 100}
-        # Perform the GET request
-        response = client.get(url, params=params)
-        # If we fail to get a 200 OK, return False
-        if response.status_code != 200:
-            return False
-        # Parse the JSON and examine the "data" array
-        data = response.json().get("data", [])
-        # If at least one doc is found, return True
-        return len(data) > 0
-    except Exception:
-        return False
-
-
-def guard_configuration(deployment_id):
-    """
-    Checks if one or more guard configurations exist for the specified entity
-    (e.g., a custom model version) associated with the given deployment.
-
-    This function calls:
-      GET /api/v2/guardConfigurations/?entityId=<custom_model_version_id>&entityType=customModelVersion
-
-    Returns:
-        - True if at least one guard configuration is found.
-        - False if no guard configurations are found or other errors occur.
-        - 'NA' if the check couldn't be performed due to insufficient permissions or missing models.
-    """
-    try:
-        # Retrieve the deployment
-        deployment = dr.Deployment.get(deployment_id)
-
-        # Extract model package and registered model IDs
-        model_package = deployment.model_package
-        model_package_id = model_package.get("id")
-        reg_model_id = model_package.get("registered_model_id")
-
-        if not reg_model_id:
-            return "NA"
-
-        # Fetch the registered model version details
-        registered_model_url = (
-            f"registeredModels/{reg_model_id}/versions/{model_package_id}/"
-        )
-        registered_model_resp = client.get(registered_model_url)
-
-        if registered_model_resp.status_code == 404:
-            # Registered model not found or access denied
-            return "NA"
-        elif registered_model_resp.status_code != 200:
-            # Other HTTP errors
-            return False
-
-        # Parse the registered model details
-        reg_model_data = registered_model_resp.json()
-        custom_model_details = reg_model_data.get("sourceMeta", {}).get(
-            "customModelDetails", {}
-        )
-        custom_model_id = custom_model_details.get("id")
-        version_label = custom_model_details.get("versionLabel")
-
-        if not custom_model_id or not version_label:
-            return "NA"
-
-        # Fetch all versions of the custom model
-        custom_model_versions_url = f"customModels/{custom_model_id}/versions/"
-        custom_model_versions_resp = client.get(custom_model_versions_url)
-
-        if custom_model_versions_resp.status_code != 200:
-            return False
-
-        # Identify the custom model version ID matching the version label
-        custom_model_versions = custom_model_versions_resp.json().get("data", [])
-        custom_model_version_id = next(
-            (
-                version["id"]
-                for version in custom_model_versions
-                if version.get("label") == version_label
-            ),
-            None,
-        )
-
-        if not custom_model_version_id:
-            return False
-
-        # Fetch guard configurations for the custom model version
-        guard_config_url = "guardConfigurations/"
-        params = {
-            "offset": 0,
-            "limit": 100,
-            "entityId": custom_model_version_id,
-            "entityType": "customModelVersion",
-        }
-        guard_config_resp = client.get(guard_config_url, params=params)
-
-        if guard_config_resp.status_code != 200:
-            return False
-
-        # Determine if at least one guard configuration exists
-        guard_configs = guard_config_resp.json().get("data", [])
-        return len(guard_configs) > 0
-
-    except dr.errors.APIError as api_err:
-        # Handle API-specific errors
-        error_message = str(api_err).lower()
-        if (
-            "registered model not found" in error_message
-            or "access denied" in error_message
-        ):
-            return "NA"
-        return False
-
-    except Exception:
-        # Handle any other unexpected errors
-        return False
-
-
-def compliance_test(deployment_id):
-    """
-    Checks if the 'LLM_TEST_SUITE_ID' runtime parameter exists for the model package
-    associated with the given deployment.
-
-    Returns:
-        - True if 'LLM_TEST_SUITE_ID' is present.
-        - False otherwise.
-    """
-    try:
-        # Retrieve the deployment
-        deployment = dr.Deployment.get(deployment_id)
-
-        # Extract the model package ID
-        model_package_id = deployment.model_package.get("id")
-        if not model_package_id:
-            return False
-
-        # Construct the endpoint URL for runtime parameters
-        url = "keyValues/"
-        params = {
-            "entityId": model_package_id,
-            "entityType": "modelPackage",
-            "orderBy": "-createdAt",
-            "category": "runtimeParameter",
-            "limit": 20,
-            "offset": 0,
-        }
-
-        # Perform the GET request
-        response = client.get(url, params=params)
-        if response.status_code != 200:
-            return False
-
-        # Parse the response and check for 'LLM_TEST_SUITE_ID'
-        data = response.json().get("data", [])
-        for param in data:
-            if param.get("name") == "LLM_TEST_SUITE_ID":
-                return True
-        return False
-
-    except Exception:
-        # Handle any unexpected errors gracefully
-        return False
-
-
-def tracing(deployment_id):
-    """
-    Checks if tracing/observability is enabled for agent deployments.
-
-    This checks if predictions data collection is enabled, which stores
-    incoming prediction requests and results - a fundamental requirement
-    for tracing and observability in agent workflows.
-
-    Returns:
-        - True if predictions data collection (tracing) is enabled.
-        - False otherwise.
-    """
-    try:
-        deployment = dr.Deployment.get(deployment_id)
-
-        # Get deployment settings to check predictions data collection
-        url = f"deployments/{deployment_id}/settings/"
-        response = client.get(url)
-
-        if response.status_code == 200:
-            settings = response.json()
-
-            # Check if predictions data collection is enabled
-            # This stores prediction requests and results, enabling tracing
-            predictions_data_collection = settings.get("predictionsDataCollection", {})
-            if predictions_data_collection.get("enabled", False):
-                return True
-
-        # Alternative: Check for association ID settings (enables tracking)
-        # This is also related to tracing capabilities
-        association_id_settings = deployment.get_association_id_settings()
-        columns_set = association_id_settings.get("column_names", [])
-        required_in_requests = association_id_settings.get(
-            "required_in_prediction_requests", False
-        )
-        if columns_set or required_in_requests:
-            return True
-
-        return False
-
-    except Exception:
-        return False
-
-
 def compute_compliance_score(
     data, capability_requirements, standard_caps, text_gen_caps, agentic_caps
 ):
@@ -639,127 +261,27 @@ def compute_compliance_score(
 
 
 # Main function to check capabilities for each deployment
-def check_deployment_status(deployment_id=None):
+def check_deployment_status(deployment_id=None, force=False):
     """
-    Optimized approach:
+    Incremental approach:
       1. Retrieve all deployments (or one, if deployment_id is specified).
-      2. Split them by model_type: "TextGeneration", "Agentic" (Agents), vs. others (standard).
-      3. For each subset, run concurrency with the relevant checks only.
-      4. Merge, compute quality/compliance, and return the results.
+      2. Reuse the stored audit of every deployment that hasn't changed since it
+         was last audited (unless force is set), and re-check the rest on the
+         shared, rate-limited worker pool with the checks for their model_type.
+      3. Compute quality/compliance, and return the results.
     """
 
     # 1) Retrieve deployments
     deployments = get_all_deployments(deployment_id)
 
-    # 2) Split into text-gen, agentic, and standard
-    text_gen_deployments = []
-    agentic_deployments = []
-    standard_deployments = []
-    for dep in deployments:
-        target_type = dep.model.get("target_type")
-        if target_type == "TextGeneration":
-            text_gen_deployments.append(dep)
-        elif target_type in ["Agentic", "AgenticWorkflow"]:
-            agentic_deployments.append(dep)
-        else:
-            standard_deployments.append(dep)
-
-    # Define the check sets for standard, text-generation, and agentic
-    standard_checks = [
-        (data_drift, "data_drift"),
-        (accuracy_monitoring, "accuracy_monitoring"),
-        (notifications, "notifications"),
-        (challenger_model, "challenger_model"),
-        (retraining_policy, "retraining_policy"),
-        (monitoring_job, "monitoring_job"),
-        (custom_metric, "custom_metric"),
-        (segment_analysis, "segment_analysis"),
-        (humility, "humility"),
-        (fairness, "fairness"),
-        (compliance_report, "compliance_report"),
-    ]
-    text_generation_checks = [
-        (compliance_report, "compliance_report"),
-        (accuracy_monitoring, "accuracy_monitoring"),
-        (notifications, "notifications"),
-        (guard_configuration, "guard_configuration"),
-        (compliance_test, "compliance_test"),
-        (custom_metric, "custom_metric"),
-    ]
-    agentic_checks = [
-        (tracing, "tracing"),
-        (guard_configuration, "guard_configuration"),
-        (notifications, "notifications"),
-        (custom_metric, "custom_metric"),
-    ]
-
-    # 3) Define helper to run concurrency for a given subset
-    def run_checks_for_subset(deps, checks):
-        try:
-            results_list = []
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                futures_map = {}
-                for deployment in deps:
-                    dep_id = deployment.id
-                    model_label = deployment.label
-                    model_type = deployment.model.get("target_type", None)
-
-                    # Extract owners
-                    model_owners = [
-                        owner["email"] for owner in deployment.owners.get("preview", [])
-                    ]
-
-                    # Extract importance
-                    try:
-                        model_importance = deployment.importance
-                    except AttributeError:
-                        model_importance = "Low"
-
-                    # Create initial results dict
-                    results_dict = {
-                        "deployment_id": dep_id,
-                        "model_label": model_label,
-                        "model_type": model_type,
-                        "model_owners": model_owners,
-                        "model_importance": model_importance,
-                        "enabled_capabilities": 0,
-                        "checks": {},
-                    }
-
-                    # Submit each relevant check
-                    for func, check_name in checks:
-                        fut = executor.submit(func, dep_id)
-                        futures_map[fut] = (check_name, results_dict)
-
-                    results_list.append(results_dict)
-
-                # Collect results
-                for fut in concurrent.futures.as_completed(futures_map):
-                    check_name, results_dict = futures_map[fut]
-                    try:
-                        is_enabled = fut.result()  # True/False/'NA'
-                        results_dict["checks"][check_name] = is_enabled
-                        if is_enabled is True:
-                            results_dict["enabled_capabilities"] += 1
-                    except Exception:
-                        results_dict["checks"][check_name] = False
-
-            return results_list
-        except Exception as e:
-            # In case there is no deployment
-            return []
-
-    # -- Run concurrency for standard, text-gen, and agentic separately
-    standard_results = run_checks_for_subset(standard_deployments, standard_checks)
-    text_gen_results = run_checks_for_subset(
-        text_gen_deployments, text_generation_checks
+    # 2) Audit new, modified and expired deployments only
+    if deployment_id is None:
+        audit_store.retain([dep.id for dep in deployments])
+    deployment_status = audit_deployments(
+        deployments, client, store=audit_store, force=force
     )
-    agentic_results = run_checks_for_subset(agentic_deployments, agentic_checks)
-
-    # 4) Merge the results
-    deployment_status = standard_results + text_gen_results + agentic_results
 
-    # 5) Calculate quality_score & compliance_score for each deployment
+    # 3) Calculate quality_score & compliance_score for each deployment
     for data in deployment_status:
         # total checks = length of checks dict
         total_checks = len(data["checks"])
@@ -955,8 +477,10 @@ def render_chatbot(deployment_data_csv, trunc_number_deployments):
 # --------------------------------------------------
 # CACHE + DATA LOADING
 # --------------------------------------------------
-@st.cache_data
-def load_data():
+# The leading underscore keeps _force out of the cache key, so a forced
+# re-audit replaces the cached data instead of being cached next to it.
+@st.cache_data(ttl=AUDIT_TTL)
+def load_data(_force=False):
     """
     Loads the data from the back end pipeline (check_deployment_status).
     Flattens the result into a DataFrame with columns for each capability.
@@ -964,7 +488,7 @@ def load_data():
     """
 
     # Call the new pipeline
-    deployment_list = check_deployment_status()
+    deployment_list = check_deployment_status(force=_force)
 
     # DEBUG: Show checks in Streamlit UI
     # for dep in deployment_list:
@@ -1590,8 +1114,21 @@ def render_deployment_table(
 def render_filters(df):
     st.sidebar.markdown("### Filter Deployments")
 
-    # Refresh data
+    # Refresh data: re-audit every deployment, ignoring the stored results
     if st.sidebar.button("Refresh Data"):
+        st.session_state["force_audit"] = True
+        st.cache_data.clear()
+        st.rerun()
+
+    # Only new, modified or expired deployments are re-audited. Settings
+    # changes (drift tracking, notifications, challengers, custom metrics,
+    # monitoring jobs) are not detected until the stored result expires.
+    if st.sidebar.button(
+        "Refresh Changed Deployments",
+        help="Re-audits only new deployments and those with a new model, "
+        "model package, label, importance or status. Use Refresh Data after "
+        "changing deployment settings.",
+    ):
         st.cache_data.clear()
         st.rerun()
 
@@ -1764,7 +1301,7 @@ def main():
         all_possible_caps,
         trunc_number_deployments,
         deployment_data_csv,
-    ) = load_data()
+    ) = load_data(st.session_state.pop("force_audit", False))
 
     # Render filters
     filtered_df = render_filters(df)
@@ -0,0 +1,738 @@
+import concurrent.futures
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import datarobot as dr
+
+# --------------------------------------------------
+# SETTINGS
+# --------------------------------------------------
+# Audit results are reused for AUDIT_TTL seconds unless the deployment changes
+AUDIT_TTL = float(os.environ.get("MLOPS_AUDIT_TTL", 3600))
+AUDIT_CACHE_FILE = os.environ.get("MLOPS_AUDIT_CACHE_FILE", "deployment_audit.json")
+# Size of the worker pool shared by every audit, and the API request rate it may use
+AUDIT_WORKERS = int(os.environ.get("MLOPS_AUDIT_WORKERS", 16))
+AUDIT_REQUESTS_PER_SECOND = float(os.environ.get("MLOPS_AUDIT_REQUESTS_PER_SECOND", 20))
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all threads: acquire() blocks until a request may
+    be sent, allowing bursts of up to `burst` requests.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+rate_limiter = RateLimiter(AUDIT_REQUESTS_PER_SECOND)
+
+
+def get_pool():
+    """The worker pool shared by every audit in this process."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=AUDIT_WORKERS, thread_name_prefix="audit"
+            )
+        return _pool
+
+
+def _is_client_error(error):
+    """4xx answers are final; anything else (timeouts, 429s, 5xx) may be transient."""
+    status = getattr(error, "status_code", None)
+    return status is not None and 400 <= status < 500 and status != 429
+
+
+class DeploymentContext:
+    """
+    Everything the checks need to know about one deployment. Each setting or
+    endpoint is fetched at most once, through the shared rate limiter, and
+    shared by every check that uses it.
+    """
+
+    def __init__(self, deployment, client, limiter=None, monitored_deployments=None):
+        self.deployment = deployment
+        self.deployment_id = deployment.id
+        self.client = client
+        self.limiter = limiter or rate_limiter
+        # deployment ids with a batch monitoring job, None if they could not be listed
+        self.monitored_deployments = monitored_deployments
+        self.transient_errors = 0
+        self._cache = {}
+
+    def call(self, key, fn, *args, **kwargs):
+        if key not in self._cache:
+            self.limiter.acquire()
+            try:
+                self._cache[key] = (True, fn(*args, **kwargs))
+            except Exception as e:
+                if not _is_client_error(e):
+                    self.transient_errors += 1
+                self._cache[key] = (False, e)
+        ok, value = self._cache[key]
+        if not ok:
+            raise value
+        return value
+
+    def get(self, url, params=None):
+        key = (url, json.dumps(params, sort_keys=True))
+        return self.call(key, self.client.get, url, params=params)
+
+    def drift_tracking_settings(self):
+        return self.call("drift", self.deployment.get_drift_tracking_settings)
+
+    def association_id_settings(self):
+        return self.call("association", self.deployment.get_association_id_settings)
+
+    def segment_analysis_settings(self):
+        return self.call("segments", self.deployment.get_segment_analysis_settings)
+
+    def bias_and_fairness_settings(self):
+        return self.call("fairness", self.deployment.get_bias_and_fairness_settings)
+
+
+# --------------------------------------------------
+# CHECKS
+# --------------------------------------------------
+def data_drift(ctx):
+    """
+    Checks whether data drift tracking (target or feature) is enabled.
+    """
+    try:
+        drift_settings = ctx.drift_tracking_settings()
+        target_drift_enabled = drift_settings.get("target_drift", {}).get(
+            "enabled", False
+        )
+        feature_drift_enabled = drift_settings.get("feature_drift", {}).get(
+            "enabled", False
+        )
+        return target_drift_enabled or feature_drift_enabled
+    except Exception:
+        return False
+
+
+def accuracy_monitoring(ctx):
+    """
+    Checks whether accuracy monitoring is configured for the deployment by looking
+    at the association ID settings.
+    """
+    try:
+        association_id_settings = ctx.association_id_settings()
+        columns_set = association_id_settings.get("column_names", [])
+        required_in_requests = association_id_settings.get(
+            "required_in_prediction_requests", False
+        )
+        return bool(columns_set or required_in_requests)
+    except Exception:
+        return False
+
+
+def notifications(ctx):
+    """
+    Checks whether at least one notification policy exists for the deployment.
+    """
+    try:
+        url = f"entityNotificationPolicies/deployment/{ctx.deployment_id}/"
+        params = {"offset": 0, "limit": 100}
+        response = ctx.get(url, params=params)
+        # If status code is 200 and "data" array is non-empty, there is at least one notification policy
+        if response.status_code == 200:
+            data = response.json().get("data", [])
+            return len(data) > 0
+        return False
+    except Exception:
+        return False
+
+
+def monitoring_job(ctx):
+    """
+    Function to check if there is a monitoring job for a deployment.
+    The job definitions are listed once per audit, not once per deployment.
+    """
+    if ctx.monitored_deployments is None:
+        return False
+    return ctx.deployment_id in ctx.monitored_deployments
+
+
+def challenger_model(ctx):
+    """
+    Checks if there is at least one challenger model attached to the deployment.
+    """
+    try:
+        url = f"deployments/{ctx.deployment_id}/challengers/"
+        response = ctx.get(url)
+        if response.status_code == 200:
+            data = response.json().get("data", [])
+            return len(data) > 0
+        return False
+    except Exception:
+        return False
+
+
+def retraining_policy(ctx):
+    """
+    Checks if there is a retraining policy for the deployment.
+    """
+    try:
+        url = f"deployments/{ctx.deployment_id}/retrainingPolicies/"
+        response = ctx.get(url)
+        if response.status_code == 200:
+            count = response.json().get("count", 0)
+            return count > 0
+        return False
+    except Exception:
+        return False
+
+
+def custom_metric(ctx):
+    """
+    Checks if there is at least one custom metric attached to the deployment.
+    """
+    try:
+        url = f"deployments/{ctx.deployment_id}/customMetrics/"
+        response = ctx.get(url)
+        if response.status_code == 200:
+            data = response.json().get("data", [])
+            return len(data) > 0
+        return False
+    except Exception:
+        return False
+
+
+def segment_analysis(ctx):
+    """
+    Checks if segment analysis is enabled for the deployment.
+    """
+    try:
+        segment_analysis_settings = ctx.segment_analysis_settings()
+        return segment_analysis_settings.get("enabled", False)
+    except Exception:
+        return False
+
+
+def humility(ctx):
+    """
+    Checks if humility is enabled for the deployment.
+    """
+    try:
+        url = f"deployments/{ctx.deployment_id}/"
+        response = ctx.get(url)
+        if response.status_code == 200:
+            settings = response.json().get("settings", {})
+            return settings.get("humbleAiEnabled", False)
+        return False
+    except Exception:
+        return False
+
+
+def fairness(ctx):
+    """
+    Checks if fairness/bias monitoring is enabled for the deployment.
+    """
+    try:
+        fairness_settings = ctx.bias_and_fairness_settings()
+        if fairness_settings is None:
+            return False
+        protected_features = fairness_settings.get("protected_features", [])
+        fairness_metric_set = fairness_settings.get("fairness_metric_set", None)
+        return bool(protected_features or fairness_metric_set)
+    except Exception:
+        return False
+
+
+def compliance_report(ctx):
+    """
+    Checks if a MODEL_COMPLIANCE document has been generated (i.e., previously created)
+    for the currently active model package used by the given deployment.
+
+    It calls the /api/v2/automatedDocuments endpoint, filtering by:
+      - entityId = model_package['id']
+
+    Returns True if one or more matching documents exist, otherwise False.
+    """
+    try:
+        # Retrieve the "model package" ID (the model in the registry)
+        model_id = ctx.deployment.model_package.get("id")
+        if not model_id:
+            return False
+        # Build the endpoint URL (note the /api/v2/automatedDocuments path)
+        url = "automatedDocuments"
+
+        # Include filters in query parameters:
+        # - entityId=<model_id> (the model for which compliance documents are generated)
+        # - offset=0
+        # - limit=100 (or however many you need)
+        params = {"entityId": model_id, "offset": 0, "limit": 100}
+        # Perform the GET request
+        response = ctx.get(url, params=params)
+        # If we fail to get a 200 OK, return False
+        if response.status_code != 200:
+            return False
+        # Parse the JSON and examine the "data" array
+        data = response.json().get("data", [])
+        # If at least one doc is found, return True
+        return len(data) > 0
+    except Exception:
+        return False
+
+
+def guard_configuration(ctx):
+    """
+    Checks if one or more guard configurations exist for the specified entity
+    (e.g., a custom model version) associated with the given deployment.
+
+    This function calls:
+      GET /api/v2/guardConfigurations/?entityId=<custom_model_version_id>&entityType=customModelVersion
+
+    Returns:
+        - True if at least one guard configuration is found.
+        - False if no guard configurations are found or other errors occur.
+        - 'NA' if the check couldn't be performed due to insufficient permissions or missing models.
+    """
+    try:
+        # Extract model package and registered model IDs
+        model_package = ctx.deployment.model_package
+        model_package_id = model_package.get("id")
+        reg_model_id = model_package.get("registered_model_id")
+
+        if not reg_model_id:
+            return "NA"
+
+        # Fetch the registered model version details
+        registered_model_url = (
+            f"registeredModels/{reg_model_id}/versions/{model_package_id}/"
+        )
+        registered_model_resp = ctx.get(registered_model_url)
+
+        if registered_model_resp.status_code == 404:
+            # Registered model not found or access denied
+            return "NA"
+        elif registered_model_resp.status_code != 200:
+            # Other HTTP errors
+            return False
+
+        # Parse the registered model details
+        reg_model_data = registered_model_resp.json()
+        custom_model_details = reg_model_data.get("sourceMeta", {}).get(
+            "customModelDetails", {}
+        )
+        custom_model_id = custom_model_details.get("id")
+        version_label = custom_model_details.get("versionLabel")
+
+        if not custom_model_id or not version_label:
+            return "NA"
+
+        # Fetch all versions of the custom model
+        custom_model_versions_url = f"customModels/{custom_model_id}/versions/"
+        custom_model_versions_resp = ctx.get(custom_model_versions_url)
+
+        if custom_model_versions_resp.status_code != 200:
+            return False
+
+        # Identify the custom model version ID matching the version label
+        custom_model_versions = custom_model_versions_resp.json().get("data", [])
+        custom_model_version_id = next(
+            (
+                version["id"]
+                for version in custom_model_versions
+                if version.get("label") == version_label
+            ),
+            None,
+        )
+
+        if not custom_model_version_id:
+            return False
+
+        # Fetch guard configurations for the custom model version
+        guard_config_url = "guardConfigurations/"
+        params = {
+            "offset": 0,
+            "limit": 100,
+            "entityId": custom_model_version_id,
+            "entityType": "customModelVersion",
+        }
+        guard_config_resp = ctx.get(guard_config_url, params=params)
+
+        if guard_config_resp.status_code != 200:
+            return False
+
+        # Determine if at least one guard configuration exists
+        guard_configs = guard_config_resp.json().get("data", [])
+        return len(guard_configs) > 0
+
+    except dr.errors.APIError as api_err:
+        # Handle API-specific errors
+        error_message = str(api_err).lower()
+        if (
+            "registered model not found" in error_message
+            or "access denied" in error_message
+        ):
+            return "NA"
+        return False
+
+    except Exception:
+        # Handle any other unexpected errors
+        return False
+
+
+def compliance_test(ctx):
+    """
+    Checks if the 'LLM_TEST_SUITE_ID' runtime parameter exists for the model package
+    associated with the given deployment.
+
+    Returns:
+        - True if 'LLM_TEST_SUITE_ID' is present.
+        - False otherwise.
+    """
+    try:
+        # Extract the model package ID
+        model_package_id = ctx.deployment.model_package.get("id")
+        if not model_package_id:
+            return False
+
+        # Construct the endpoint URL for runtime parameters
+        url = "keyValues/"
+        params = {
+            "entityId": model_package_id,
+            "entityType": "modelPackage",
+            "orderBy": "-createdAt",
+            "category": "runtimeParameter",
+            "limit": 20,
+            "offset": 0,
+        }
+
+        # Perform the GET request
+        response = ctx.get(url, params=params)
+        if response.status_code != 200:
+            return False
+
+        # Parse the response and check for 'LLM_TEST_SUITE_ID'
+        data = response.json().get("data", [])
+        for param in data:
+            if param.get("name") == "LLM_TEST_SUITE_ID":
+                return True
+        return False
+
+    except Exception:
+        # Handle any unexpected errors gracefully
+        return False
+
+
+def tracing(ctx):
+    """
+    Checks if tracing/observability is enabled for agent deployments.
+
+    This checks if predictions data collection is enabled, which stores
+    incoming prediction requests and results - a fundamental requirement
+    for tracing and observability in agent workflows.
+
+    Returns:
+        - True if predictions data collection (tracing) is enabled.
+        - False otherwise.
+    """
+    try:
+        # Get deployment settings to check predictions data collection
+        url = f"deployments/{ctx.deployment_id}/settings/"
+        response = ctx.get(url)
+
+        if response.status_code == 200:
+            settings = response.json()
+
+            # Check if predictions data collection is enabled
+            # This stores prediction requests and results, enabling tracing
+            predictions_data_collection = settings.get("predictionsDataCollection", {})
+            if predictions_data_collection.get("enabled", False):
+                return True
+
+        # Alternative: Check for association ID settings (enables tracking)
+        # This is also related to tracing capabilities
+        association_id_settings = ctx.association_id_settings()
+        columns_set = association_id_settings.get("column_names", [])
+        required_in_requests = association_id_settings.get(
+            "required_in_prediction_requests", False
+        )
+        if columns_set or required_in_requests:
+            return True
+
+        return False
+
+    except Exception:
+        return False
+
+
+# Define the check sets for standard, text-generation, and agentic deployments
+STANDARD_CHECKS = [
+    (data_drift, "data_drift"),
+    (accuracy_monitoring, "accuracy_monitoring"),
+    (notifications, "notifications"),
+    (challenger_model, "challenger_model"),
+    (retraining_policy, "retraining_policy"),
+    (monitoring_job, "monitoring_job"),
+    (custom_metric, "custom_metric"),
+    (segment_analysis, "segment_analysis"),
+    (humility, "humility"),
+    (fairness, "fairness"),
+    (compliance_report, "compliance_report"),
+]
+TEXT_GENERATION_CHECKS = [
+    (compliance_report, "compliance_report"),
+    (accuracy_monitoring, "accuracy_monitoring"),
+    (notifications, "notifications"),
+    (guard_configuration, "guard_configuration"),
+    (compliance_test, "compliance_test"),
+    (custom_metric, "custom_metric"),
+]
+AGENTIC_CHECKS = [
+    (tracing, "tracing"),
+    (guard_configuration, "guard_configuration"),
+    (notifications, "notifications"),
+    (custom_metric, "custom_metric"),
+]
+
+
+# Results are reported group by group, in this order
+CHECK_GROUPS = {
+    "standard": STANDARD_CHECKS,
+    "text_generation": TEXT_GENERATION_CHECKS,
+    "agentic": AGENTIC_CHECKS,
+}
+
+
+def check_group(deployment):
+    """Split by model_type: "TextGeneration", "Agentic" (Agents), vs. others (standard)."""
+    target_type = deployment.model.get("target_type")
+    if target_type == "TextGeneration":
+        return "text_generation"
+    elif target_type in ["Agentic", "AgenticWorkflow"]:
+        return "agentic"
+    return "standard"
+
+
+# --------------------------------------------------
+# PERSISTED RESULTS
+# --------------------------------------------------
+def deployment_fingerprint(deployment, checks):
+    """
+    Hash of the deployment attributes an audit depends on: a new model or
+    model package, a relabel, a new importance or a different set of checks
+    all make the stored result stale. The listing carries no settings, but its
+    drift, accuracy and fairness health statuses turn "unavailable" when the
+    matching monitoring is not set up, so they stand in for those settings
+    (a health change also re-audits the deployment). Other settings
+    (notification policies, challengers, custom metrics, retraining,
+    monitoring jobs) are deliberately not covered: fetching them is the audit
+    itself, so changes to them only show after a forced audit or once the
+    result expires.
+    """
+    state = {
+        "model": getattr(deployment, "model", None),
+        "model_package": getattr(deployment, "model_package", None),
+        "label": getattr(deployment, "label", None),
+        "importance": getattr(deployment, "importance", None),
+        "status": getattr(deployment, "status", None),
+        "health": {
+            health: (getattr(deployment, health, None) or {}).get("status")
+            for health in ["model_health", "accuracy_health", "fairness_health"]
+        },
+        "checks": [check_name for _, check_name in checks],
+    }
+    encoded = json.dumps(state, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class AuditStore:
+    """
+    Per-deployment audit results persisted to a JSON file. A result is reused
+    while it is younger than `ttl` seconds and its fingerprint still matches.
+    """
+
+    def __init__(self, path=AUDIT_CACHE_FILE, ttl=AUDIT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def lookup(self, deployment_id, fingerprint, now=None):
+        entry = self.entries.get(deployment_id)
+        now = time.time() if now is None else now
+        if (
+            entry is None
+            or entry["fingerprint"] != fingerprint
+            or now - entry["audited_at"] > self.ttl
+        ):
+            return None
+        return entry
+
+    def update(self, deployment_id, fingerprint, checks, now=None):
+        with self.lock:
+            self.entries[deployment_id] = {
+                "fingerprint": fingerprint,
+                "audited_at": time.time() if now is None else now,
+                "checks": checks,
+            }
+
+    def retain(self, deployment_ids):
+        """Forget deployments that no longer exist."""
+        with self.lock:
+            self.entries = {
+                k: v for k, v in self.entries.items() if k in set(deployment_ids)
+            }
+
+    def save(self):
+        with self.lock:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            with tempfile.NamedTemporaryFile(
+                "w", dir=directory, suffix=".tmp", delete=False
+            ) as f:
+                json.dump(self.entries, f)
+            os.replace(f.name, self.path)
+
+
+# --------------------------------------------------
+# AUDIT ENGINE
+# --------------------------------------------------
+def deployment_summary(deployment):
+    """Descriptive columns of a deployment, taken from the listing itself."""
+    # Extract owners
+    model_owners = [owner["email"] for owner in deployment.owners.get("preview", [])]
+
+    # Extract importance
+    try:
+        model_importance = deployment.importance
+    except AttributeError:
+        model_importance = "Low"
+
+    return {
+        "deployment_id": deployment.id,
+        "model_label": deployment.label,
+        "model_type": deployment.model.get("target_type", None),
+        "model_owners": model_owners,
+        "model_importance": model_importance,
+    }
+
+
+def list_monitored_deployments(limiter=None):
+    """Ids of deployments with a batch monitoring job, or None if they can't be listed."""
+    (limiter or rate_limiter).acquire()
+    try:
+        monitoring_jobs = dr.BatchMonitoringJobDefinition.list()
+    except Exception:
+        return None
+    return {
+        getattr(job, "batch_monitoring_job", {}).get("deployment_id")
+        for job in monitoring_jobs
+    }
+
+
+def run_checks(ctx, checks):
+    """Run every check against one deployment, sharing its fetched settings."""
+    results = {}
+    for func, check_name in checks:
+        try:
+            results[check_name] = func(ctx)  # True/False/'NA'
+        except Exception:
+            results[check_name] = False
+    return results
+
+
+def audit_deployments(
+    deployments, client, store=None, force=False, limiter=None, pool=None
+):
+    """
+    Audit deployments, re-checking only those that are new, modified or whose
+    stored result expired (all of them when `force` is set).
+
+    Returns one dict per deployment with its summary columns, `checks` and
+    `enabled_capabilities`, standard deployments first, then text generation,
+    then agentic, as the dashboard expects.
+    """
+    limiter = limiter or rate_limiter
+    pool = pool or get_pool()
+    now = time.time()
+
+    groups = list(CHECK_GROUPS)
+    deployments = sorted(deployments, key=lambda dep: groups.index(check_group(dep)))
+
+    cached, stale = {}, []
+    for deployment in deployments:
+        checks = CHECK_GROUPS[check_group(deployment)]
+        fingerprint = deployment_fingerprint(deployment, checks)
+        entry = (
+            None
+            if force or store is None
+            else store.lookup(deployment.id, fingerprint, now)
+        )
+        if entry is None:
+            stale.append((deployment, checks, fingerprint))
+        else:
+            cached[deployment.id] = entry["checks"]
+
+    monitored = None
+    if any(checks is STANDARD_CHECKS for _, checks, _ in stale):
+        monitored = list_monitored_deployments(limiter)
+
+    contexts = {
+        deployment.id: DeploymentContext(deployment, client, limiter, monitored)
+        for deployment, _, _ in stale
+    }
+    futures = {
+        deployment.id: pool.submit(run_checks, contexts[deployment.id], checks)
+        for deployment, checks, _ in stale
+    }
+
+    for deployment, checks, fingerprint in stale:
+        results = futures[deployment.id].result()
+        cached[deployment.id] = results
+        # don't keep results that may be wrong because of throttling or timeouts
+        complete = contexts[deployment.id].transient_errors == 0 and (
+            monitored is not None or checks is not STANDARD_CHECKS
+        )
+        if store is not None and complete:
+            store.update(deployment.id, fingerprint, results, now)
+
+    results = []
+    for deployment in deployments:
+        checks = cached[deployment.id]
+        results.append(
+            {
+                **deployment_summary(deployment),
+                "enabled_capabilities": sum(value is True for value in checks.values()),
+                "checks": checks,
+            }
+        )
+
+    if store is not None and stale:
+        store.save()
+    return results
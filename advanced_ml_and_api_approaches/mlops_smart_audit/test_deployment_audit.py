@@ -0,0 +1,193 @@
+"""
+audit_deployments against a stubbed DataRobot API
+
+StubAPI stands in for the REST client, the deployment listing, the settings
+getters of every deployment and the monitoring job listing. It counts every
+fetch by path and can answer any of them with an error status, so the tests
+check how often settings are fetched and which results are stored and reused
+by AuditStore without a DataRobot account. Run with `python -m pytest` from
+this folder.
+"""
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+import datarobot as dr
+import pytest
+
+from deployment_audit import AuditStore, RateLimiter, audit_deployments
+
+N_DEPLOYMENTS = 60
+TARGET_TYPES = ["Binary", "Regression", "TextGeneration", "AgenticWorkflow"]
+SETTINGS = {
+    "driftTrackingSettings": "get_drift_tracking_settings",
+    "associationIdSettings": "get_association_id_settings",
+    "segmentAnalysisSettings": "get_segment_analysis_settings",
+    "biasAndFairnessSettings": "get_bias_and_fairness_settings",
+}
+
+
+class StubAPI:
+    def __init__(self, n_deployments):
+        self.lock = threading.Lock()
+        self.fetches = Counter()
+        self.failures = {}
+        self.deployments = [self.make_deployment(i) for i in range(n_deployments)]
+
+    def fetch(self, path, payload):
+        with self.lock:
+            self.fetches[path] += 1
+            status = self.failures.get(path)
+        if status is None:
+            return payload
+        error = dr.errors.ServerError if status >= 500 else dr.errors.ClientError
+        raise error(f"{status} {path}", status)
+
+    def make_deployment(self, i):
+        deployment = SimpleNamespace(
+            id=f"dep-{i:02d}",
+            label=f"deployment {i}",
+            status="active",
+            importance=["LOW", "MODERATE", "HIGH", "CRITICAL"][i % 4],
+            model={"target_type": TARGET_TYPES[i % 4], "id": f"model-{i:02d}"},
+            model_package={"id": f"pkg-{i:02d}", "registered_model_id": None},
+            owners={"preview": [{"email": f"owner{i}@example.com"}]},
+            model_health={"status": "passing" if i % 2 else "unavailable"},
+            accuracy_health={"status": "unavailable"},
+            fairness_health={"status": "unavailable"},
+        )
+        for name, method in SETTINGS.items():
+            setattr(
+                deployment,
+                method,
+                lambda name=name: self.fetch(
+                    f"deployments/{deployment.id}/{name}/", {"enabled": i % 2 == 1}
+                ),
+            )
+        return deployment
+
+    def list_deployments(self):
+        return self.fetch("deployments/", self.deployments)
+
+    def list_monitoring_jobs(self):
+        job = SimpleNamespace(batch_monitoring_job={"deployment_id": "dep-00"})
+        return self.fetch("batchMonitoringJobDefinitions/", [job])
+
+    def get(self, url, params=None):
+        path = url + ("?" + urlencode(sorted(params.items())) if params else "")
+        payload = self.fetch(path, {"data": [], "count": 0, "settings": {}})
+        return SimpleNamespace(status_code=200, json=lambda: payload)
+
+    def audited(self):
+        """Ids of the deployments whose settings or endpoints were fetched"""
+        return {
+            deployment.id
+            for deployment in self.deployments
+            if any(deployment.id[3:] in path for path in self.fetches)
+        }
+
+
+@pytest.fixture
+def api(monkeypatch):
+    api = StubAPI(N_DEPLOYMENTS)
+    monkeypatch.setattr(
+        dr.BatchMonitoringJobDefinition, "list", api.list_monitoring_jobs
+    )
+    return api
+
+
+@pytest.fixture
+def audit(api, tmp_path):
+    path = str(tmp_path / "deployment_audit.json")
+    pool = ThreadPoolExecutor(max_workers=8)
+
+    def audit(store=None, **kwargs):
+        store = store or AuditStore(path)
+        api.fetches.clear()
+        results = audit_deployments(
+            api.list_deployments(),
+            api,
+            store=store,
+            limiter=RateLimiter(0),
+            pool=pool,
+            **kwargs,
+        )
+        return results, store
+
+    yield audit
+    pool.shutdown()
+
+
+def test_cold_audit_fetches_each_setting_once(api, audit):
+    results, store = audit()
+
+    assert len(results) == N_DEPLOYMENTS
+    assert api.audited() == {deployment.id for deployment in api.deployments}
+    assert max(api.fetches.values()) == 1
+    # standard deployments read every setting, the monitoring jobs are listed once
+    assert all(api.fetches[f"deployments/dep-00/{name}/"] == 1 for name in SETTINGS)
+    assert api.fetches["batchMonitoringJobDefinitions/"] == 1
+    assert [r["model_type"] for r in results][:30] == ["Binary", "Regression"] * 15
+    assert results[0]["checks"]["monitoring_job"] is True
+    assert len(store.entries) == N_DEPLOYMENTS
+
+
+def test_warm_audit_only_lists_deployments(api, audit):
+    cold, _ = audit()
+
+    # a new store reads the results saved by the cold audit
+    warm, _ = audit()
+
+    assert api.fetches == {"deployments/": 1}
+    assert warm == cold
+
+
+def test_only_changed_or_expired_deployments_are_re_audited(api, audit):
+    _, store = audit()
+    relabelled, new_health, expired = api.deployments[3], api.deployments[8], "dep-13"
+    relabelled.label = "renamed"
+    # drift tracking was set up
+    new_health.model_health = {"status": "passing"}
+    store.entries[expired]["audited_at"] -= store.ttl + 1
+
+    audit(store)
+
+    assert api.audited() == {relabelled.id, new_health.id, expired}
+
+    audit(force=True)
+    assert len(api.audited()) == N_DEPLOYMENTS
+
+
+def test_results_with_transient_errors_are_not_stored(api, audit):
+    throttled, unavailable, forbidden = api.deployments[:3]
+    api.failures = {
+        f"deployments/{throttled.id}/challengers/": 429,
+        f"deployments/{unavailable.id}/driftTrackingSettings/": 503,
+        f"deployments/{forbidden.id}/customMetrics/": 403,
+    }
+
+    results, store = audit()
+
+    assert results[0]["checks"]["challenger_model"] is False
+    assert throttled.id not in store.entries
+    assert unavailable.id not in store.entries
+    # a 4xx answer is final, so that result is kept
+    assert store.entries[forbidden.id]["checks"]["custom_metric"] is False
+
+    api.failures = {}
+    audit()
+    assert api.audited() == {throttled.id, unavailable.id}
+
+
+def test_standard_results_are_not_stored_without_monitoring_jobs(api, audit):
+    api.failures = {"batchMonitoringJobDefinitions/": 503}
+
+    _, store = audit()
+
+    assert len(store.entries) == N_DEPLOYMENTS // 2
+    assert all(
+        "monitoring_job" not in entry["checks"] for entry in store.entries.values()
+    )
@@ -3,6 +3,8 @@ import concurrent.futures
 import io
 import logging
 import math
+import os
+import time
 from typing import Any, Dict
 import warnings
 
@@ -226,95 +228,240 @@ def test_distribution(
     return im
 
 
-def test_stationarity(
+def hurst_exponent(series: np.ndarray):
+    """
+    Estimates the Hurst exponent of a series with the rescaled range (R/S) statistic.
+
+    The returns of the series are truncated to the largest power of two n = 2**power.
+    For each window size m = 2**p, the returns are reshaped into n / m windows and the
+    rescaled range of every window is computed at once; log2 of the average rescaled
+    range is then regressed on p.
+
+    Args:
+    series (np.ndarray): The values of the series.
+
+    Returns:
+    tuple: The Hurst exponent and the p-value of the t-test for a Hurst exponent of 0.5.
+    """
+    returns = np.diff(np.asarray(series, dtype=float), prepend=np.nan)
+    power = int(math.log2(len(returns)))
+
+    n = 2**power
+    returns_sub = returns[len(returns) - n :]
+    X = np.arange(2, power + 1)
+    Y = np.empty(len(X))
+    for j, p in enumerate(X):
+        # one row per subsample of size m = 2**p
+        windows = returns_sub.reshape(-1, 2**p)
+        mean = np.nanmean(windows, axis=1, keepdims=True)
+        deviate = np.nancumsum(windows - mean, axis=1)
+        difference = np.nanmax(deviate, axis=1) - np.nanmin(deviate, axis=1)
+        stdev = np.nanstd(windows, axis=1)
+        # calculating the log2 of average rescaled range
+        Y[j] = np.log2(np.nanmean(difference / stdev))
+
+    reg = sm.OLS(Y, sm.add_constant(X))
+    res = reg.fit()
+    if len(res.params) > 1:
+        hurst = res.params[1]
+        tstat = (res.params[1] - 0.5) / res.bse[1]
+        pvalue = 2 * (1 - spstat.t.cdf(abs(tstat), res.df_resid))
+    else:
+        hurst = np.nan
+        pvalue = np.nan
+
+    return hurst, pvalue
+
+
+def _test_record(test, statistic, pvalue, n_lags=np.nan, critical_values=None):
+    record = {
+        "Test": test,
+        "Test Statistic": statistic,
+        "p-value": pvalue,
+        "n_lags": n_lags,
+    }
+    for key in ["1%", "5%", "10%"]:
+        record[f"cv_{key}"] = (critical_values or {}).get(key, np.nan)
+    return record
+
+
+def stationarity_records(series: np.ndarray):
+    adf = adfuller(series, autolag="AIC")
+    kps = kpss(series, nlags=adf[2])  # type: ignore
+    hurst, pvalue = hurst_exponent(series)
+
+    return [
+        _test_record("kpss", kps[0], kps[1], kps[2], kps[3]),
+        _test_record("adfuller", adf[0], adf[1], adf[2], adf[4]),  # type: ignore
+        _test_record("hurst exponent", hurst, pvalue),
+    ]
+
+
+def normality_records(residuals: np.ndarray):
+    JB, p_value_jb, _, _ = jarque_bera(residuals)
+    ad2, p_value_ad = normal_ad(residuals)
+
+    return [
+        _test_record("jarque_bera", JB, p_value_jb),
+        _test_record("anderson_darling", ad2, p_value_ad),
+    ]
+
+
+def arch_records(residuals: np.ndarray, maxlag: int = 10):
+    (
+        lagrange_multiplier_stat,
+        lagrange_multiplier_pval,
+        f_stat,
+        f_pval,
+    ) = het_arch(residuals, maxlag)
+
+    return [
+        _test_record(
+            "lagrange multiplier",
+            lagrange_multiplier_stat,
+            lagrange_multiplier_pval,
+            maxlag,
+        ),
+        _test_record("f", f_stat, f_pval, maxlag),
+    ]
+
+
+def autocorrelation_records(residuals: np.ndarray):
+    records = [_test_record("durbin_watson", durbin_watson(residuals), np.nan)]
+
+    ljungbox = acorr_ljungbox(residuals, boxpierce=True, return_df=True)
+    for lag, row in ljungbox.iterrows():
+        records.append(_test_record("ljung_box", row.lb_stat, row.lb_pvalue, lag))
+        records.append(_test_record("box_pierce", row.bp_stat, row.bp_pvalue, lag))
+    return records
+
+
+# per-series tests run by run_series_tests, and whether they test the target or
+# the residuals
+SERIES_TESTS = {
+    "stationarity": (stationarity_records, "target"),
+    "normality": (normality_records, "residuals"),
+    "arch": (arch_records, "residuals"),
+    "autocorrelation": (autocorrelation_records, "residuals"),
+}
+
+
+def _run_series_test(task):
+    s, test, values = task
+    records_fn, _ = SERIES_TESTS[test]
+
+    start = time.perf_counter()
+    records = records_fn(values)
+    seconds = time.perf_counter() - start
+
+    return [{"Series": s, "Test Group": test, **r, "seconds": seconds} for r in records]
+
+
+def run_series_tests(
     data: Dict[str, pd.DataFrame],
     parameters: Dict[str, Any],
+    tests=None,
+    max_workers=None,
+    chunksize=None,
 ):
-    for s in data:
-        df_data = data[s]
-        series = df_data.loc[:, parameters["target_column"]]
+    """
+    Runs the per-series statistical tests for every series, across a process pool.
 
-        adf = adfuller(series, autolag="AIC")
-        adf_summary = {
-            "Test": "adfuller",
-            "Test Statistic": round(adf[0], 4),
-            "p-value": round(adf[1], 4),  # type: ignore
-            "n_lags": adf[2],  # type: ignore
-        }
-        for key, value in adf[4].items():  # type: ignore
-            if key in ["1%", "5%", "10%"]:
-                adf_summary[f"cv_{key}"] = round(value, 4)
-            else:
-                pass
+    Every (series, test) pair is one task. Only the target (or residual) values are
+    sent to the workers, in chunks of `chunksize` tasks, so the wall-clock time of a
+    panel with many series scales with the number of cores.
 
-        kps = kpss(series, nlags=adf_summary["n_lags"])
-        kps_summary = {
-            "Test": "kpss",
-            "Test Statistic": round(kps[0], 4),
-            "p-value": round(kps[1], 4),
-            "n_lags": kps[2],
-        }
-        for key, value in kps[3].items():
-            if key in ["1%", "5%", "10%"]:
-                kps_summary[f"cv_{key}"] = round(value, 4)
-            else:
-                pass
+    Args:
+    data (Dict[str, pd.DataFrame]): The data of each series. Tests of the residuals need
+        the "<target_column>_PREDICTION" column.
+    parameters (Dict[str, Any]): Must contain "target_column".
+    tests (list, optional): Names of the SERIES_TESTS to run. Defaults to all of them.
+    max_workers (int, optional): Size of the process pool. Defaults to the number of CPUs,
+        and 1 runs the tests in this process.
+    chunksize (int, optional): Tasks sent to a worker at a time. Defaults to splitting the
+        tasks into 4 chunks per worker.
 
-        # calculate hurst exponent for the maximum sample length n = 2**power
-
-        returns = series.diff().to_numpy()
-        power = int(math.log2(len(returns)))
-
-        n = 2**power
-        returns_sub = returns[len(returns) - n : len(returns)]
-        X = np.arange(2, power + 1)
-        Y = np.array([])
-        for p in X:
-            m = 2**p
-            sub = 2 ** (power - p)
-            rs_array = np.array([])
-            # moving across subsamples
-            for i in np.arange(0, sub):
-                subsample = returns_sub[i * m : (i + 1) * m]
-                mean = np.nanmean(subsample)
-                deviate = np.nancumsum(subsample - mean)
-                difference = np.nanmax(deviate) - np.nanmin(deviate)
-                stdev = np.nanstd(subsample)
-                rescaled_range = difference / stdev
-                rs_array = np.append(rs_array, rescaled_range)
-            # calculating the log2 of average rescaled range
-            Y = np.append(Y, np.log2(np.nanmean(rs_array)))
-
-        reg = sm.OLS(Y, sm.add_constant(X))
-        res = reg.fit()
-        if len(res.params) > 1:
-            hurst = res.params[1]
-            tstat = (res.params[1] - 0.5) / res.bse[1]
-            pvalue = 2 * (1 - spstat.t.cdf(abs(tstat), res.df_resid))
-        else:
-            hurst = np.nan
-            tstat = np.nan
-            pvalue = np.nan
-
-        hurst_exp_summary = {
-            "Test": "hurst exponent",
-            "Test Statistic": round(hurst, 4),
-            "p-value": round(pvalue, 4),  # type: ignore
-            "n_lags": np.nan,  # type: ignore
-        }
-        for key, value in adf[4].items():  # type: ignore
-            if key in ["1%", "5%", "10%"]:
-                hurst_exp_summary[f"cv_{key}"] = np.nan
+    Returns:
+    pd.DataFrame: One row per series and test statistic, with the columns "Series",
+    "Test Group", "Test", "Test Statistic", "p-value", "n_lags", "cv_1%", "cv_5%", "cv_10%"
+    and "seconds", the time taken by the task that computed the row.
+    """
+    tests = list(SERIES_TESTS) if tests is None else tests
+    target_column = parameters["target_column"]
+
+    tasks = []
+    for s, df_data in data.items():
+        target = df_data.loc[:, target_column].to_numpy(dtype=float)
+        for test in tests:
+            if SERIES_TESTS[test][1] == "residuals":
+                values = target - df_data.loc[
+                    :, f"{target_column}_PREDICTION"
+                ].to_numpy(dtype=float)
             else:
-                pass
+                values = target
+            tasks.append((s, test, values))
 
-        results_summary = pd.DataFrame.from_records(
-            [
-                kps_summary,
-                adf_summary,
-                hurst_exp_summary,
-            ],
-        )
+    max_workers = max_workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    if max_workers == 1 or len(tasks) <= 1:
+        results = list(map(_run_series_test, tasks))
+    else:
+        chunksize = chunksize or max(1, math.ceil(len(tasks) / (4 * max_workers)))
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers
+        ) as executor:
+            results = list(executor.map(_run_series_test, tasks, chunksize=chunksize))
+    elapsed = time.perf_counter() - start
+
+    results_summary = pd.DataFrame.from_records(
+        [record for records in results for record in records],
+        columns=[
+            "Series",
+            "Test Group",
+            "Test",
+            "Test Statistic",
+            "p-value",
+            "n_lags",
+            "cv_1%",
+            "cv_5%",
+            "cv_10%",
+            "seconds",
+        ],
+    )
+    log.info(
+        "Ran %d series tests in %.2fs (%.2fs of test time) with %d workers",
+        len(tasks),
+        elapsed,
+        sum(records[0]["seconds"] for records in results if records),
+        max_workers,
+    )
+
+    return results_summary
+
+
+def test_stationarity(
+    data: Dict[str, pd.DataFrame],
+    parameters: Dict[str, Any],
+    max_workers=None,
+):
+    results_summary = run_series_tests(
+        data, parameters, ["stationarity"], max_workers=max_workers
+    )
+    results_summary = results_summary.loc[
+        :,
+        [
+            "Series",
+            "Test",
+            "Test Statistic",
+            "p-value",
+            "n_lags",
+            "cv_1%",
+            "cv_5%",
+            "cv_10%",
+        ],
+    ]
+    rounded = ["Test Statistic", "p-value", "cv_1%", "cv_5%", "cv_10%"]
+    results_summary[rounded] = results_summary[rounded].round(4)
 
     return results_summary
 
@@ -483,7 +630,35 @@ def test_partial_dependence(dr_models: Dict[str, Any], parameters: Dict[str, Any
 def test_autocorrelation(
     predictions: dict[str, pd.DataFrame],
     parameters: dict[str, Any],
+    max_workers=None,
 ):
+    tests = run_series_tests(
+        predictions, parameters, ["autocorrelation"], max_workers=max_workers
+    )
+
+    summaries = []
+    for s, series_tests in tests.groupby("Series", sort=False):
+        ljungbox = series_tests[series_tests["Test"] == "ljung_box"]
+        boxpierce = series_tests[series_tests["Test"] == "box_pierce"]
+        d_stat = series_tests.loc[
+            series_tests["Test"] == "durbin_watson", "Test Statistic"
+        ].iloc[0]
+
+        summary = pd.DataFrame(
+            {
+                "Series": s,
+                "lag": ljungbox["n_lags"].astype(int).to_numpy(),
+                "d_stat": np.nan,
+                "lb_stat": ljungbox["Test Statistic"].round(4).to_numpy(),
+                "lb_pvalue": ljungbox["p-value"].to_numpy(),
+                "bp_stat": boxpierce["Test Statistic"].round(4).to_numpy(),
+                "bp_pvalue": boxpierce["p-value"].to_numpy(),
+            }
+        )
+        summary.loc[summary["lag"] == 1, "d_stat"] = round(d_stat, 4)
+        summaries.append(summary)
+    results_summary = pd.concat(summaries, ignore_index=True)
+
     for s in predictions:
         df_predictions = predictions[s]
 
@@ -491,16 +666,6 @@ def test_autocorrelation(
             df_predictions.loc[:, f"{parameters['target_column']}_PREDICTION"]
         )
 
-        d_stat = durbin_watson(residuals)
-
-        results_summary = acorr_ljungbox(residuals, boxpierce=True, return_df=True)
-        results_summary["lb_stat"] = round(results_summary["lb_stat"], 4)
-        results_summary["bp_stat"] = round(results_summary["bp_stat"], 4)
-        results_summary.index.name = "lag"
-        results_summary.insert(loc=0, column="d_stat", value=np.nan)
-        results_summary.loc[1, "d_stat"] = round(d_stat, 4)
-        results_summary.reset_index(inplace=True)
-
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 3), dpi=80)
         fig.suptitle(s.capitalize(), fontsize=18)
 
@@ -533,62 +698,42 @@ def test_autocorrelation(
 def test_normality(
     predictions: Dict[str, pd.DataFrame],
     parameters: Dict[str, Any],
+    max_workers=None,
 ):
-    for s in predictions:
-        df_predictions = predictions[s]
-
-        residuals = df_predictions.loc[:, parameters["target_column"]].subtract(
-            df_predictions.loc[:, f"{parameters['target_column']}_PREDICTION"]
-        )
-
-        (JB, p_value_jb, _, _) = jarque_bera(residuals)
-        jb_summary = {
-            "Test": "jarque_bera",
-            "Test Statistic": JB,
-            "p-value": p_value_jb,
-        }
-
-        (ad2, p_value_ad) = normal_ad(residuals)
-        ad_summary = {
-            "Test": "anderson_darling",
-            "Test Statistic": ad2,
-            "p-value": p_value_ad,
-        }
+    results_summary = run_series_tests(
+        predictions, parameters, ["normality"], max_workers=max_workers
+    )
 
-        results_summary = pd.DataFrame.from_records(
-            [jb_summary, ad_summary],
-        )
-
-    return results_summary
+    return results_summary.loc[:, ["Series", "Test", "Test Statistic", "p-value"]]
 
 
 def test_arch(
     predictions: Dict[str, pd.DataFrame],
     parameters: Dict[str, Any],
+    max_workers=None,
 ):
-    for s in predictions:
-        df_predictions = predictions[s]
+    tests = run_series_tests(predictions, parameters, ["arch"], max_workers=max_workers)
 
-        residuals = df_predictions.loc[:, parameters["target_column"]].subtract(
-            df_predictions.loc[:, f"{parameters['target_column']}_PREDICTION"]
-        )
-        (
-            lagrange_multiplier_stat,
-            lagrange_multiplier_pval,
-            f_stat,
-            f_pval,
-        ) = het_arch(residuals, maxlag=10)
-
-        results_summary = pd.DataFrame.from_records(
-            [
-                {
-                    "lagrange multiplier statistic": round(lagrange_multiplier_stat, 4),
-                    "lagrange multiplier p-value": round(lagrange_multiplier_pval, 4),
-                    "f statistic": round(f_stat, 4),
-                    "f p-value": round(f_pval, 4),
-                }
-            ]
+    records = []
+    for s, series_tests in tests.groupby("Series", sort=False):
+        lagrange_multiplier = series_tests[
+            series_tests["Test"] == "lagrange multiplier"
+        ]
+        f = series_tests[series_tests["Test"] == "f"]
+        records.append(
+            {
+                "Series": s,
+                "lagrange multiplier statistic": round(
+                    lagrange_multiplier["Test Statistic"].iloc[0], 4
+                ),
+                "lagrange multiplier p-value": round(
+                    lagrange_multiplier["p-value"].iloc[0], 4
+                ),
+                "f statistic": round(f["Test Statistic"].iloc[0], 4),
+                "f p-value": round(f["p-value"].iloc[0], 4),
+            }
         )
+    results_summary = pd.DataFrame.from_records(records)
 
     return results_summary
 
@@ -0,0 +1,143 @@
+"""
+Custom metric submission in utilities against a local HTTP stub of the API
+
+The stub stands in for the customMetrics/fromJSON endpoint. It records the
+buckets of every request and answers with scripted status codes, so the tests
+check batching, delivery, retries, timeouts and the bounded buffer of
+CustomMetricReporter without a DataRobot deployment. Run with
+`python -m pytest` from this folder.
+"""
+
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+import pytest
+import requests
+
+import utilities
+
+
+class StubCustomMetricAPI(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            status = server.statuses.pop(0) if server.statuses else 202
+            if status == 202:
+                server.received.append((self.path, body["buckets"]))
+        time.sleep(server.delay)
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubCustomMetricAPI)
+    server.lock = threading.Lock()
+    server.received = []
+    server.statuses = []
+    server.delay = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(
+        utilities,
+        "CM_API_URL",
+        f"http://127.0.0.1:{server.server_address[1]}"
+        "/api/v2/deployments/{}/customMetrics/{}/fromJSON/",
+    )
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def values(api, path_part):
+    return [
+        bucket["value"]
+        for path, buckets in api.received
+        if path_part in path
+        for bucket in buckets
+    ]
+
+
+def report_all(reporter, custom_metric_id, metrics):
+    start = datetime(2024, 1, 1)
+    for i, metric in enumerate(metrics):
+        reporter.report("d1", custom_metric_id, metric, start + timedelta(seconds=i))
+
+
+def test_reporter_delivers_all_values_in_batches(api):
+    reporter = utilities.CustomMetricReporter(max_buckets=3, flush_interval=3600)
+
+    report_all(reporter, "toxicity", range(7))
+    report_all(reporter, "latency", [0.5, 0.7])
+    reporter.close()
+
+    assert values(api, "/customMetrics/toxicity/") == list(range(7))
+    assert values(api, "/customMetrics/latency/") == [0.5, 0.7]
+    assert max(len(buckets) for _, buckets in api.received) == 3
+    assert all(path.startswith("/api/v2/deployments/d1/") for path, _ in api.received)
+    assert reporter.dropped == {}
+
+
+def test_transient_errors_are_retried(api):
+    api.statuses = [503, 429]
+
+    response = utilities.post_custom_metric_buckets(
+        "d1", "toxicity", [{"timestamp": "t", "value": 1}], backoff=0
+    )
+
+    assert response.status_code == 202
+    assert values(api, "toxicity") == [1]
+
+
+def test_requests_time_out(api):
+    api.delay = 1
+
+    with pytest.raises(requests.Timeout):
+        utilities.post_custom_metric_buckets(
+            "d1",
+            "toxicity",
+            [{"timestamp": "t", "value": 1}],
+            max_retries=0,
+            timeout=0.2,
+        )
+
+
+def test_buffer_is_bounded_while_the_api_is_down(api, caplog):
+    reporter = utilities.CustomMetricReporter(
+        max_buckets=10, flush_interval=3600, max_retries=0, max_buffered=5
+    )
+
+    api.statuses = [503]
+    report_all(reporter, "toxicity", range(4))
+    assert reporter.flush() == 4
+
+    # the failed values are kept, then the oldest ones make room for new ones
+    report_all(reporter, "toxicity", range(4, 7))
+    assert reporter.flush() == 0
+    reporter.close()
+
+    assert values(api, "toxicity") == [2, 3, 4, 5, 6]
+    assert reporter.dropped == {("d1", "toxicity"): 2}
+    assert "Dropped the 2 oldest values of custom metric toxicity" in caplog.text
+
+
+def test_rejected_values_are_dropped_and_counted(api):
+    reporter = utilities.CustomMetricReporter(
+        max_buckets=10, flush_interval=3600, max_retries=0
+    )
+
+    api.statuses = [422]
+    report_all(reporter, "toxicity", range(3))
+    assert reporter.flush() == 0
+    reporter.close()
+
+    assert api.received == []
+    assert reporter.dropped == {("d1", "toxicity"): 3}
@@ -1,5 +1,12 @@
+import atexit
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+import logging
 import os
+import threading
+import time
 
 import datarobot as dr
 from datarobot.mlops.connected.client import MLOpsClient
@@ -8,20 +15,10 @@ import nltk
 import pandas as pd
 from readability import Readability
 import requests
-from transformers import AutoModelForSequenceClassification, AutoTokenizer, pipeline
+from requests.adapters import HTTPAdapter
 
-nltk.download("punkt")
-
-model = AutoModelForSequenceClassification.from_pretrained("unitary/toxic-bert")
-tokenizer = AutoTokenizer.from_pretrained("unitary/toxic-bert")
-toxicity_check = pipeline(
-    "text-classification",
-    model=model,
-    tokenizer=tokenizer,
-)
-
-service_url = context.endpoint.split("/api")[0]
-mlops_client = MLOpsClient(service_url=service_url, api_key=context.token, verify=True)
+# hub id or local directory of the toxicity model, set a local path to run offline
+TOXICITY_MODEL = os.environ.get("TOXICITY_MODEL_PATH", "unitary/toxic-bert")
 
 CM_API_URL = (
     "https://app.datarobot.com/api/v2/deployments/{}/customMetrics/{}/fromJSON/"
@@ -31,10 +28,53 @@ CM_HEADERS = {
     "Authorization": "Bearer {}".format(CM_API_KEY),
     "User-Agent": "IntegrationSnippet-Requests",
 }
+# status codes worth retrying a custom metric submission for
+CM_RETRY_STATUSES = {429, 500, 502, 503, 504}
+# seconds to wait for the custom metric API to answer a submission
+CM_TIMEOUT = 30
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_mlops_client():
+    """MLOps client, created on first use"""
+    service_url = context.endpoint.split("/api")[0]
+    return MLOpsClient(service_url=service_url, api_key=context.token, verify=True)
+
+
+@lru_cache(maxsize=None)
+def get_toxicity_pipeline(model_path=TOXICITY_MODEL):
+    """Load the toxicity classifier once, on first use"""
+    # transformers is slow to import, so it is only imported when needed
+    from transformers import (
+        AutoModelForSequenceClassification,
+        AutoTokenizer,
+        pipeline,
+    )
+
+    local_files_only = os.path.isdir(model_path)
+    model = AutoModelForSequenceClassification.from_pretrained(
+        model_path, local_files_only=local_files_only
+    )
+    tokenizer = AutoTokenizer.from_pretrained(
+        model_path, local_files_only=local_files_only
+    )
+    return pipeline("text-classification", model=model, tokenizer=tokenizer)
+
+
+@lru_cache(maxsize=None)
+def ensure_punkt():
+    """Download the nltk punkt tokenizer data only if it is missing"""
+    try:
+        nltk.data.find("tokenizers/punkt")
+    except LookupError:
+        nltk.download("punkt")
 
 
 def create_external_llm_deployment(name="External Deployment"):
     """Create a DataRobot Model Package, Deployment to monitor External models"""
+    mlops_client = get_mlops_client()
     pred_env = {
         "name": name + " Environment",
         "description": name + " Environment",
@@ -71,13 +111,39 @@ def create_external_llm_deployment(name="External Deployment"):
     return deployment_id, model_id
 
 
+def score_texts(texts, batch_size=32):
+    """Calculate toxicity scores for a list of texts in padded mini-batches"""
+    texts = list(texts)
+    # texts of similar length are batched together to keep padding small
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    results = get_toxicity_pipeline()(
+        [texts[i] for i in order], batch_size=batch_size, truncation=True
+    )
+    scores = [None] * len(texts)
+    for i, result in zip(order, results):
+        scores[i] = result["score"]
+    return scores
+
+
+_scoring_executor = None
+
+
+def score_texts_in_background(texts, batch_size=32):
+    """Run score_texts in a worker thread, returns a future of the scores"""
+    global _scoring_executor
+    if _scoring_executor is None:
+        _scoring_executor = ThreadPoolExecutor(max_workers=1)
+    return _scoring_executor.submit(score_texts, texts, batch_size)
+
+
 def get_text_texicity(text):
     """Calculate toxicity score for text"""
-    return toxicity_check(text)[0]["score"]
+    return score_texts([text])[0]
 
 
 def get_flesch_score(text):
     """Calculate Flesch readability score for text"""
+    ensure_punkt()
     readability = Readability(text)
     return readability.flesch().score
 
@@ -100,26 +166,180 @@ def create_custom_metric(
         "value": {"columnName": "value"},
         "isModelSpecific": False,
     }
-    metric_id = mlops_client.create_custom_metric(deployment_id, definition)
+    metric_id = get_mlops_client().create_custom_metric(deployment_id, definition)
     dr.Deployment.get(deployment_id).update_predictions_data_collection_settings(
         enabled=True
     )
     return metric_id
 
 
+@lru_cache(maxsize=None)
+def get_session():
+    """Pooled HTTP session for the custom metric API"""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+    session.headers.update(CM_HEADERS)
+    return session
+
+
+def post_custom_metric_buckets(
+    deployment_id,
+    custom_metric_id,
+    buckets,
+    max_retries=5,
+    backoff=1.0,
+    timeout=CM_TIMEOUT,
+):
+    """Post buckets of values for a custom metric, retrying transient errors"""
+    for attempt in range(max_retries + 1):
+        try:
+            response = get_session().post(
+                CM_API_URL.format(deployment_id, custom_metric_id),
+                json={
+                    "modelPackageId": None,
+                    "buckets": buckets,
+                },
+                timeout=timeout,
+            )
+            if response.status_code not in CM_RETRY_STATUSES:
+                response.raise_for_status()
+                return response
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == max_retries:
+                raise
+        if attempt < max_retries:
+            time.sleep(backoff * 2**attempt)
+    response.raise_for_status()
+
+
 def submit_custom_metric(deployment_id, custom_metric_id, metric):
     """Record values for an existing custom metric on a deployment"""
-    time_ = datetime.today().strftime("%m/%d/%Y %I:%M %p")
-    rows = [
-        {"timestamp": ts.isoformat(), "value": value}
-        for ts, value in zip([pd.to_datetime(time_)], [metric])
-    ]
-    response = requests.post(
-        CM_API_URL.format(deployment_id, custom_metric_id),
-        json={
-            "modelPackageId": None,
-            "buckets": rows,
-        },
-        headers=CM_HEADERS,
-    )
-    response.raise_for_status()
+    rows = [{"timestamp": datetime.now().isoformat(), "value": metric}]
+    post_custom_metric_buckets(deployment_id, custom_metric_id, rows)
+
+
+class CustomMetricReporter:
+    """
+    Buffer custom metric values per (deployment, metric) and submit them as
+    multi-bucket requests from a background thread, once max_buckets values
+    are buffered for a metric or every flush_interval seconds.
+
+    Buckets that still fail after the retries are kept in the buffer and
+    sent again on the next flush; rejected buckets (4xx) are dropped. At most
+    max_buffered values are kept per metric, the oldest ones are dropped when
+    the API is unavailable for long. Dropped values are counted per metric in
+    `dropped` and logged. The buffer is flushed when the interpreter exits.
+    """
+
+    def __init__(
+        self,
+        max_buckets=1000,
+        flush_interval=10,
+        max_retries=5,
+        backoff=1.0,
+        max_buffered=10000,
+    ):
+        self.max_buckets = max_buckets
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_buffered = max_buffered
+        self.buffers = defaultdict(list)
+        self.dropped = defaultdict(int)
+        self._dropped_unlogged = defaultdict(int)
+        self.lock = threading.Lock()
+        self.flush_requested = threading.Event()
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def report(self, deployment_id, custom_metric_id, metric, timestamp=None):
+        """Buffer one value of a custom metric"""
+        timestamp = timestamp or datetime.now()
+        with self.lock:
+            buckets = self.buffers[(deployment_id, custom_metric_id)]
+            buckets.append({"timestamp": timestamp.isoformat(), "value": metric})
+            self._trim((deployment_id, custom_metric_id))
+            if len(buckets) >= self.max_buckets:
+                self.flush_requested.set()
+
+    def flush(self):
+        """Submit all buffered values, returns the number of values still buffered"""
+        with self.lock:
+            buffers, self.buffers = self.buffers, defaultdict(list)
+        for (deployment_id, custom_metric_id), buckets in buffers.items():
+            for start in range(0, len(buckets), self.max_buckets):
+                batch = buckets[start : start + self.max_buckets]
+                try:
+                    post_custom_metric_buckets(
+                        deployment_id,
+                        custom_metric_id,
+                        batch,
+                        max_retries=self.max_retries,
+                        backoff=self.backoff,
+                    )
+                except requests.HTTPError as e:
+                    if e.response.status_code in CM_RETRY_STATUSES:
+                        self._requeue(deployment_id, custom_metric_id, batch)
+                    else:
+                        with self.lock:
+                            self.dropped[deployment_id, custom_metric_id] += len(batch)
+                        logger.error(
+                            "Dropped %d values of custom metric %s: %s",
+                            len(batch),
+                            custom_metric_id,
+                            e,
+                        )
+                except requests.RequestException as e:
+                    logger.warning(
+                        "Custom metric %s submission failed, will retry: %s",
+                        custom_metric_id,
+                        e,
+                    )
+                    self._requeue(deployment_id, custom_metric_id, batch)
+        with self.lock:
+            dropped, self._dropped_unlogged = self._dropped_unlogged, defaultdict(int)
+            remaining = sum(len(buckets) for buckets in self.buffers.values())
+        for (_, custom_metric_id), count in dropped.items():
+            logger.error(
+                "Dropped the %d oldest values of custom metric %s, more than %d "
+                "values were waiting to be submitted",
+                count,
+                custom_metric_id,
+                self.max_buffered,
+            )
+        return remaining
+
+    def close(self):
+        """Stop the background thread and flush what is left"""
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        self.flush_requested.set()
+        self.thread.join()
+        remaining = self.flush()
+        if remaining:
+            logger.error("%d custom metric values could not be submitted", remaining)
+
+    def _requeue(self, deployment_id, custom_metric_id, buckets):
+        with self.lock:
+            key = (deployment_id, custom_metric_id)
+            self.buffers[key] = buckets + self.buffers[key]
+            self._trim(key)
+
+    def _trim(self, key):
+        # called with the lock held, keeps the newest max_buffered values
+        buckets = self.buffers[key]
+        excess = len(buckets) - self.max_buffered
+        if excess > 0:
+            del buckets[:excess]
+            self.dropped[key] += excess
+            self._dropped_unlogged[key] += excess
+
+    def _run(self):
+        while not self.closed.is_set():
+            self.flush_requested.wait(self.flush_interval)
+            self.flush_requested.clear()
+            if not self.closed.is_set():
+                self.flush()
@@ -1,8 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
 import logging
-from typing import Any, Dict
+import os
+from typing import Any, Dict, List, Optional, Union
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import requests
+from requests.adapters import HTTPAdapter
 
 logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -37,32 +43,196 @@ def flatten_json(data: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
     return flattened
 
 
+def _value_type(value: Any) -> pa.DataType:
+    # bool is checked first, as it's a subclass of int
+    if isinstance(value, bool):
+        return pa.bool_()
+    if isinstance(value, int):
+        return pa.int64()
+    if isinstance(value, float):
+        return pa.float64()
+    return pa.string()
+
+
+def _merge_types(left: pa.DataType, right: pa.DataType) -> pa.DataType:
+    if left == right or pa.types.is_null(right):
+        return left
+    if pa.types.is_null(left):
+        return right
+    numbers = (pa.int64(), pa.float64())
+    if left in numbers and right in numbers:
+        return pa.float64()
+    return pa.string()
+
+
+def _to_string(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def flatten_page(
+    records: List[Dict[str, Any]], schema: Optional[pa.Schema] = None
+) -> pa.Table:
+    """Flatten a page of trace records into a table with a stable schema.
+
+    The schema of the previous pages is grown with the columns first seen on
+    this page and widened where this page needs it (int to float, anything
+    else to string), so every page can be written and read back with the same
+    columns. Values that aren't scalar JSON, and all the values of columns
+    mixing types, are JSON-encoded to strings.
+    """
+    rows = [flatten_json(record) for record in records]
+    types = {field.name: field.type for field in schema or []}
+    for row in rows:
+        for key, value in row.items():
+            value_type = pa.null() if value is None else _value_type(value)
+            types[key] = _merge_types(types.get(key, pa.null()), value_type)
+
+    columns = {}
+    for name, column_type in types.items():
+        values = [row.get(name) for row in rows]
+        if column_type == pa.string():
+            values = [_to_string(value) for value in values]
+        columns[name] = pa.array(values, type=column_type)
+    return pa.table(columns)
+
+
+def _conform(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    # add the columns missing from an earlier page and widen the others
+    columns = [
+        (
+            table.column(field.name).cast(field.type)
+            if field.name in table.column_names
+            else pa.nulls(table.num_rows, field.type)
+        )
+        for field in schema
+    ]
+    return pa.table(columns, schema=schema)
+
+
+def _unify(tables: List[pa.Table]) -> pa.Table:
+    types: Dict[str, pa.DataType] = {}
+    for table in tables:
+        for field in table.schema:
+            types[field.name] = _merge_types(
+                types.get(field.name, pa.null()), field.type
+            )
+    schema = pa.schema(list(types.items()))
+    return pa.concat_tables([_conform(table, schema) for table in tables])
+
+
+def read_trace_pages(output_dir: str) -> pd.DataFrame:
+    """Read the pages written by get_trace_data into a single DataFrame."""
+    cursor = _read_cursor(output_dir)
+    pages = cursor["pages"] if cursor is not None else 0
+    tables = [pq.read_table(_page_path(output_dir, p)) for p in range(pages)]
+    if not tables:
+        return pd.DataFrame()
+    return _unify(tables).to_pandas()
+
+
+def _make_session(headers: Dict[str, str]) -> requests.Session:
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+    session.headers.update(headers)
+    return session
+
+
+def _read_cursor(output_dir: str) -> Optional[Dict[str, Any]]:
+    cursor_path = os.path.join(output_dir, "cursor.json")
+    if not os.path.exists(cursor_path):
+        return None
+    with open(cursor_path) as f:
+        return json.load(f)
+
+
+def _write_cursor(output_dir: str, next_url: Optional[str], pages: int) -> None:
+    # write then rename, so an interruption never leaves a partial cursor
+    cursor_path = os.path.join(output_dir, "cursor.json")
+    with open(cursor_path + ".tmp", "w") as f:
+        json.dump({"next": next_url, "pages": pages}, f)
+    os.replace(cursor_path + ".tmp", cursor_path)
+
+
+def _page_path(output_dir: str, page: int) -> str:
+    return os.path.join(output_dir, f"page_{page:06d}.parquet")
+
+
 def get_trace_data(
-    playground_id: str, headers: Dict[str, str], endpoint: str
-) -> pd.DataFrame:
+    playground_id: str,
+    headers: Dict[str, str],
+    endpoint: str,
+    page_size: int = 100,
+    output_dir: Optional[str] = None,
+    return_frame: bool = True,
+) -> Union[pd.DataFrame, str]:
+    """Export the playground trace as a DataFrame.
+
+    The next page is fetched while the current one is flattened. With
+    output_dir, each page is written to its own Parquet file together with
+    the cursor of the next page, and an interrupted export resumes from
+    that cursor. Every page is written with the schema of all the pages
+    before it, grown as new keys appear.
+
+    The pages are kept in memory to build the returned DataFrame. For
+    exports that don't fit in memory, pass return_frame=False with
+    output_dir: only output_dir is returned, and the pages can be read
+    with read_trace_pages or any Parquet reader.
+    """
+    if not return_frame and output_dir is None:
+        raise ValueError("output_dir is required when return_frame is False")
+
+    session = _make_session(headers)
+
     def _fetch_page(url: str) -> tuple[list, str]:
-        response = requests.get(url, headers=headers)
+        response = session.get(url)
         if response.status_code != 200:
             raise Exception(f"Failed to fetch data: {response.status_code}")
 
         json_data = response.json()
         return json_data.get("data", []), json_data.get("next")
 
-    all_data = []
     url = (
-        f"{endpoint}/genai/playgrounds/{playground_id}/trace/?limit=50&sortBy=timestamp"
+        f"{endpoint}/genai/playgrounds/{playground_id}/trace/"
+        f"?limit={page_size}&sortBy=timestamp"
     )
+    pages = 0
+    tables = []
+    schema = None
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        cursor = _read_cursor(output_dir)
+        if cursor is not None:
+            url, pages = cursor["next"], cursor["pages"]
+            if pages:
+                # the last page was written with the schema of all the pages
+                schema = pq.read_schema(_page_path(output_dir, pages - 1))
+            if return_frame:
+                tables = [
+                    pq.read_table(_page_path(output_dir, p)) for p in range(pages)
+                ]
+            if url:
+                logger.info(f"Resuming trace export after {pages} pages")
 
-    # Fetch all pages recursively
-    while url:
-        data_list, next_url = _fetch_page(url)
-        all_data.extend(data_list)
-        url = next_url  # If next_url is None, the loop will end
-
-    # Flatten each item in the data array
-    flattened_data = [flatten_json(item) for item in all_data]
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(_fetch_page, url) if url else None
+        while future is not None:
+            data_list, next_url = future.result()
+            # prefetch the next page while this one is flattened
+            future = executor.submit(_fetch_page, next_url) if next_url else None
 
-    # Convert to DataFrame
-    df = pd.DataFrame(flattened_data)
+            table = flatten_page(data_list, schema)
+            schema = table.schema
+            if output_dir is not None:
+                pq.write_table(table, _page_path(output_dir, pages))
+                _write_cursor(output_dir, next_url, pages + 1)
+            if return_frame:
+                tables.append(table)
+            pages += 1
 
-    return df
+    if not return_frame:
+        return output_dir
+    if not tables:
+        return pd.DataFrame()
+    return _unify(tables).to_pandas()
@@ -0,0 +1,131 @@
+# Copyright 2025 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Benchmark the JSON log formatter and the cost of a log call on the request path.
+
+Formats the stream-event record of the chat handler with orjson and with the
+standard library encoder, then times logger.info with a synchronous handler
+and with the background queue listener, writing to /dev/null and to a slow
+stream that takes 200us per write, like a congested stdout pipe.
+
+Usage:
+    uv run python scripts/benchmark_logging.py
+"""
+
+import io
+import logging
+import os
+import statistics
+import time
+from typing import Any, Callable
+
+from core.telemetry import JsonFormatter, start_queue_logging, stop_queue_logging
+from core.telemetry import logging as telemetry_logging
+
+EXTRA = {
+    "chat_id": "c-123",
+    "event": "TEXT_MESSAGE_CONTENT",
+    "delta": "token text",
+    "index": 42,
+    "meta": {"model": "gpt", "latency_ms": 12.5},
+}
+
+
+class SlowStream(io.TextIOBase):
+    """A stream that takes `delay` seconds per write."""
+
+    def __init__(self, delay: float = 0.0002):
+        self.delay = delay
+
+    def write(self, s: str) -> int:
+        time.sleep(self.delay)
+        return len(s)
+
+
+def format_time(n: int = 50000) -> float:
+    """Mean microseconds to format the stream-event record."""
+    record = logging.LogRecord(
+        "app.chat", logging.INFO, __file__, 1, "stream event %s", ("x",), None
+    )
+    record.__dict__.update(EXTRA)
+    formatter = JsonFormatter()
+    start = time.perf_counter()
+    for _ in range(n):
+        formatter.format(record)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def add_sync_handler(logger: logging.Logger, handler: logging.Handler) -> None:
+    logger.addHandler(handler)
+
+
+def add_queue_handler(logger: logging.Logger, handler: logging.Handler) -> None:
+    start_queue_logging(logger, handler, queue_size=100000)
+
+
+def call_latency(
+    setup: Callable[[logging.Logger, logging.Handler], None], stream: Any, n: int
+) -> tuple[float, float, float]:
+    """Mean, p50 and p99 microseconds spent in logger.info."""
+    logger = logging.getLogger("benchmark")
+    logger.handlers.clear()
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    setup(logger, handler)
+
+    latencies = []
+    for i in range(n):
+        start = time.perf_counter_ns()
+        logger.info("stream event %s", i, extra=EXTRA)
+        latencies.append((time.perf_counter_ns() - start) / 1000)
+    stop_queue_logging(logger)
+    logger.handlers.clear()
+
+    latencies.sort()
+    return (
+        statistics.mean(latencies),
+        latencies[len(latencies) // 2],
+        latencies[int(len(latencies) * 0.99)],
+    )
+
+
+def main() -> None:
+    if telemetry_logging.orjson is None:
+        print("orjson is not installed, only the standard library encoder is timed")
+    else:
+        print(f"format with orjson: {format_time():.1f}us")
+    orjson, telemetry_logging.orjson = telemetry_logging.orjson, None
+    try:
+        print(f"format with the standard library: {format_time():.1f}us")
+    finally:
+        telemetry_logging.orjson = orjson
+
+    print("logger.info latency, mean/p50/p99 us:")
+    with open(os.devnull, "w") as devnull:
+        for name, stream, n in [
+            ("/dev/null", devnull, 20000),
+            ("200us per write", SlowStream(), 2000),
+        ]:
+            for mode, setup in [
+                ("synchronous", add_sync_handler),
+                ("queued", add_queue_handler),
+            ]:
+                mean, p50, p99 = call_latency(setup, stream, n)
+                print(f"  {name}, {mode}: {mean:.1f}/{p50:.1f}/{p99:.1f}")
+
+
+if __name__ == "__main__":
+    main()
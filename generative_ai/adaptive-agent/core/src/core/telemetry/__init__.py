@@ -13,12 +13,15 @@
 # limitations under the License.
 
 from .logging import (
+    DroppingQueueHandler,
     FormatType,
     get_logger,
     init_logging,
     JsonFormatter,
     log_api_call,
     LogLevel,
+    start_queue_logging,
+    stop_queue_logging,
     TextFormatter,
 )
 from .uvicorn_filter import configure_uvicorn_logging
@@ -28,6 +31,9 @@ __all__ = [
     "FormatType",
     "TextFormatter",
     "JsonFormatter",
+    "DroppingQueueHandler",
+    "start_queue_logging",
+    "stop_queue_logging",
     "init_logging",
     "get_logger",
     "log_api_call",
@@ -11,16 +11,26 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from datetime import datetime, timezone
+import atexit
+import copy
+from datetime import datetime
 from enum import Enum
 from functools import wraps
 import json
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
 import sys
+import threading
 import time
 import traceback
 from typing import Any, Callable, Coroutine, Dict, Literal, ParamSpec, TypeVar, Union
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None  # type: ignore[assignment]
+
 
 class LogLevel(str, Enum):
     ERROR = "ERROR"
@@ -42,6 +52,39 @@ _ALL_EXCLUDED_LOG_RECORD_ATTRS = _STANDARD_LOG_RECORD_ATTRS.union(
 )
 
 
+def _json_default(value: Any) -> Any:
+    """Fallback for values the JSON encoder can't serialize natively."""
+    return str(value)
+
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, default=_json_default)
+# Leave datetimes and dataclasses to _json_default, as the standard library does
+_ORJSON_OPTIONS = (
+    orjson.OPT_NON_STR_KEYS
+    | orjson.OPT_PASSTHROUGH_DATETIME
+    | orjson.OPT_PASSTHROUGH_DATACLASS
+    if orjson is not None
+    else 0
+)
+
+
+def json_dumps(value: Any) -> str:
+    """
+    Serialize a value to JSON, with orjson when it is installed.
+
+    Values that aren't JSON serializable are converted with str().
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(
+                value, default=_json_default, option=_ORJSON_OPTIONS
+            ).decode()
+        except TypeError:
+            # e.g. integers over 64 bits, which the standard library handles
+            pass
+    return _json_encoder.encode(value)
+
+
 class JsonFormatter(logging.Formatter):
     """
     Custom JSON formatter for structured logging.
@@ -51,14 +94,34 @@ class JsonFormatter(logging.Formatter):
 
     def __init__(self, *args: Any, **kwargs: Any):
         super().__init__(*args, **kwargs)
+        # (second, date and time up to that second), replaced as a whole
+        self._timestamp_cache = (-1, "")
         self.default_fields: Dict[
             str, Union[Callable[[logging.LogRecord], Any], Any]
         ] = {
-            "timestamp": lambda _: datetime.now(timezone.utc).isoformat(),
+            "timestamp": self.timestamp,
             "level": lambda record: record.levelname,
             "logger": lambda record: record.name,
         }
 
+    def timestamp(self, record: logging.LogRecord) -> str:
+        """
+        ISO format UTC timestamp of the record's creation, as datetime.isoformat()
+        renders it. The date and time up to the second are reused across records.
+        """
+        second = int(record.created)
+        microsecond = round((record.created - second) * 1_000_000)
+        if microsecond >= 1_000_000:
+            second += 1
+            microsecond -= 1_000_000
+        cached_second, prefix = self._timestamp_cache
+        if second != cached_second:
+            prefix = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+            self._timestamp_cache = (second, prefix)
+        if microsecond:
+            return f"{prefix}.{microsecond:06d}+00:00"
+        return f"{prefix}+00:00"
+
     def format(self, record: logging.LogRecord) -> str:
         """
         Format the log record as JSON.
@@ -93,19 +156,20 @@ class JsonFormatter(logging.Formatter):
             }
 
         # Include only explicitly added extra fields by filtering out standard attributes
-        extra_fields = {
-            k: v
-            for k, v in record.__dict__.items()
-            if k not in _ALL_EXCLUDED_LOG_RECORD_ATTRS
-        }
-        for key, value in extra_fields.items():
-            try:
-                json.dumps(value, default=str)
+        for key, value in record.__dict__.items():
+            if key not in _ALL_EXCLUDED_LOG_RECORD_ATTRS:
                 log_data[key] = value
-            except ValueError as e:
-                log_data[key] = f"<serialization error: {str(e)}>"
 
-        return json.dumps(log_data, ensure_ascii=False, default=str)
+        try:
+            return json_dumps(log_data)
+        except (TypeError, ValueError):
+            # Find the fields that fail to serialize, e.g. circular references
+            for key, value in list(log_data.items()):
+                try:
+                    json_dumps(value)
+                except (TypeError, ValueError) as e:
+                    log_data[key] = f"<serialization error: {str(e)}>"
+            return json_dumps(log_data)
 
 
 class TextFormatter(logging.Formatter):
@@ -137,10 +201,129 @@ class TextFormatter(logging.Formatter):
         return message
 
 
+DEFAULT_QUEUE_SIZE = 10_000
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Queue handler that never blocks the thread emitting the log record.
+
+    Records are put on a bounded queue for a QueueListener to format and write on
+    its own thread. When the queue is full the record is dropped and counted in
+    `dropped`; a warning with the number of dropped records is queued as soon as
+    there is room again.
+    """
+
+    def __init__(self, queue: "queue.Queue[logging.LogRecord | None]"):
+        super().__init__(queue)
+        self.dropped = 0
+        self._unreported_drops = 0
+        self._drops_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Merge the message with its arguments, so later changes to mutable arguments
+        don't change the log. Unlike QueueHandler.prepare, the record isn't formatted
+        here and keeps its exception info for the listener's formatter.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._drops_lock:
+                self.dropped += 1
+                self._unreported_drops += 1
+            return
+
+        if self._unreported_drops:
+            with self._drops_lock:
+                dropped, self._unreported_drops = self._unreported_drops, 0
+            warning = logging.LogRecord(
+                record.name,
+                logging.WARNING,
+                __file__,
+                0,
+                "Logging queue was full, dropped %d log records",
+                (dropped,),
+                None,
+            )
+            try:
+                self.queue.put_nowait(self.prepare(warning))
+            except queue.Full:
+                with self._drops_lock:
+                    self._unreported_drops += dropped
+
+
+class _BoundedQueueListener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Wait for room instead of failing when the queue is full
+        self.queue.put(self._sentinel)
+
+
+# Listeners started by start_queue_logging, by logger name
+_queue_listeners: Dict[str, QueueListener] = {}
+_queue_listeners_lock = threading.Lock()
+
+
+def start_queue_logging(
+    logger: logging.Logger,
+    handler: logging.Handler,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+) -> DroppingQueueHandler:
+    """
+    Log through `handler` on a background thread.
+
+    Adds a DroppingQueueHandler to the logger and starts a listener thread that
+    passes the queued records to `handler`. A listener previously started for the
+    same logger is stopped first, after writing the records it has queued.
+
+    Args:
+        logger: The logger to add the queue handler to
+        handler: The handler that formats and writes the records
+        queue_size: Maximum number of records waiting to be written
+
+    Returns:
+        The queue handler added to the logger
+    """
+    records: "queue.Queue[logging.LogRecord | None]" = queue.Queue(queue_size)
+    queue_handler = DroppingQueueHandler(records)
+    listener = _BoundedQueueListener(records, handler, respect_handler_level=True)
+
+    stop_queue_logging(logger)
+    with _queue_listeners_lock:
+        listener.start()
+        _queue_listeners[logger.name] = listener
+
+    logger.addHandler(queue_handler)
+    return queue_handler
+
+
+def stop_queue_logging(logger: logging.Logger | None = None) -> None:
+    """
+    Write the queued records and stop the listener started by start_queue_logging
+    for the logger, or all of them if no logger is given.
+    """
+    with _queue_listeners_lock:
+        names = list(_queue_listeners) if logger is None else [logger.name]
+        for name in names:
+            listener = _queue_listeners.pop(name, None)
+            if listener is not None:
+                listener.stop()
+
+
+atexit.register(stop_queue_logging)
+
+
 def init_logging(
     level: LogLevel = LogLevel.INFO,
     format_type: FormatType = "text",
     stream: Any = sys.stdout,
+    queue_size: int | None = DEFAULT_QUEUE_SIZE,
 ) -> None:
     """
     Initialize the root logger globally.
@@ -153,6 +336,9 @@ def init_logging(
         level: The minimum logging level (e.g., logging.INFO, 'DEBUG').
         format_type: The format type to use ('json' or 'text').
         stream: The stream to write logs to (defaults to stdout).
+        queue_size: Maximum number of records waiting to be formatted and written
+            on a background thread (see start_queue_logging). None formats and
+            writes them on the thread that logs.
     """
     root_logger = logging.getLogger()
     root_logger.setLevel(level.value)
@@ -172,7 +358,11 @@ def init_logging(
         text_formatter.converter = time.gmtime
         handler.setFormatter(text_formatter)
 
-    root_logger.addHandler(handler)
+    if queue_size is None:
+        stop_queue_logging(root_logger)
+        root_logger.addHandler(handler)
+    else:
+        start_queue_logging(root_logger, handler, queue_size)
 
 
 def get_logger(
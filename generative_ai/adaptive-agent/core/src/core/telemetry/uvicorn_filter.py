@@ -14,7 +14,13 @@
 
 import logging
 
-from .logging import JsonFormatter, TextFormatter
+from .logging import (
+    DEFAULT_QUEUE_SIZE,
+    JsonFormatter,
+    start_queue_logging,
+    stop_queue_logging,
+    TextFormatter,
+)
 
 
 class HealthCheckFilter(logging.Filter):
@@ -38,9 +44,16 @@ class HealthCheckFilter(logging.Filter):
 
 
 def configure_uvicorn_logging(
-    log_format: str = "text", log_level: str = "INFO"
+    log_format: str = "text",
+    log_level: str = "INFO",
+    queue_size: int | None = DEFAULT_QUEUE_SIZE,
 ) -> None:
-    """Configure uvicorn logging to use our custom formatter and filter."""
+    """
+    Configure uvicorn logging to use our custom formatter and filter.
+
+    With a queue_size, records are formatted and written on a background thread
+    (see start_queue_logging) instead of the event loop.
+    """
 
     # Configure uvicorn access logger
     access_logger = logging.getLogger("uvicorn.access")
@@ -54,10 +67,15 @@ def configure_uvicorn_logging(
             TextFormatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
         )
 
-    # Add the health check filter
-    handler.addFilter(HealthCheckFilter(log_level))
-
-    access_logger.addHandler(handler)
+    if queue_size is None:
+        # Add the health check filter
+        handler.addFilter(HealthCheckFilter(log_level))
+        stop_queue_logging(access_logger)
+        access_logger.addHandler(handler)
+    else:
+        queue_handler = start_queue_logging(access_logger, handler, queue_size)
+        # Add the health check filter, before health checks are queued
+        queue_handler.addFilter(HealthCheckFilter(log_level))
     access_logger.setLevel(getattr(logging, log_level.upper()))
     access_logger.propagate = False
 
@@ -73,6 +91,10 @@ def configure_uvicorn_logging(
             TextFormatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
         )
 
-    error_logger.addHandler(handler)
+    if queue_size is None:
+        stop_queue_logging(error_logger)
+        error_logger.addHandler(handler)
+    else:
+        start_queue_logging(error_logger, handler, queue_size)
     error_logger.setLevel(getattr(logging, log_level.upper()))
     error_logger.propagate = False
@@ -0,0 +1,240 @@
+# Copyright 2025 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from datetime import datetime, timezone
+import io
+import json
+import logging
+import sys
+import threading
+import time
+from typing import Any, Iterator
+
+import pytest
+
+from core.telemetry import (
+    DroppingQueueHandler,
+    init_logging,
+    JsonFormatter,
+    LogLevel,
+    start_queue_logging,
+    stop_queue_logging,
+)
+
+
+class SlowStream(io.StringIO):
+    """A stream that takes `delay` seconds per write, like a congested pipe."""
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    def write(self, s: str) -> int:
+        time.sleep(self.delay)
+        return super().write(s)
+
+
+class BlockingHandler(logging.Handler):
+    """A handler that doesn't write anything until released."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.released = threading.Event()
+        self.records: list[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.released.wait()
+        self.records.append(record)
+
+
+@pytest.fixture
+def logger() -> Iterator[logging.Logger]:
+    logger = logging.getLogger("test_logging")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    yield logger
+    stop_queue_logging(logger)
+    logger.handlers.clear()
+
+
+@pytest.fixture
+def restore_root_logger() -> Iterator[None]:
+    root_logger = logging.getLogger()
+    handlers, level = root_logger.handlers[:], root_logger.level
+    yield
+    stop_queue_logging(root_logger)
+    root_logger.handlers[:] = handlers
+    root_logger.setLevel(level)
+
+
+def make_record(**extra: Any) -> logging.LogRecord:
+    record = logging.LogRecord(
+        "app", logging.INFO, __file__, 1, "hello %s", ("x",), None
+    )
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter_fields() -> None:
+    record = make_record(user_id=7, tags=["a", "b"], data={"k": 1.5})
+
+    log_data = json.loads(JsonFormatter().format(record))
+
+    assert log_data == {
+        "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+        "level": "INFO",
+        "logger": "app",
+        "message": "hello x",
+        "user_id": 7,
+        "tags": ["a", "b"],
+        "data": {"k": 1.5},
+    }
+
+
+@pytest.mark.parametrize(
+    "created",
+    [1_700_000_000.0, 1_700_000_000.25, 1_700_000_000.999_999_7, 1_700_000_059.000_001],
+)
+def test_json_formatter_timestamp_matches_isoformat(created: float) -> None:
+    record = make_record()
+    record.created = created
+
+    timestamp = JsonFormatter().timestamp(record)
+
+    assert timestamp == datetime.fromtimestamp(created, timezone.utc).isoformat()
+
+
+def test_json_formatter_unserializable_values() -> None:
+    circular: list[Any] = []
+    circular.append(circular)
+    record = make_record(when=datetime(2025, 1, 2), circular=circular, ok="fine")
+
+    log_data = json.loads(JsonFormatter().format(record))
+
+    assert log_data["when"] == str(datetime(2025, 1, 2))
+    assert log_data["circular"].startswith("<serialization error:")
+    assert log_data["ok"] == "fine"
+
+
+def test_json_formatter_exception() -> None:
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.LogRecord(
+            "app", logging.ERROR, __file__, 1, "failed", None, sys.exc_info()
+        )
+
+    log_data = json.loads(JsonFormatter().format(record))
+
+    assert log_data["exception"]["type"] == "ValueError"
+    assert log_data["exception"]["message"] == "boom"
+    assert "Traceback" in log_data["exception"]["traceback"]
+
+
+def test_queue_logging_writes_records_in_order(logger: logging.Logger) -> None:
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    start_queue_logging(logger, handler)
+
+    for i in range(100):
+        logger.info("record %d", i, extra={"i": i})
+    stop_queue_logging(logger)
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [line["i"] for line in lines] == list(range(100))
+    assert lines[0]["message"] == "record 0"
+
+
+def test_queue_logging_snapshots_arguments(logger: logging.Logger) -> None:
+    handler = BlockingHandler()
+    start_queue_logging(logger, handler)
+
+    items = ["a"]
+    logger.info("items: %s", items)
+    items.append("b")
+    handler.released.set()
+    stop_queue_logging(logger)
+
+    assert handler.records[0].getMessage() == "items: ['a']"
+
+
+def test_queue_logging_keeps_exception_info(logger: logging.Logger) -> None:
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    start_queue_logging(logger, handler)
+
+    try:
+        raise RuntimeError("bad")
+    except RuntimeError:
+        logger.exception("request failed")
+    stop_queue_logging(logger)
+
+    log_data = json.loads(stream.getvalue())
+    assert log_data["message"] == "request failed"
+    assert log_data["exception"]["type"] == "RuntimeError"
+
+
+def test_queue_logging_counts_drops(logger: logging.Logger) -> None:
+    handler = BlockingHandler()
+    queue_handler = start_queue_logging(logger, handler, queue_size=2)
+
+    # The listener takes the first record and blocks on it, two more fill the queue
+    logger.info("first")
+    time.sleep(0.1)
+    for i in range(10):
+        logger.info("record %d", i)
+
+    assert isinstance(queue_handler, DroppingQueueHandler)
+    assert queue_handler.dropped == 8
+
+    handler.released.set()
+    time.sleep(0.1)
+    logger.info("after")
+    stop_queue_logging(logger)
+
+    messages = [record.getMessage() for record in handler.records]
+    assert messages == [
+        "first",
+        "record 0",
+        "record 1",
+        "after",
+        "Logging queue was full, dropped 8 log records",
+    ]
+
+
+def test_init_logging_doesnt_block_on_slow_stream(restore_root_logger: None) -> None:
+    n_records = 20
+    stream = SlowStream(delay=0.01)
+    init_logging(LogLevel.INFO, "json", stream)
+    logger = logging.getLogger("test_init_logging.latency")
+
+    start = time.perf_counter()
+    for i in range(n_records):
+        logger.info("token", extra={"i": i})
+    emit_seconds = time.perf_counter() - start
+    stop_queue_logging()
+
+    # Writing takes at least n_records * delay, logging must not wait for it
+    assert emit_seconds < n_records * stream.delay / 2
+    assert len(stream.getvalue().splitlines()) == n_records
+
+
+def test_init_logging_without_queue(restore_root_logger: None) -> None:
+    stream = io.StringIO()
+    init_logging(LogLevel.INFO, "json", stream, queue_size=None)
+
+    logging.getLogger("test_init_logging.sync").info("written now")
+
+    assert json.loads(stream.getvalue())["message"] == "written now"
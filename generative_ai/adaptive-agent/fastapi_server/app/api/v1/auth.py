@@ -176,6 +176,7 @@ async def oauth_callback(
     user_repo = request.app.state.deps.user_repo
     identity_repo = request.app.state.deps.identity_repo
     auth = request.app.state.deps.auth
+    tokens: Tokens = request.app.state.deps.tokens
 
     params = request.query_params
 
@@ -274,6 +275,8 @@ async def oauth_callback(
             provider_user_id=user_profile.id,
             update=identity_update,
         )
+        # drop the access token this replica may have cached before the re-link
+        tokens.invalidate(str(identity.id))
 
         logger.info(
             "upserted identity for existing user",
@@ -341,6 +344,7 @@ async def oauth_callback(
             provider_user_id=user_profile.id,
             update=identity_update,
         )
+        tokens.invalidate(str(identity.id))
 
         logger.info("logged in user", extra={"user_id": user.id, "identity": identity})
 
@@ -506,6 +510,12 @@ async def validate_oauth_identities(
 @auth_router.post("/logout/", status_code=status.HTTP_204_NO_CONTENT)
 async def logout(request: Request) -> None:
     """Logout the current user"""
+    tokens: Tokens = request.app.state.deps.tokens
+
+    if auth_sess := request.session.get(AUTH_SESS_KEY):
+        for identity in auth_sess.get("identities") or []:
+            tokens.invalidate(identity["id"])
+
     request.session.clear()
 
     return None
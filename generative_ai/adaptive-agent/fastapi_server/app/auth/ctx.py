@@ -119,6 +119,7 @@ async def get_auth_ctx(
     api_key_validator: APIKeyValidator = request.app.state.deps.api_key_validator
     user_repo: UserRepository = request.app.state.deps.user_repo
     identity_repo: IdentityRepository = request.app.state.deps.identity_repo
+    tokens: Tokens = request.app.state.deps.tokens
 
     provider_type: ProviderType
     user_profile: Profile
@@ -197,6 +198,7 @@ async def get_auth_ctx(
                 datarobot_tenant_id=profile_metadata.get("tenant_id"),
             ),
         )
+        tokens.invalidate(str(identity.id))
 
     # reload the user account data
     user = await user_repo.get_user(user_id=identity.user_id)
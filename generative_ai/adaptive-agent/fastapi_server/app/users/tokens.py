@@ -11,7 +11,12 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+from functools import partial
 import logging
+import random
 
 from app.users.identity import IdentityRepository, IdentityUpdate
 from datarobot.auth.identity import Identity as IdentityData
@@ -26,9 +31,43 @@ class NoRefreshToken(Exception):
     """
 
 
+class RefreshRefused(Exception):
+    """
+    Exception raised by a forced refresh when the OAuth provider refuses to refresh the access token. The provider's
+    error is its cause.
+    """
+
+
+@dataclass(frozen=True)
+class CachedToken:
+    """
+    An access token kept in memory along with the moments it should be refreshed at and stops being usable
+    """
+
+    token: OAuthToken
+    refresh_at: datetime | None = None
+    expires_at: datetime | None = None
+
+    def expired(self, now: datetime) -> bool:
+        return self.expires_at is not None and now >= self.expires_at
+
+    def refresh_due(self, now: datetime) -> bool:
+        return self.refresh_at is not None and now >= self.refresh_at
+
+
 class Tokens:
     """
     An OAuth2 access token manager
+
+    Access tokens are cached in memory per identity (i.e. per user and provider). A cached token is refreshed in
+    the background once it gets within `leeway_secs` plus a random jitter of up to `refresh_jitter_secs` of its
+    expiration, so concurrent users don't refresh their tokens in lockstep. Tokens without an expiration are
+    re-read from the database once they are `max_cache_secs` old. There is at most one load or refresh in flight
+    per identity, all other callers await its result.
+
+    We may have multiple replicas of this application, and every time a replica refreshes a rotating refresh token,
+    the previous one gets invalidated. That's why the database stays the source of truth: a load always re-reads
+    the identity first and only contacts the provider if no other replica has already stored a newer token.
     """
 
     def __init__(
@@ -36,19 +75,127 @@ class Tokens:
         oauth: AsyncOAuthComponent,
         identity_repo: IdentityRepository,
         leeway_secs: int = 60,
+        refresh_jitter_secs: int = 60,
+        refresh_retry_secs: int = 5,
+        max_cache_secs: int = 300,
     ) -> None:
         self._leeway_secs = leeway_secs
+        self._refresh_jitter_secs = refresh_jitter_secs
+        self._refresh_retry_secs = refresh_retry_secs
+        self._max_cache_secs = max_cache_secs
         self._oauth = oauth
         self._identity_repo = identity_repo
 
+        self._cache: dict[str, CachedToken] = {}
+        self._inflight: dict[str, asyncio.Task[OAuthToken]] = {}
+
     async def get_access_token(
         self, identity: IdentityData, scope: str | None = None
     ) -> OAuthToken:
         """
         Get an access token for the given identity
+        """
+        now = datetime.now(timezone.utc)
+        cached = self._cache.get(str(identity.id))
+
+        if cached and not cached.expired(now):
+            if cached.refresh_due(now):
+                # the token is still usable, so let the refresh happen in the background
+                self._load_token(identity, scope, stale=cached.token)
+
+            return cached.token
+
+        task = self._load_token(identity, scope, stale=cached.token if cached else None)
+
+        # shielded so that a cancelled caller doesn't cancel the load for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    def invalidate(self, identity_id: str | int) -> None:
+        """
+        Drop the cached access token of the given identity (e.g. on logout or when the identity has been revoked).
+
+        A load that is already in flight is detached from the cache, so its result is not going to be cached either.
+        """
+        key = str(identity_id)
+
+        self._cache.pop(key, None)
+        self._inflight.pop(key, None)
+
+    def _load_token(
+        self,
+        identity: IdentityData,
+        scope: str | None,
+        stale: OAuthToken | None,
+        force: bool = False,
+    ) -> asyncio.Task[OAuthToken]:
+        key = str(identity.id)
+
+        if (task := self._inflight.get(key)) is None:
+            task = asyncio.create_task(
+                self._fetch_token(identity, scope, stale, force=force)
+            )
+            task.add_done_callback(partial(self._on_token_loaded, key))
+            self._inflight[key] = task
+
+        return task
+
+    def _on_token_loaded(self, key: str, task: asyncio.Task[OAuthToken]) -> None:
+        if self._inflight.get(key) is not task:
+            # the identity has been invalidated while the token was loading
+            return
+
+        del self._inflight[key]
+
+        if task.cancelled():
+            return
+
+        if (exc := task.exception()) is not None:
+            logger.warning(
+                "failed to load access token",
+                extra={"identity_id": key, "error": str(exc)},
+            )
+
+            # keep serving a still usable token, but don't retry the refresh on every single call
+            if cached := self._cache.get(key):
+                retry_at = datetime.now(timezone.utc) + timedelta(
+                    seconds=self._refresh_retry_secs
+                )
+                self._cache[key] = replace(cached, refresh_at=retry_at)
+
+            return
+
+        self._cache[key] = self._cache_entry(task.result())
+
+    def _cache_entry(self, token: OAuthToken) -> CachedToken:
+        if token.expires_at is None:
+            # re-read it now and then to pick up relinks and revocations made on other replicas
+            expires_at = datetime.now(timezone.utc) + timedelta(
+                seconds=self._max_cache_secs
+            )
+        else:
+            expires_at = token.expires_at
+
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+
+            expires_at -= timedelta(seconds=self._leeway_secs)
+
+        jitter = timedelta(seconds=random.uniform(0, self._refresh_jitter_secs))
+
+        return CachedToken(
+            token=token, refresh_at=expires_at - jitter, expires_at=expires_at
+        )
 
-        Assuming that we have multiple replicas of this application we can't have a safe in-memory cache here, because
-        every time a replica refresh token, it will be invalidated all previous tokens in other replicas.
+    async def _fetch_token(
+        self,
+        identity: IdentityData,
+        scope: str | None,
+        stale: OAuthToken | None,
+        force: bool = False,
+    ) -> OAuthToken:
+        """
+        Load the identity's access token from the database, refreshing it if it's expired, it's the stale one
+        we already hold or `force` is set
         """
         ctx = {
             "identity": identity,
@@ -61,8 +208,16 @@ class Tokens:
         if identity_model is None:
             raise ValueError(f"Identity with id {identity.id} not found")
 
-        if identity_model.access_token and not identity_model.access_token_expired(
-            leeway_secs=self._leeway_secs
+        if (
+            not force
+            and identity_model.access_token
+            and not identity_model.access_token_expired(leeway_secs=self._leeway_secs)
+            and (
+                stale is None
+                # a token without an expiration is only re-read, there is nothing to refresh it for
+                or stale.expires_at is None
+                or identity_model.access_token != stale.access_token
+            )
         ):
             logger.info("found actual access token", extra=ctx)
 
@@ -73,12 +228,18 @@ class Tokens:
 
         logger.info("found expired access token, refreshing", extra=ctx)
 
-        token_data = await self._oauth.refresh_access_token(
-            provider_id=identity_model.provider_id,
-            identity_id=identity_model.provider_identity_id,
-            refresh_token=identity_model.refresh_token,
-            scope=scope,
-        )
+        try:
+            token_data = await self._oauth.refresh_access_token(
+                provider_id=identity_model.provider_id,
+                identity_id=identity_model.provider_identity_id,
+                refresh_token=identity_model.refresh_token,
+                scope=scope,
+            )
+        except Exception as e:
+            if force:
+                raise RefreshRefused(str(e)) from e
+
+            raise
 
         update = IdentityUpdate(
             access_token=token_data.access_token,
@@ -102,7 +263,10 @@ class Tokens:
         Validate if the token for an identity is still valid by forcing a refresh.
 
         Unlike get_access_token, this always contacts the OAuth provider to verify
-        the authorization hasn't been revoked.
+        the authorization hasn't been revoked. The refresh is the identity's load like any other:
+        it starts once the load in flight is done, so it uses the refresh token that one stored,
+        and loads started meanwhile await it. A successful refresh caches the new access token,
+        a failed one drops the cached token as it's no longer usable.
 
         Returns:
             (is_valid, error_status_code) - status_code is None if valid or if error had no HTTP status
@@ -112,16 +276,20 @@ class Tokens:
         )
 
         if identity_model is None:
+            self.invalidate(identity.id)
             return (False, None)
 
+        while (inflight := self._inflight.get(str(identity.id))) is not None:
+            await asyncio.wait([inflight])
+
+        task = self._load_token(identity, None, stale=None, force=True)
+
         try:
-            # Force a refresh to verify the authorization is still valid
-            token_data = await self._oauth.refresh_access_token(
-                provider_id=identity_model.provider_id,
-                identity_id=identity_model.provider_identity_id,
-                refresh_token=identity_model.refresh_token,
-            )
-        except Exception as e:
+            # shielded so that a cancelled caller doesn't cancel the load for everyone else waiting on it
+            await asyncio.shield(task)
+        except RefreshRefused as refused:
+            e = refused.__cause__ or refused
+
             # Try to extract HTTP status code from the exception
             status_code = getattr(e, "status_code", None)
             if status_code is None:
@@ -137,22 +305,7 @@ class Tokens:
                     "error": str(e),
                 },
             )
+            self.invalidate(identity.id)
             return (False, status_code)
 
-        # OAuth refresh succeeded - persist the new tokens (important for rotating refresh tokens)
-        update = IdentityUpdate(
-            access_token=token_data.access_token,
-            access_token_expires_at=token_data.expires_at,
-        )
-
-        if token_data.refresh_token:
-            update.refresh_token = token_data.refresh_token
-
-        if identity_model.id:
-            await self._identity_repo.update_identity(
-                identity_id=identity_model.id, update=update
-            )
-        else:
-            raise ValueError(f"Identity must have id {identity.id}")
-
         return (True, None)
@@ -188,6 +188,14 @@ async def test__auth__oauth_callback__with_user_session(
         assert identity.provider_type == dr_oauth_data.provider.type
         assert identity.provider_user_id == dr_oauth_data.user_profile.id
 
+    # the re-linked identity must not be served a token cached before the link
+    stored_identity = await db_deps.identity_repo.get_by_external_user_id(
+        provider_type=dr_oauth_data.provider.type,
+        provider_user_id=dr_oauth_data.user_profile.id,
+    )
+    assert stored_identity
+    db_deps.tokens.invalidate.assert_called_once_with(str(stored_identity.id))  # type: ignore[attr-defined]
+
 
 async def test__auth__oauth_callback__no_user_session(
     db_deps: Deps,
@@ -228,6 +236,13 @@ async def test__auth__oauth_callback__no_user_session(
         assert identity.type == AuthSchema.OAUTH2
         assert identity.provider_user_id == dr_oauth_data.user_profile.id
 
+    stored_identity = await db_deps.identity_repo.get_by_external_user_id(
+        provider_type=dr_oauth_data.provider.type,
+        provider_user_id=dr_oauth_data.user_profile.id,
+    )
+    assert stored_identity
+    db_deps.tokens.invalidate.assert_called_once_with(str(stored_identity.id))  # type: ignore[attr-defined]
+
 
 def test__auth__get_user(
     deps: Deps,
@@ -119,6 +119,7 @@ async def test__get_auth_ctx__existing_user__new_identity(
     assert identity.type == AuthSchema.DATAROBOT
     assert identity.provider_type == ProviderType.EXTERNAL_EMAIL
     assert identity.provider_user_id == dr_user.email
+    db_deps.tokens.invalidate.assert_called_once_with(str(identity.id))  # type: ignore[attr-defined]
 
 
 async def test__get_auth_ctx__new_visit__empty_dr_ctx(db_deps: Deps) -> None:
@@ -11,17 +11,83 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
 from datetime import datetime, timedelta, UTC
+import itertools
+from typing import Callable
 from unittest.mock import AsyncMock
 
 from app import Deps
-from app.users.identity import IdentityCreate
+from app.users.identity import IdentityCreate, IdentityUpdate
 from app.users.tokens import Tokens
 from datarobot.auth.identity import Identity
 from datarobot.auth.oauth import OAuthToken
 import pytest
 
 
+class StubIdentityProvider:
+    """
+    An OAuth provider that rotates refresh tokens: every refresh issues a new refresh token
+    and invalidates the one that was used, like most providers with refresh token rotation do.
+    """
+
+    class RevokedError(Exception):
+        status_code = 401
+
+    def __init__(self, refresh_token: str, ttl_secs: int = 3600) -> None:
+        self.refresh_token = refresh_token
+        self.ttl_secs = ttl_secs
+        self.calls = 0
+        self._ids = itertools.count(1)
+
+    async def refresh_access_token(
+        self,
+        provider_id: str,
+        identity_id: str | None = None,
+        refresh_token: str | None = None,
+        scope: str | None = None,
+    ) -> OAuthToken:
+        self.calls += 1
+        # give concurrent callers a chance to pile up
+        await asyncio.sleep(0.01)
+
+        if refresh_token != self.refresh_token:
+            raise self.RevokedError(f"refresh token {refresh_token} is not valid")
+
+        token_id = next(self._ids)
+        self.refresh_token = f"refresh-token-{token_id}"
+
+        return OAuthToken(
+            access_token=f"access-token-{token_id}",
+            refresh_token=self.refresh_token,
+            expires_at=datetime.now(UTC) + timedelta(seconds=self.ttl_secs),
+        )
+
+
+async def wait_until(condition: Callable[[], bool], timeout: float = 5) -> None:
+    async def poll() -> None:
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(poll(), timeout=timeout)
+
+
+async def create_expired_identity(db_deps: Deps) -> Identity:
+    identity = await db_deps.identity_repo.create_identity(
+        IdentityCreate(
+            user_id="1",
+            provider_id="google",
+            provider_type="google",
+            provider_user_id="test-ext-user-id",
+            access_token="access-token-0",
+            access_token_expires_at=datetime.now(UTC) - timedelta(hours=1),
+            refresh_token="refresh-token-0",
+        )
+    )
+
+    return identity.to_data()
+
+
 async def test__tokens__custom_token_mgmt__no_cached_token(
     db_deps: Deps, oauth_token: OAuthToken
 ) -> None:
@@ -262,3 +328,223 @@ async def test__tokens__validate_token__db_update_fails_raises(db_deps: Deps) ->
 
     with pytest.raises(Exception, match="Database connection error"):
         await tokens.validate_token(identity.to_data())
+
+
+async def test__tokens__cache__concurrent_callers_share_one_refresh(
+    db_deps: Deps,
+) -> None:
+    identity = await create_expired_identity(db_deps)
+    provider = StubIdentityProvider(refresh_token="refresh-token-0")
+    tokens = Tokens(oauth=provider, identity_repo=db_deps.identity_repo)  # type: ignore[arg-type]
+
+    results = await asyncio.gather(
+        *(tokens.get_access_token(identity=identity) for _ in range(10))
+    )
+
+    assert provider.calls == 1
+    assert {token.access_token for token in results} == {"access-token-1"}
+
+    # the rotated refresh token must be persisted, otherwise the next refresh fails
+    updated_identity = await db_deps.identity_repo.get_identity_by_id(int(identity.id))
+
+    assert updated_identity
+    assert updated_identity.access_token == "access-token-1"
+    assert updated_identity.refresh_token == "refresh-token-1"
+
+
+async def test__tokens__cache__serves_cached_token_without_db(
+    db_deps: Deps,
+) -> None:
+    identity = await create_expired_identity(db_deps)
+    provider = StubIdentityProvider(refresh_token="refresh-token-0")
+    tokens = Tokens(oauth=provider, identity_repo=db_deps.identity_repo)  # type: ignore[arg-type]
+
+    await tokens.get_access_token(identity=identity)
+
+    db_deps.identity_repo.get_identity_by_id = AsyncMock(  # type: ignore[method-assign]
+        side_effect=Exception("Database connection error")
+    )
+
+    token = await tokens.get_access_token(identity=identity)
+
+    assert token.access_token == "access-token-1"
+    assert provider.calls == 1
+
+
+async def test__tokens__cache__proactive_refresh(
+    db_deps: Deps, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    identity = await create_expired_identity(db_deps)
+    # tokens get within the leeway + jitter window right away
+    provider = StubIdentityProvider(refresh_token="refresh-token-0", ttl_secs=90)
+    tokens = Tokens(
+        oauth=provider,  # type: ignore[arg-type]
+        identity_repo=db_deps.identity_repo,
+        leeway_secs=60,
+        refresh_jitter_secs=60,
+    )
+    monkeypatch.setattr("app.users.tokens.random.uniform", lambda a, b: b)
+
+    token = await tokens.get_access_token(identity=identity)
+    assert token.access_token == "access-token-1"
+
+    # the token is still usable, so it's returned while the refresh runs in the background
+    token = await tokens.get_access_token(identity=identity)
+    assert token.access_token == "access-token-1"
+
+    await wait_until(lambda: provider.calls >= 2 and not tokens._inflight)
+
+    token = await tokens.get_access_token(identity=identity)
+    assert token.access_token == "access-token-2"
+    assert provider.calls == 2
+
+    # the new token is due for a refresh too, so wait until it's done
+    await wait_until(lambda: not tokens._inflight)
+
+
+async def test__tokens__cache__reuses_token_rotated_by_another_replica(
+    db_deps: Deps,
+) -> None:
+    identity = await create_expired_identity(db_deps)
+    provider = StubIdentityProvider(refresh_token="refresh-token-0")
+    replica_a = Tokens(oauth=provider, identity_repo=db_deps.identity_repo)  # type: ignore[arg-type]
+    replica_b = Tokens(oauth=provider, identity_repo=db_deps.identity_repo)  # type: ignore[arg-type]
+
+    token_a = await replica_a.get_access_token(identity=identity)
+    # replica B would fail with the rotated refresh token, it must pick up the stored token instead
+    token_b = await replica_b.get_access_token(identity=identity)
+
+    assert token_a.access_token == token_b.access_token == "access-token-1"
+    assert provider.calls == 1
+
+
+async def test__tokens__cache__invalidate(
+    db_deps: Deps,
+) -> None:
+    identity = await create_expired_identity(db_deps)
+    provider = StubIdentityProvider(refresh_token="refresh-token-0")
+    tokens = Tokens(oauth=provider, identity_repo=db_deps.identity_repo)  # type: ignore[arg-type]
+
+    await tokens.get_access_token(identity=identity)
+    await db_deps.identity_repo.update_identity(
+        int(identity.id),
+        IdentityUpdate(
+            access_token="sk-relinked-token",
+            access_token_expires_at=datetime.now(UTC) + timedelta(hours=1),
+        ),
+    )
+
+    token = await tokens.get_access_token(identity=identity)
+    assert token.access_token == "access-token-1"
+
+    tokens.invalidate(identity.id)
+
+    token = await tokens.get_access_token(identity=identity)
+    assert token.access_token == "sk-relinked-token"
+    assert provider.calls == 1
+
+
+async def test__tokens__cache__rereads_token_without_expiration(
+    db_deps: Deps,
+) -> None:
+    db_identity = await db_deps.identity_repo.create_identity(
+        IdentityCreate(
+            user_id="1",
+            provider_id="google",
+            provider_type="google",
+            provider_user_id="test-ext-user-id",
+            access_token="sk-token-0",
+            refresh_token="refresh-token-0",
+        )
+    )
+    identity = db_identity.to_data()
+    provider = StubIdentityProvider(refresh_token="refresh-token-0")
+    cached = Tokens(oauth=provider, identity_repo=db_deps.identity_repo)  # type: ignore[arg-type]
+    expiring = Tokens(
+        oauth=provider,  # type: ignore[arg-type]
+        identity_repo=db_deps.identity_repo,
+        refresh_jitter_secs=0,
+        max_cache_secs=0,
+    )
+
+    for tokens in (cached, expiring):
+        token = await tokens.get_access_token(identity=identity)
+        assert token.access_token == "sk-token-0"
+
+    # another replica relinks the identity
+    await db_deps.identity_repo.update_identity(
+        int(identity.id), IdentityUpdate(access_token="sk-relinked-token")
+    )
+
+    token = await cached.get_access_token(identity=identity)
+    assert token.access_token == "sk-token-0"
+
+    # past its max age, the token is re-read without contacting the provider
+    token = await expiring.get_access_token(identity=identity)
+    assert token.access_token == "sk-relinked-token"
+    assert provider.calls == 0
+
+
+async def test__tokens__cache__invalidate_detaches_inflight_refresh(
+    db_deps: Deps,
+) -> None:
+    identity = await create_expired_identity(db_deps)
+    provider = StubIdentityProvider(refresh_token="refresh-token-0")
+    tokens = Tokens(oauth=provider, identity_repo=db_deps.identity_repo)  # type: ignore[arg-type]
+
+    pending = asyncio.create_task(tokens.get_access_token(identity=identity))
+    await asyncio.sleep(0)
+    tokens.invalidate(identity.id)
+
+    # the caller still gets its token, but it's not cached after the invalidation
+    assert (await pending).access_token == "access-token-1"
+    assert not tokens._cache
+
+
+async def test__tokens__validate_token__revoked_drops_cached_token(
+    db_deps: Deps,
+) -> None:
+    identity = await create_expired_identity(db_deps)
+    provider = StubIdentityProvider(refresh_token="refresh-token-0")
+    tokens = Tokens(oauth=provider, identity_repo=db_deps.identity_repo)  # type: ignore[arg-type]
+
+    await tokens.get_access_token(identity=identity)
+
+    # the user revokes the app on the provider side
+    provider.refresh_token = "refresh-token-revoked"
+
+    is_valid, error_code = await tokens.validate_token(identity)
+
+    assert is_valid is False
+    assert error_code == 401
+    assert not tokens._cache
+
+
+async def test__tokens__validate_token__shares_the_load_with_concurrent_callers(
+    db_deps: Deps,
+) -> None:
+    identity = await create_expired_identity(db_deps)
+    # tokens are within the leeway right away, so every caller waits for a load
+    provider = StubIdentityProvider(refresh_token="refresh-token-0", ttl_secs=30)
+    tokens = Tokens(oauth=provider, identity_repo=db_deps.identity_repo)  # type: ignore[arg-type]
+
+    # the validation starts while a refresh is in flight and callers arrive while it's refreshing
+    loading = asyncio.create_task(tokens.get_access_token(identity=identity))
+    await asyncio.sleep(0)
+    validating = asyncio.create_task(tokens.validate_token(identity))
+    await wait_until(lambda: provider.calls == 2)
+    waiting = await asyncio.gather(
+        *(tokens.get_access_token(identity=identity) for _ in range(5))
+    )
+
+    # each refresh used the refresh token rotated by the one before it
+    assert await validating == (True, None)
+    assert (await loading).access_token == "access-token-1"
+    assert {token.access_token for token in waiting} == {"access-token-2"}
+    assert provider.calls == 2
+    assert tokens._cache[str(identity.id)].token.access_token == "access-token-2"
+
+    updated_identity = await db_deps.identity_repo.get_identity_by_id(int(identity.id))
+
+    assert updated_identity
+    assert updated_identity.refresh_token == "refresh-token-2"
@@ -1,6 +1,10 @@
+import asyncio
 import datetime
+import hashlib
 import json
 import os
+import shutil
+import sqlite3
 import time
 import warnings
 
@@ -28,6 +32,7 @@ from langchain.chains.combine_documents.stuff import StuffDocumentsChain
 from langchain.chains.llm import LLMChain
 from langchain.chat_models import AzureChatOpenAI
 from langchain.embeddings.openai import OpenAIEmbeddings
+from langchain_community.callbacks import get_openai_callback
 from langchain_core.messages import HumanMessage
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
@@ -38,9 +43,10 @@ import pandas as pd
 import plotly
 import plotly.express as px
 import plotly.graph_objects as go
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.decomposition import PCA
 from sklearn.manifold import TSNE
+from sklearn.metrics import pairwise_distances_argmin_min, silhouette_score
 import streamlit as st
 import tiktoken
 
@@ -62,6 +68,14 @@ tsne_components = 2
 min_clusters = 2
 max_clusters = 10
 
+# stores with more chunks than this are clustered with MiniBatchKMeans
+minibatch_threshold = 20000
+# number of chunks sampled for the silhouette score
+silhouette_sample_size = 5000
+
+# clustering results are cached per vector database and embeddings hash
+cluster_cache_dir = "cluster_cache"
+
 # JINA_EMBEDDING_T_EN_V1 is recommend for english, SUP_SIMCSE_JA_BASE is recommend for japanese
 embedding_model = VectorDatabaseEmbeddingModel.SUP_SIMCSE_JA_BASE
 chunking_method = VectorDatabaseChunkingMethod.RECURSIVE
@@ -71,6 +85,10 @@ chunk_size = 384
 chunk_overlap_percentage = 50
 separators = ["\n\n", "\n", " "]
 
+# summarization: concurrent llm requests and persistent summary cache
+summary_concurrency = 8
+summary_cache_path = "summary_cache.sqlite"
+
 # seed
 seed = 42
 
@@ -80,7 +98,8 @@ time_sleep = 60
 
 def split_text(text):
     tokenizer = tiktoken.get_encoding("cl100k_base")
-    text = " ".join(text)
+    if not isinstance(text, str):
+        text = " ".join(text)
     tokens = tokenizer.encode(text)
     chunks = []
     startIndex = 0
@@ -91,8 +110,15 @@ def split_text(text):
     return [tokenizer.decode(chunk) for chunk in chunks]
 
 
-def generate_summaries(texts):
-    llm = AzureChatOpenAI(
+# create the summarize prompt
+summary_prompt = PromptTemplate.from_template(
+    template="""この文章を要約してください : {question}"""  # if you use english, you can input [Please summarize the following text briefly]
+)
+
+
+@st.cache_resource
+def get_llm():
+    return AzureChatOpenAI(
         deployment_name=OPENAI_DEPLOYMENT_NAME,
         openai_api_type=OPENAI_API_TYPE,
         openai_api_base=OPENAI_API_BASE["payload"]["apiToken"],
@@ -103,30 +129,119 @@ def generate_summaries(texts):
         verbose=True,
     )
 
-    # create the summarize prompt
-    prompt_template: str = (
-        """この文章を要約してください : {question}"""  # if you use english, you can input [Please summarize the following text briefly]
-    )
-    prompt = PromptTemplate.from_template(template=prompt_template)
 
-    texts_list = split_text(texts)
-    predictions = []
-    for t in texts_list:
-        prompt_formatted_str = prompt.format(question=t)
-        prediction = llm.predict(prompt_formatted_str)
-        predictions.append(prediction)
-    predictions = " ".join(predictions)
+class SummaryCache:
+    """Summaries keyed by a hash of the model and the formatted prompt."""
 
-    prompt_formatted_str = prompt.format(question=predictions)
-    predictions = llm.predict(prompt_formatted_str)
+    def __init__(self, path=summary_cache_path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, summary TEXT)"
+        )
+
+    @staticmethod
+    def key(prompt):
+        return hashlib.sha256(
+            (OPENAI_DEPLOYMENT_NAME + "\n" + prompt).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key):
+        row = self.connection.execute(
+            "SELECT summary FROM summaries WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, summary):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO summaries VALUES (?, ?)", (key, summary)
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+class Summarizer:
+    """
+    Map-reduce summarization: every token window of a text is summarized
+    concurrently, then the partial summaries are summarized again, window by
+    window, until a single summary is left.
+    """
+
+    def __init__(self, llm, cache, concurrency=summary_concurrency):
+        self.llm = llm
+        self.cache = cache
+        self.concurrency = concurrency
+        self.calls = 0
+        self.cached = 0
+
+    async def predict(self, prompt, key):
+        async with self.semaphore:
+            summary = await self.llm.apredict(prompt)
+        self.calls += 1
+        self.cache.set(key, summary)
+        return summary
+
+    async def summarize_window(self, text):
+        prompt = summary_prompt.format(question=text)
+        key = self.cache.key(prompt)
+        summary = self.cache.get(key)
+        if summary is not None:
+            self.cached += 1
+            return summary
+        # identical windows requested concurrently share one llm call
+        if key in self.pending:
+            self.cached += 1
+        else:
+            self.pending[key] = asyncio.ensure_future(self.predict(prompt, key))
+        return await self.pending[key]
 
-    return predictions
+    async def summarize(self, text):
+        summaries = await asyncio.gather(
+            *(self.summarize_window(t) for t in split_text(text))
+        )
+        while len(summaries) > 1:
+            summaries = await asyncio.gather(
+                *(self.summarize_window(t) for t in split_text(summaries))
+            )
+        return summaries[0] if summaries else ""
+
+    async def summarize_all(self, texts):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.pending = {}
+        return await asyncio.gather(*(self.summarize(text) for text in texts))
+
+
+def summarize_texts(texts):
+    """Summarize all texts concurrently; returns the summaries and a usage report."""
+    start_time = time.time()
+    cache = SummaryCache()
+    summarizer = Summarizer(get_llm(), cache)
+    try:
+        with get_openai_callback() as usage:
+            summaries = asyncio.run(summarizer.summarize_all(texts))
+    finally:
+        cache.close()
+    report = {
+        "LLM Calls": summarizer.calls,
+        "Cached Summaries": summarizer.cached,
+        "Prompt Tokens": usage.prompt_tokens,
+        "Completion Tokens": usage.completion_tokens,
+        "Total Tokens": usage.total_tokens,
+        "Wall Time (seconds)": round(time.time() - start_time, 2),
+    }
+    return summaries, report
+
+
+def generate_summaries(texts):
+    summaries, _ = summarize_texts([texts])
+    return summaries[0]
 
 
 def create_chunk_summary(df):
-    chunk = df[["index", "text_chunks"]]
-    chunk["Summary"] = chunk["text_chunks"].apply(lambda x: generate_summaries(x))
-    return chunk
+    chunk = df[["index", "text_chunks"]].copy()
+    chunk["Summary"], report = summarize_texts(list(chunk["text_chunks"]))
+    return chunk, report
 
 
 def create_cluster_summary(df, cluster_number):
@@ -136,8 +251,8 @@ def create_cluster_summary(df, cluster_number):
     text_chunks = df.groupby(["label"])["text_chunks"].agg(list).reset_index()
     cluster = cluster.merge(text_chunks, on=["label"], how="left")
     cluster["text_chunks"] = cluster["text_chunks"].astype(str)
-    cluster["Summary"] = cluster["text_chunks"].apply(lambda x: generate_summaries(x))
-    return cluster
+    cluster["Summary"], report = summarize_texts(list(cluster["text_chunks"]))
+    return cluster, report
 
 
 def convert_df(df):
@@ -190,6 +305,101 @@ def download_vectordb_embeddings(vid):
     return vdb_id, df
 
 
+def embeddings_matrix(df):
+    return np.ascontiguousarray(np.stack(df["embeddings"].to_numpy()), dtype=np.float32)
+
+
+def embeddings_hash(df, embeddings):
+    digest = hashlib.sha256(embeddings.tobytes())
+    digest.update(pd.util.hash_pandas_object(df["text_chunks"], index=False).values)
+    return digest.hexdigest()[:16]
+
+
+def project_embeddings(embeddings):
+    # the projection does not depend on the number of clusters, so it is fit once
+    pca = PCA(n_components=pca_components)
+    pca_result = pca.fit_transform(embeddings)
+    tsne = TSNE(
+        n_components=tsne_components,
+        random_state=seed,
+        init="pca",
+        learning_rate="auto",
+        perplexity=10,
+    )
+    return tsne.fit_transform(pca_result)
+
+
+def cluster_sweep(embeddings):
+    """
+    Fit KMeans for every cluster number, warm-starting each fit from the
+    previous centers plus the chunk farthest from them.
+    """
+    if len(embeddings) > minibatch_threshold:
+        model_class, model_args = MiniBatchKMeans, {"batch_size": 4096}
+    else:
+        model_class, model_args = KMeans, {}
+    sample_size = min(len(embeddings), silhouette_sample_size)
+
+    labels, scores = {}, []
+    centers = None
+    for cluster_number in range(min_clusters, max_clusters + 1):
+        if centers is None:
+            init, n_init = "k-means++", 10
+        else:
+            _, distances = pairwise_distances_argmin_min(embeddings, centers)
+            init, n_init = np.vstack([centers, embeddings[distances.argmax()]]), 1
+        kmeans = model_class(
+            n_clusters=cluster_number,
+            init=init,
+            n_init=n_init,
+            random_state=seed,
+            **model_args,
+        ).fit(embeddings)
+        centers = kmeans.cluster_centers_
+        labels[cluster_number] = kmeans.labels_
+        score = silhouette_score(
+            embeddings, kmeans.labels_, sample_size=sample_size, random_state=seed
+        )
+        scores.append({"Cluster Number": cluster_number, "Silhouette Score": score})
+    return labels, pd.DataFrame(scores)
+
+
+def create_chunk_clusters(vdb_id, df):
+    embeddings = embeddings_matrix(df)
+    cache_path = os.path.join(
+        cluster_cache_dir, vdb_id + "_" + embeddings_hash(df, embeddings)
+    )
+    file_names = [
+        "vdb_chunk_" + str(n) + ".csv" for n in range(min_clusters, max_clusters + 1)
+    ]
+    file_names.append("cluster_scores.csv")
+
+    if not all(os.path.exists(os.path.join(cache_path, f)) for f in file_names):
+        os.makedirs(cache_path, exist_ok=True)
+        labels, scores = cluster_sweep(embeddings)
+        tsne = project_embeddings(embeddings)
+        # the embeddings are written to every file, so format them to text once
+        df_text = df.copy()
+        df_text["embeddings"] = df_text["embeddings"].astype(str)
+        for cluster_number, cluster_labels in labels.items():
+            df_embedding = df_text.copy()
+            df_embedding["label"] = cluster_labels
+            df_embedding = df_embedding.reset_index()
+            df_embedding["tsne1"] = tsne[:, 0]
+            df_embedding["tsne0"] = tsne[:, 1]
+            df_embedding["index"] = df_embedding["index"] + 1
+            df_embedding["label"] = df_embedding["label"].astype("category")
+            df_embedding.to_csv(
+                os.path.join(cache_path, "vdb_chunk_" + str(cluster_number) + ".csv"),
+                index=False,
+            )
+        scores.to_csv(os.path.join(cache_path, "cluster_scores.csv"), index=False)
+
+    for f in file_names:
+        shutil.copy(os.path.join(cache_path, f), f)
+    return pd.read_csv("cluster_scores.csv")
+
+
 # ======================================== Start Streamlit ========================================#
 st.title("Chunk Clustering In RAG")
 
@@ -217,9 +427,6 @@ with tab1:
             with st.status("Processing...", expanded=True) as status:
                 start_time = time.time()
                 for i in range(1):
-                    file_path = "vdb_chunk_" + str(max_clusters) + ".csv"
-                    if os.path.exists(file_path):
-                        continue
                     vdb_id, df = download_vectordb_embeddings(vid)
                     end_time = time.time()
                     st.write(
@@ -227,30 +434,8 @@ with tab1:
                     )
 
                     st.write("Creating Kmeans Cluster For Chunks...")
-                    for cluster_number in range(min_clusters, max_clusters + 1):
-                        df_embedding = df.copy()
-                        kmeans = KMeans(
-                            n_clusters=cluster_number, random_state=seed
-                        ).fit(list(df_embedding["embeddings"]))
-                        df_embedding["label"] = kmeans.labels_
-                        df_embedding = df_embedding.reset_index()
-                        pca = PCA(n_components=pca_components)
-                        pca_result = pca.fit_transform(list(df_embedding["embeddings"]))
-                        tsne = TSNE(
-                            n_components=tsne_components,
-                            random_state=seed,
-                            init="pca",
-                            learning_rate="auto",
-                            perplexity=10,
-                        )
-                        tsne = tsne.fit_transform(pca_result)
-                        df_embedding["tsne1"] = tsne[:, 0]
-                        df_embedding["tsne0"] = tsne[:, 1]
-                        df_embedding["index"] = df_embedding["index"] + 1
-                        df_embedding["label"] = df_embedding["label"].astype("category")
-                        df_embedding.to_csv(
-                            "vdb_chunk_" + str(cluster_number) + ".csv", index=False
-                        )
+                    scores = create_chunk_clusters(vdb_id, df)
+                    st.write(scores)
 
                 end_time = time.time()
                 st.write(
@@ -293,30 +478,8 @@ with tab1:
                     )
 
                     st.write("Creating Kmeans Cluster For Chunks...")
-                    for cluster_number in range(min_clusters, max_clusters + 1):
-                        df_embedding = df.copy()
-                        kmeans = KMeans(
-                            n_clusters=cluster_number, random_state=seed
-                        ).fit(list(df_embedding["embeddings"]))
-                        df_embedding["label"] = kmeans.labels_
-                        df_embedding = df_embedding.reset_index()
-                        pca = PCA(n_components=pca_components)
-                        pca_result = pca.fit_transform(list(df_embedding["embeddings"]))
-                        tsne = TSNE(
-                            n_components=tsne_components,
-                            random_state=seed,
-                            init="pca",
-                            learning_rate="auto",
-                            perplexity=10,
-                        )
-                        tsne = tsne.fit_transform(pca_result)
-                        df_embedding["tsne1"] = tsne[:, 0]
-                        df_embedding["tsne0"] = tsne[:, 1]
-                        df_embedding["index"] = df_embedding["index"] + 1
-                        df_embedding["label"] = df_embedding["label"].astype("category")
-                        df_embedding.to_csv(
-                            "vdb_chunk_" + str(cluster_number) + ".csv", index=False
-                        )
+                    scores = create_chunk_clusters(vdb_id, df)
+                    st.write(scores)
 
                 end_time = time.time()
                 st.write(
@@ -345,7 +508,8 @@ with tab2:
                     continue
                 st.write("Start Cluster:", cluster_number)
                 df_cluster = pd.read_csv("vdb_chunk_" + str(cluster_number) + ".csv")
-                cluster = create_cluster_summary(df_cluster, cluster_number)
+                cluster, report = create_cluster_summary(df_cluster, cluster_number)
+                st.write(report)
                 cluster.to_csv(
                     "cluster_summary_" + str(cluster_number) + ".csv", index=False
                 )
@@ -375,7 +539,8 @@ with tab3:
                     continue
 
                 df_embedding = pd.read_csv("vdb_chunk_" + str(min_clusters) + ".csv")
-                chunk = create_chunk_summary(df_embedding)
+                chunk, report = create_chunk_summary(df_embedding)
+                st.write(report)
                 chunk.to_csv("chunk_summary.csv", index=False)
 
             end_time = time.time()
@@ -396,6 +561,12 @@ with tab4:
         )  # color="label",
         st.plotly_chart(fig, use_container_width=True)
 
+    if os.path.isfile("cluster_scores.csv"):
+        scores = pd.read_csv("cluster_scores.csv")
+        score = scores.loc[scores["Cluster Number"] == cluster_id, "Silhouette Score"]
+        if not score.empty:
+            st.write("Silhouette Score: ", round(score.iloc[0], 4))
+
     if os.path.isfile("chunk_summary.csv"):
         chunk_summary = pd.read_csv("chunk_summary.csv")
         chunk = df[["label", "index"]]
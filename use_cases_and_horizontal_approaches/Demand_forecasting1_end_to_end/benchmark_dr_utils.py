@@ -0,0 +1,173 @@
+"""
+Benchmark series profiling and spike detection in dr_utils
+
+Times make_series_stats and identify_spikes on synthetic daily series with
+random gaps, missing, zero and negative targets, at 10k, 100k and 1M series
+by default. Up to --compare-up-to series, the previous groupby implementation
+is timed too and both outputs are checked to be equal. Series ids are
+integers to keep the 1M series frame within a few GB of memory.
+
+Usage:
+    python benchmark_dr_utils.py [--series 10000 100000 1000000]
+        [--max-length 24] [--compare-up-to 10000]
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from dr_utils import identify_spikes, make_series_stats
+
+
+def groupby_series_stats(data, date_col, series_id, target, freq=1):
+    """The previous make_series_stats, with gap mode ties going to the smallest gap"""
+
+    def gap_mode(x):
+        modes = x.mode()
+        return modes.min() if len(modes) else pd.NaT
+
+    data_tmp = data.copy()
+    data_tmp.sort_values([series_id, date_col], inplace=True)
+    data_tmp["gap"] = data_tmp.groupby(series_id)[date_col].diff()
+    data_mode = (
+        data_tmp.groupby(series_id)[["gap"]]
+        .agg(gap_mode=("gap", gap_mode))
+        .reset_index()
+    )
+    data_tmp = data_tmp.merge(data_mode, how="left", on=series_id)
+    data_tmp["gap_uncommon"] = (
+        (data_tmp["gap"] != data_tmp["gap_mode"])
+        & (data_tmp["gap"]).notna()
+        & (data_tmp["gap_mode"]).notna()
+    ) * 1
+
+    data_agg = data_tmp.groupby(series_id).agg(
+        rows=(series_id, "count"),
+        date_col_min=(date_col, "min"),
+        date_col_max=(date_col, "max"),
+        target_mean=(target, "mean"),
+        nunique=(target, "nunique"),
+        missing=(target, lambda x: x.isna().sum()),
+        zeros=(target, lambda x: (x == 0).sum()),
+        negatives=(target, lambda x: (x < 0).sum()),
+        gap_max=("gap", "max"),
+        gap_mode=("gap_mode", "first"),
+        gap_uncommon_count=("gap_uncommon", "sum"),
+    )
+
+    data_agg["duration"] = (
+        (data_agg["date_col_max"] - data_agg["date_col_min"]).dt.days
+    ) // freq + 1
+    data_agg["rows_to_duration"] = data_agg["rows"] / data_agg["duration"]
+    data_agg["missing_rate"] = data_agg["missing"] / data_agg["rows"]
+    data_agg["zeros_rate"] = data_agg["zeros"] / data_agg["rows"]
+
+    data_agg.reset_index(inplace=True)
+
+    return data_agg
+
+
+def groupby_spikes(data, date_col, series_id, target, span=5, threshold=4):
+    """The previous identify_spikes"""
+    tmp = data[[series_id, date_col, target]].copy()
+    tmp.sort_values([series_id, date_col], inplace=True, kind="mergesort")
+    tmp.reset_index(drop=True, inplace=True)
+
+    tmp["EWA"] = (
+        tmp.groupby(series_id)[target]
+        .transform(lambda x: x.ewm(span=span).mean())
+        .fillna(value=1)
+    )
+    tmp["SD"] = (
+        tmp.groupby(series_id)[target]
+        .transform(lambda x: x.ewm(span=span).std())
+        .fillna(value=1)
+    )
+    tmp["Threshold"] = threshold * tmp["SD"]
+    tmp["Spike"] = np.where(tmp[target] >= tmp["Threshold"], 1, 0)
+
+    return tmp
+
+
+def make_series(n_series, max_length, seed=0):
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, max_length + 1, n_series)
+    series = np.repeat(np.arange(n_series), lengths)
+    # consecutive days with an occasional skipped day or week, from a random
+    # first day
+    firsts = np.cumsum(lengths) - lengths
+    steps = rng.choice([1, 1, 1, 1, 1, 1, 2, 7], len(series))
+    steps[firsts] = rng.integers(0, 30, n_series)
+    elapsed = np.cumsum(steps)
+    days = elapsed - np.repeat(elapsed[firsts] - steps[firsts], lengths)
+
+    target = rng.poisson(3, len(series)).astype("float64")
+    target[rng.random(len(series)) < 0.05] = -1
+    target[rng.random(len(series)) < 0.1] = np.nan
+    # nanosecond dates, as pd.to_datetime returns them
+    dates = np.datetime64("2020-01-01", "ns") + days.astype("timedelta64[D]")
+
+    data = pd.DataFrame(
+        {
+            "series": series,
+            "date": dates,
+            "target": target,
+        }
+    )
+    # unsorted input, as read from a warehouse
+    return data.iloc[rng.permutation(len(data))].reset_index(drop=True)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--series", type=int, nargs="+", default=[10000, 100000, 1000000]
+    )
+    parser.add_argument("--max-length", type=int, default=24)
+    parser.add_argument("--compare-up-to", type=int, default=10000)
+    args = parser.parse_args()
+
+    columns = ("date", "series", "target")
+    print("series    rows        function           new s    groupby s")
+    for n_series in args.series:
+        data = make_series(n_series, args.max_length)
+        compare = n_series <= args.compare_up_to
+        for name, new, old, check in [
+            (
+                "make_series_stats",
+                make_series_stats,
+                groupby_series_stats,
+                lambda a, b: pd.testing.assert_frame_equal(a, b, check_dtype=False),
+            ),
+            (
+                "identify_spikes",
+                identify_spikes,
+                groupby_spikes,
+                lambda a, b: pd.testing.assert_frame_equal(
+                    a, b, check_dtype=False, rtol=1e-9
+                ),
+            ),
+        ]:
+            result, seconds = timed(new, data, *columns)
+            old_seconds = ""
+            if compare:
+                expected, old_seconds = timed(old, data, *columns)
+                check(expected, result)
+                old_seconds = f"{old_seconds:.2f}"
+            print(
+                f"{n_series:<9} {len(data):<11} {name:<18} {seconds:<8.2f} "
+                f"{old_seconds}"
+            )
+            del result
+
+
+if __name__ == "__main__":
+    main()
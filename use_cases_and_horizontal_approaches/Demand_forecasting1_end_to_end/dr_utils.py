@@ -1,3 +1,4 @@
+from concurrent.futures import as_completed, ThreadPoolExecutor
 from datetime import datetime as dt
 import os
 import time
@@ -24,6 +25,7 @@ dr_red = "#BE3C28"
 dr_green = "#00c96e"
 
 max_wait = 3600
+max_workers = 4
 
 
 def prepare_demo_tables_in_db(
@@ -102,34 +104,103 @@ def create_dataset_from_data_source(
 #################################################################
 
 
+def _sort_series(data, date_col, series_id, columns):
+    """Sorts rows by series and date and finds where each series starts
+
+    Returns the sorted frame, the sorted series keys and the start position
+    of every series segment, so per-series statistics can be computed with
+    segment reductions on NumPy arrays instead of groupby lambdas.
+    """
+    tmp = data[columns].sort_values([series_id, date_col], kind="mergesort")
+    tmp.reset_index(drop=True, inplace=True)
+
+    codes, keys = pd.factorize(tmp[series_id], sort=True)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+
+    return tmp, keys, codes, starts
+
+
+def _segment_gap_mode(codes, gaps, valid, n_series):
+    """Most frequent gap per series, ties going to the smallest gap"""
+    gap_mode = np.full(n_series, np.iinfo(np.int64).min)
+    seg, gap = codes[valid], gaps[valid]
+    if len(seg) == 0:
+        return gap_mode
+
+    order = np.lexsort((gap, seg))
+    seg, gap = seg[order], gap[order]
+    run_starts = np.flatnonzero(
+        np.r_[True, (seg[1:] != seg[:-1]) | (gap[1:] != gap[:-1])]
+    )
+    run_counts = np.diff(np.r_[run_starts, len(seg)])
+    run_seg, run_gap = seg[run_starts], gap[run_starts]
+
+    best = np.lexsort((run_gap, -run_counts, run_seg))
+    first = np.r_[True, run_seg[best][1:] != run_seg[best][:-1]]
+    gap_mode[run_seg[best][first]] = run_gap[best][first]
+
+    return gap_mode
+
+
 def make_series_stats(data, date_col, series_id, target, freq=1):
-    data_tmp = data.copy()
-    data_tmp.sort_values([series_id, date_col], inplace=True)
-    data_tmp["gap"] = data_tmp.groupby(series_id)[date_col].diff()
-    data_mode = (
-        data_tmp.groupby(series_id)[["gap"]]
-        .agg(gap_mode=("gap", pd.Series.mode))
-        .reset_index()
+    tmp, keys, codes, starts = _sort_series(
+        data[data[series_id].notna()],
+        date_col,
+        series_id,
+        [series_id, date_col, target],
+    )
+    n_series = len(keys)
+    nat = np.iinfo(np.int64).min
+
+    values = tmp[target].to_numpy(dtype="float64")
+    is_missing = np.isnan(values)
+    filled = np.where(is_missing, 0.0, values)
+
+    dates = tmp[date_col].to_numpy(dtype="datetime64[ns]").view("int64")
+    is_nat = dates == nat
+
+    # gaps between consecutive dates of the same series
+    gaps = np.full(len(dates), nat)
+    same_series = np.r_[False, codes[1:] == codes[:-1]]
+    gap_valid = same_series & ~is_nat & ~np.r_[False, is_nat[:-1]]
+    gaps[1:] = np.where(gap_valid[1:], dates[1:] - dates[:-1], nat)
+    gap_mode = _segment_gap_mode(codes, gaps, gap_valid, n_series)
+    gap_uncommon = gap_valid & (gap_mode[codes] != nat) & (gaps != gap_mode[codes])
+
+    # number of distinct non-missing target values per series
+    order = np.lexsort((values, codes))
+    sorted_values, sorted_codes = values[order], codes[order]
+    is_new_value = np.r_[
+        True,
+        (sorted_codes[1:] != sorted_codes[:-1])
+        | (sorted_values[1:] != sorted_values[:-1]),
+    ] & ~np.isnan(sorted_values)
+
+    rows = np.diff(np.r_[starts, len(tmp)])
+    missing = np.add.reduceat(is_missing.astype("int64"), starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        target_mean = np.add.reduceat(filled, starts) / (rows - missing)
+
+    date_min = np.minimum.reduceat(
+        np.where(is_nat, np.iinfo(np.int64).max, dates), starts
     )
-    data_tmp = data_tmp.merge(data_mode, how="left", on=series_id)
-    data_tmp["gap_uncommon"] = (
-        (data_tmp["gap"] != data_tmp["gap_mode"])
-        & (data_tmp["gap"]).notna()
-        & (data_tmp["gap_mode"]).notna()
-    ) * 1
-
-    data_agg = data_tmp.groupby(series_id).agg(
-        rows=(series_id, "count"),
-        date_col_min=(date_col, min),
-        date_col_max=(date_col, max),
-        target_mean=(target, "mean"),
-        nunique=(target, "nunique"),
-        missing=(target, lambda x: x.isna().sum()),
-        zeros=(target, lambda x: (x == 0).sum()),
-        negatives=(target, lambda x: (x < 0).sum()),
-        gap_max=("gap", max),
-        gap_mode=("gap_mode", pd.Series.mode),
-        gap_uncommon_count=("gap_uncommon", sum),
+    date_min[date_min == np.iinfo(np.int64).max] = nat
+
+    data_agg = pd.DataFrame(
+        {
+            "rows": rows,
+            "date_col_min": date_min.view("datetime64[ns]"),
+            "date_col_max": np.maximum.reduceat(dates, starts).view("datetime64[ns]"),
+            "target_mean": target_mean,
+            "nunique": np.add.reduceat(is_new_value.astype("int64"), starts),
+            "missing": missing,
+            "zeros": np.add.reduceat((values == 0).astype("int64"), starts),
+            "negatives": np.add.reduceat((values < 0).astype("int64"), starts),
+            "gap_max": np.maximum.reduceat(gaps, starts).view("timedelta64[ns]"),
+            "gap_mode": gap_mode.view("timedelta64[ns]"),
+            "gap_uncommon_count": np.add.reduceat(gap_uncommon.astype("int64"), starts),
+        },
+        index=pd.Index(keys, name=series_id),
     )
 
     data_agg["duration"] = (
@@ -144,21 +215,84 @@ def make_series_stats(data, date_col, series_id, target, freq=1):
     return data_agg
 
 
-def identify_spikes(data, date_col, series_id, target, span=5, threshold=4):
-    tmp = data[[series_id, date_col, target]].copy()
-    tmp.sort_values([series_id, date_col], inplace=True)
-    tmp.reset_index(drop=True, inplace=True)
+def _segment_ewm_mean_std(values, starts, span):
+    """Exponentially weighted mean and std of every series in one pass
+
+    Matches `x.ewm(span=span).mean()` and `x.ewm(span=span).std()` applied
+    to each series. Series are processed side by side, one time step at a
+    time, so the number of Python iterations is the length of the longest
+    series rather than the number of rows.
+    """
+    decay = 1.0 - 2.0 / (span + 1.0)
+    lengths = np.diff(np.r_[starts, len(values)])
+
+    # longest series first, so the series still active at a step are a prefix
+    order = np.argsort(-lengths, kind="stable")
+    seg_starts, seg_lengths = starts[order], lengths[order]
+    n_series = len(starts)
+
+    mean = np.full(n_series, np.nan)
+    cov = np.zeros(n_series)
+    old_wt = np.ones(n_series)
+    sum_wt = np.ones(n_series)
+    sum_wt2 = np.ones(n_series)
+    nobs = np.zeros(n_series, dtype="int64")
+
+    ewm_mean = np.full(len(values), np.nan)
+    ewm_std = np.full(len(values), np.nan)
+
+    for step in range(seg_lengths.max() if n_series else 0):
+        k = np.searchsorted(-seg_lengths, -step, side="left")
+        idx = seg_starts[:k] + step
+        x = values[idx]
+        is_obs = ~np.isnan(x)
+        has_mean = ~np.isnan(mean[:k])
+
+        sum_wt[:k][has_mean] *= decay
+        sum_wt2[:k][has_mean] *= decay * decay
+        old_wt[:k][has_mean] *= decay
+
+        upd = np.flatnonzero(has_mean & is_obs)
+        old_mean, cur, wt = mean[upd], x[upd], old_wt[upd]
+        new_mean = np.where(
+            old_mean != cur, (wt * old_mean + cur) / (wt + 1.0), old_mean
+        )
+        cov[upd] = (
+            wt * (cov[upd] + (old_mean - new_mean) ** 2) + (cur - new_mean) ** 2
+        ) / (wt + 1.0)
+        mean[upd] = new_mean
+        sum_wt[upd] += 1.0
+        sum_wt2[upd] += 1.0
+        old_wt[upd] += 1.0
+
+        first = np.flatnonzero(~has_mean & is_obs)
+        mean[first] = x[first]
+        nobs[:k] += is_obs
+
+        numerator = sum_wt[:k] ** 2
+        denominator = numerator - sum_wt2[:k]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            var = np.where(denominator > 0, numerator / denominator * cov[:k], np.nan)
+        active = nobs[:k] >= 1
+        ewm_mean[idx] = np.where(active, mean[:k], np.nan)
+        ewm_std[idx] = np.where(active, np.sqrt(np.maximum(var, 0.0)), np.nan)
 
-    tmp["EWA"] = (
-        tmp.groupby(series_id)[target]
-        .transform(lambda x: x.ewm(span=span).mean())
-        .fillna(value=1)
+    return ewm_mean, ewm_std
+
+
+def identify_spikes(data, date_col, series_id, target, span=5, threshold=4):
+    tmp, _, codes, starts = _sort_series(
+        data, date_col, series_id, [series_id, date_col, target]
     )
-    tmp["SD"] = (
-        tmp.groupby(series_id)[target]
-        .transform(lambda x: x.ewm(span=span).std())
-        .fillna(value=1)
+
+    ewm_mean, ewm_std = _segment_ewm_mean_std(
+        tmp[target].to_numpy(dtype="float64"), starts, span
     )
+    # rows without a series id are not part of any series
+    ewm_mean[codes == -1] = np.nan
+    ewm_std[codes == -1] = np.nan
+    tmp["EWA"] = np.where(np.isnan(ewm_mean), 1, ewm_mean)
+    tmp["SD"] = np.where(np.isnan(ewm_std), 1, ewm_std)
     tmp["Threshold"] = threshold * tmp["SD"]
     tmp["Spike"] = np.where(tmp[target] >= tmp["Threshold"], 1, 0)
 
@@ -197,7 +331,96 @@ def save_project_meta(file_to_save, results):
     df_results.to_csv(file_to_save, header=not os.path.isfile(file_to_save), mode="a")
 
 
-def run_projects(data, params, description=None, file_to_save=None):
+def load_project_meta(file_to_save):
+    """Loads the projects saved with `save_project_meta`
+
+    Args:
+        file_to_save (str): path to the csv file with the project meta-data
+
+    Returns:
+        dict: dictionary with the projects, in the same format as `run_projects`
+    """
+    if file_to_save is None or not os.path.isfile(file_to_save):
+        return {}
+
+    # the "all series" rows have no cluster, so without explicit dtypes the
+    # cluster columns may come back as floats and not match the cluster names
+    df_results = pd.read_csv(
+        file_to_save,
+        index_col="project_id",
+        dtype={"cluster_id": str, "cluster_name": str},
+    )
+    df_results = df_results[~df_results.index.duplicated(keep="last")]
+    df_results = df_results.astype(object).where(df_results.notna(), None)
+
+    results = {}
+    for pid, vals in df_results.to_dict("index").items():
+        vals["project"] = dr.Project.get(pid)
+        results[pid] = vals
+    return results
+
+
+def run_concurrently(func, items, max_workers=max_workers, on_result=None):
+    """Calls `func` on every item with a bounded pool of threads
+
+    Args:
+        func (callable): function to call with each item
+        items (dict): dictionary of {key: item}
+        max_workers (int, optional): maximum number of concurrent calls
+        on_result (callable, optional): called with (key, result) in the calling
+            thread as soon as each call succeeds, e.g. to checkpoint progress
+
+    Returns:
+        tuple: dictionaries of {key: result} and {key: error} for the failed calls
+    """
+    results, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(func, item): key for key, item in items.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                errors[key] = e
+                continue
+            if on_result is not None:
+                on_result(key, results[key])
+    return results, errors
+
+
+def report_errors(errors, action):
+    """Prints a summary of the failed calls returned by `run_concurrently`"""
+    if not errors:
+        return
+    print(f"{len(errors)} failed to {action}:")
+    for key, e in errors.items():
+        print(f"  {key}: {e}")
+
+
+def run_projects(
+    data,
+    params,
+    description=None,
+    file_to_save=None,
+    max_workers=max_workers,
+):
+    """Runs one project, a segmented project or a project per cluster
+
+    Projects of a factory (one per cluster) are created concurrently. When
+    `file_to_save` is provided, every project is saved as soon as it starts
+    and clusters already saved there with the same description are not
+    created again, so an interrupted factory can be resumed.
+
+    Args:
+        data (dr.Dataset, pd.DataFrame, path to a local file):
+        params (dict):
+        description (str, optional): Defaults to None.
+        file_to_save (str, optional): Defaults to None.
+        max_workers (int, optional): maximum number of projects created concurrently
+
+    Returns:
+        dict: dictionary with the projects
+    """
     if params.get("cluster_id") is None:
         proj = run_project(data, params)
         results = {
@@ -225,13 +448,30 @@ def run_projects(data, params, description=None, file_to_save=None):
             }
         }
     else:
-        results = {}
         cluster_id = params["cluster_id"]
-        for cl in sorted(data[cluster_id].unique()):
-            try:
-                data_tmp = data[data[cluster_id] == cl].copy()
-                proj = run_project(data_tmp, params, notes=f"_{cluster_id}_{cl}")
-                results[proj.id] = {
+
+        # projects of this factory saved by a previous, interrupted run
+        results = {
+            pid: vals
+            for pid, vals in load_project_meta(file_to_save).items()
+            if vals["project_type"] == "factory part"
+            and vals["cluster_id"] == cluster_id
+            and vals["description"] == description
+        }
+        done = {str(vals["cluster_name"]) for vals in results.values()}
+        if done:
+            print(f"{len(done)} projects already created, resuming")
+
+        clusters = {
+            cl: data_tmp
+            for cl, data_tmp in data.groupby(cluster_id, sort=True)
+            if str(cl) not in done
+        }
+
+        def run_cluster_project(cl):
+            proj = run_project(clusters[cl], params, notes=f"_{cluster_id}_{cl}")
+            return {
+                proj.id: {
                     "project": proj,
                     "project_name": proj.project_name,
                     "project_type": "factory part",
@@ -239,20 +479,56 @@ def run_projects(data, params, description=None, file_to_save=None):
                     "cluster_name": cl,
                     "description": description,
                 }
-            except Exception as e:
-                print(f"The project creation error for the cluster {cluster_id}: {cl}")
-                print()
-                print(str(e))
+            }
+
+        def save_result(cl, result):
+            results.update(result)
+            if file_to_save is not None:
+                save_project_meta(file_to_save, result)
+
+        _, errors = run_concurrently(
+            run_cluster_project,
+            {cl: cl for cl in clusters},
+            max_workers=max_workers,
+            on_result=save_result,
+        )
+        report_errors(
+            {f"{cluster_id}: {cl}": e for cl, e in errors.items()}, "create a project"
+        )
+        return results
+
     if file_to_save is not None:
         save_project_meta(file_to_save, results)
-        # df_results = pd.DataFrame(results).T
-        # df_results.index.name = 'project_id'
-        # cols = ['project', 'project_name', 'project_type', 'cluster_id', 'cluster_name', 'description']
-        # df_results = df_results[cols].copy()
-        # df_results.to_csv(file_to_save, header=not os.path.isfile(file_to_save), mode='a')
     return results
 
 
+def wait_for_projects(projects_dct, poll_interval=60, timeout=None):
+    """Waits for Autopilot to finish in all projects, polling them together
+
+    Args:
+        projects_dct (dict): the dictionary with projects
+        poll_interval (int, optional): seconds between two status checks. Defaults to 60.
+        timeout (int, optional): seconds to wait before giving up. Defaults to None.
+
+    Returns:
+        list: ids of the projects still running when the timeout was reached
+    """
+    start = time.time()
+    running = {pid: vals["project"] for pid, vals in projects_dct.items()}
+    while running:
+        statuses, errors = run_concurrently(lambda p: p.get_status(), running)
+        report_errors(errors, "get the project status")
+        for pid, status in statuses.items():
+            if status["autopilot_done"]:
+                print(str(dt.now()), "done:", running.pop(pid).project_name)
+
+        if not running or (timeout is not None and time.time() - start > timeout):
+            break
+        time.sleep(poll_interval)
+
+    return list(running)
+
+
 def run_project(data, params, notes=""):
     """Runs a project based on provided data and params
 
@@ -391,17 +667,24 @@ def get_leaderboard(proj, metrics=[], rename_proj_metric=False):
     return model_scores
 
 
-def make_deployments(projects_dct, file_to_save=None, feature_drift_enabled=False):
+def make_deployments(
+    projects_dct,
+    file_to_save=None,
+    feature_drift_enabled=False,
+    max_workers=max_workers,
+):
     """
     Args:
         projects_dct (dict): the dictionary with projects
         file_to_save (str, optional): Defaults to None.
+        max_workers (int, optional): maximum number of deployments created concurrently
 
     Returns:
         dict: dictionary with the projects and related deployments
     """
     deployments_dct = projects_dct.copy()
-    for cl, vals in deployments_dct.items():
+
+    def deploy(vals):
         project = vals["project"]
 
         if vals["project_type"] == "segmented":
@@ -409,17 +692,23 @@ def make_deployments(projects_dct, file_to_save=None, feature_drift_enabled=Fals
         else:
             model_id = None
 
-        deployment = make_deployment(
+        return make_deployment(
             project,
             name=project.project_name,
             model_id=model_id,
             feature_drift_enabled=feature_drift_enabled,
         )
+
+    deployments, errors = run_concurrently(
+        deploy, deployments_dct, max_workers=max_workers
+    )
+    report_errors(errors, "create a deployment")
+    for cl, deployment in deployments.items():
         deployments_dct[cl]["deployment_id"] = deployment.id
         deployments_dct[cl]["deployment"] = deployment
 
     if file_to_save is not None:
-        df_log = pd.DataFrame(deployments_dct).T
+        df_log = pd.DataFrame({cl: deployments_dct[cl] for cl in deployments}).T
         df_log.index.name = "project_id"
         cols = [
             "project",
@@ -548,31 +837,38 @@ def create_preds_job_definitions(
     schedule=None,
     passthrough_columns_set="all",
     passthrough_columns=None,
+    max_workers=max_workers,
 ):
-    for pid, vals in deployments.items():
+    def create(vals):
         print(
             str(dt.now()),
             "start:",
             vals["project_name"],
             "create predictions job definition",
         )
-        deployment = vals["deployment"]
+        return create_preds_job_definition(
+            vals["deployment"],
+            intake_settings,
+            output_settings,
+            enabled=enabled,
+            schedule=schedule,
+            passthrough_columns_set=passthrough_columns_set,
+            passthrough_columns=passthrough_columns,
+        )
 
-        if vals["project_type"] in ("all series", "segmented"):
-            preds_job_def = create_preds_job_definition(
-                deployment,
-                intake_settings,
-                output_settings,
-                enabled=enabled,
-                schedule=schedule,
-                passthrough_columns_set=passthrough_columns_set,
-                passthrough_columns=passthrough_columns,
-            )
-            deployments[pid]["preds_job_def"] = preds_job_def
-            deployments[pid]["preds_job_def_id"] = preds_job_def.id
-        else:
-            # todo
-            pass
+    # todo: factory parts
+    to_create = {
+        pid: vals
+        for pid, vals in deployments.items()
+        if vals["project_type"] in ("all series", "segmented")
+    }
+    preds_job_defs, errors = run_concurrently(
+        create, to_create, max_workers=max_workers
+    )
+    report_errors(errors, "create a predictions job definition")
+    for pid, preds_job_def in preds_job_defs.items():
+        deployments[pid]["preds_job_def"] = preds_job_def
+        deployments[pid]["preds_job_def_id"] = preds_job_def.id
 
     return deployments
 
@@ -707,7 +1003,7 @@ def make_train_preds_from_model(
 
 
 def make_train_preds_from_projects(
-    projects_dct, data_train, date_col, series_id, target
+    projects_dct, data_train, date_col, series_id, target, max_workers=max_workers
 ):
     """requests training predictions from the specified projects and
        combines with corresponding training data
@@ -718,12 +1014,14 @@ def make_train_preds_from_projects(
         date_col (str):
         series_id (str):
         target (str):
+        max_workers (int, optional): maximum number of projects processed concurrently
 
     Returns:
         pd.DataFrame
     """
-    preds = []
-    for _, vals in projects_dct.items():
+
+    def train_preds(vals):
+        preds = []
         print(str(dt.now()), "start:", vals["project_name"], "training predictions")
         project = vals["project"]
         cluster_id = vals["cluster_id"]
@@ -798,6 +1096,18 @@ def make_train_preds_from_projects(
             preds_tmp = data_tmp.merge(preds_tmp, on=[series_id, date_col])
             preds.append(preds_tmp.copy())
 
+        return preds
+
+    project_preds, errors = run_concurrently(
+        train_preds, projects_dct, max_workers=max_workers
+    )
+    report_errors(errors, "make training predictions")
+    preds = [
+        p for pid in projects_dct if pid in project_preds for p in project_preds[pid]
+    ]
+    if not preds:
+        return pd.DataFrame()
+
     return pd.concat(preds, ignore_index=True, sort=False)
 
 
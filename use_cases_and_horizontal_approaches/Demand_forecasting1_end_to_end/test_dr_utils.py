@@ -0,0 +1,173 @@
+"""
+Project factory launching and polling in dr_utils against a stubbed client
+
+run_project and dr.Project.get are replaced by doubles, so the tests check the
+concurrency budget of run_projects, the resume from the save_project_meta
+checkpoint, the failure summary and the single polling loop of
+wait_for_projects without a DataRobot connection. Run with `python -m pytest`
+from this folder.
+"""
+
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import dr_utils
+
+
+class FakeProject:
+    def __init__(self, pid, statuses=()):
+        self.id = pid
+        self.project_name = f"name_{pid}"
+        self.statuses = list(statuses)
+        self.status_calls = 0
+
+    def get_status(self):
+        self.status_calls += 1
+        status = self.statuses.pop(0) if self.statuses else {"autopilot_done": True}
+        if isinstance(status, Exception):
+            raise status
+        return status
+
+
+class FakeClient:
+    """
+    Stands in for run_project and dr.Project.get, recording the clusters a
+    project is created for and the largest number of concurrent creations.
+    """
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.created = []
+        self.projects = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def run_project(self, data, params, notes=""):
+        cluster = data[params["cluster_id"]].iloc[0]
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(0.02)
+            if cluster in self.fail:
+                raise RuntimeError(f"upload of {cluster} failed")
+            project = FakeProject(f"p{cluster}")
+            with self.lock:
+                self.created.append(cluster)
+                self.projects[project.id] = project
+            return project
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def get_project(self, pid):
+        return self.projects[pid]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(dr_utils, "run_project", client.run_project)
+    monkeypatch.setattr(dr_utils.dr.Project, "get", client.get_project)
+    return client
+
+
+def make_data(n_clusters=10):
+    return pd.DataFrame(
+        {
+            "cluster": [cl for cl in range(n_clusters) for _ in range(3)],
+            "series": range(3 * n_clusters),
+            "sales": 1.0,
+        }
+    )
+
+
+PARAMS = {"target": "sales", "cluster_id": "cluster"}
+
+
+def test_run_projects_bounds_concurrent_creations(client):
+    results = dr_utils.run_projects(make_data(), PARAMS, max_workers=3)
+
+    assert sorted(client.created) == list(range(10))
+    assert 1 < client.max_in_flight <= 3
+    assert sorted(vals["cluster_name"] for vals in results.values()) == list(range(10))
+    assert {vals["project_type"] for vals in results.values()} == {"factory part"}
+
+
+def test_run_projects_reports_failures_and_resumes(client, tmp_path, capsys):
+    file_to_save = tmp_path / "projects.csv"
+    client.fail = {3, 7}
+
+    results = dr_utils.run_projects(
+        make_data(), PARAMS, description="v1", file_to_save=file_to_save
+    )
+
+    assert len(results) == 8
+    out = capsys.readouterr().out
+    assert "2 failed to create a project:" in out
+    assert "cluster: 3: upload of 3 failed" in out
+    assert "cluster: 7: upload of 7 failed" in out
+    assert len(pd.read_csv(file_to_save)) == 8
+
+    client.fail = set()
+    client.created = []
+    results = dr_utils.run_projects(
+        make_data(), PARAMS, description="v1", file_to_save=file_to_save
+    )
+
+    # only the clusters missing from the checkpoint are created again
+    assert sorted(client.created) == [3, 7]
+    assert "8 projects already created, resuming" in capsys.readouterr().out
+    assert sorted(str(vals["cluster_name"]) for vals in results.values()) == [
+        str(cl) for cl in range(10)
+    ]
+    assert all(vals["project"] is client.projects[pid] for pid, vals in results.items())
+    assert len(pd.read_csv(file_to_save)) == 10
+
+    # a different description starts a new factory
+    client.created = []
+    dr_utils.run_projects(
+        make_data(), PARAMS, description="v2", file_to_save=file_to_save
+    )
+    assert sorted(client.created) == list(range(10))
+
+
+def test_wait_for_projects_polls_all_projects_together(monkeypatch, capsys):
+    sleeps = []
+    monkeypatch.setattr(dr_utils.time, "sleep", sleeps.append)
+    running = {"autopilot_done": False}
+    projects = {
+        "a": FakeProject("a", [running]),
+        "b": FakeProject("b", [running, RuntimeError("502"), running]),
+        "c": FakeProject("c"),
+    }
+
+    still_running = dr_utils.wait_for_projects(
+        {pid: {"project": p} for pid, p in projects.items()}, poll_interval=5
+    )
+
+    assert still_running == []
+    # one sleep per polling round, not one per project
+    assert sleeps == [5, 5, 5]
+    assert [p.status_calls for p in projects.values()] == [2, 4, 1]
+    assert "1 failed to get the project status:" in capsys.readouterr().out
+
+
+def test_wait_for_projects_returns_running_projects_on_timeout(monkeypatch):
+    clock = iter(range(0, 1000, 10))
+    monkeypatch.setattr(dr_utils.time, "time", lambda: next(clock))
+    monkeypatch.setattr(dr_utils.time, "sleep", lambda seconds: None)
+    projects = {
+        "a": FakeProject("a", [{"autopilot_done": False}] * 10),
+        "b": FakeProject("b"),
+    }
+
+    still_running = dr_utils.wait_for_projects(
+        {pid: {"project": p} for pid, p in projects.items()}, timeout=25
+    )
+
+    assert still_running == ["a"]
@@ -102,34 +102,103 @@ def create_dataset_from_data_source(
 #################################################################
 
 
+def _sort_series(data, date_col, series_id, columns):
+    """Sorts rows by series and date and finds where each series starts
+
+    Returns the sorted frame, the sorted series keys and the start position
+    of every series segment, so per-series statistics can be computed with
+    segment reductions on NumPy arrays instead of groupby lambdas.
+    """
+    tmp = data[columns].sort_values([series_id, date_col], kind="mergesort")
+    tmp.reset_index(drop=True, inplace=True)
+
+    codes, keys = pd.factorize(tmp[series_id], sort=True)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+
+    return tmp, keys, codes, starts
+
+
+def _segment_gap_mode(codes, gaps, valid, n_series):
+    """Most frequent gap per series, ties going to the smallest gap"""
+    gap_mode = np.full(n_series, np.iinfo(np.int64).min)
+    seg, gap = codes[valid], gaps[valid]
+    if len(seg) == 0:
+        return gap_mode
+
+    order = np.lexsort((gap, seg))
+    seg, gap = seg[order], gap[order]
+    run_starts = np.flatnonzero(
+        np.r_[True, (seg[1:] != seg[:-1]) | (gap[1:] != gap[:-1])]
+    )
+    run_counts = np.diff(np.r_[run_starts, len(seg)])
+    run_seg, run_gap = seg[run_starts], gap[run_starts]
+
+    best = np.lexsort((run_gap, -run_counts, run_seg))
+    first = np.r_[True, run_seg[best][1:] != run_seg[best][:-1]]
+    gap_mode[run_seg[best][first]] = run_gap[best][first]
+
+    return gap_mode
+
+
 def make_series_stats(data, date_col, series_id, target, freq=1):
-    data_tmp = data.copy()
-    data_tmp.sort_values([series_id, date_col], inplace=True)
-    data_tmp["gap"] = data_tmp.groupby(series_id)[date_col].diff()
-    data_mode = (
-        data_tmp.groupby(series_id)[["gap"]]
-        .agg(gap_mode=("gap", pd.Series.mode))
-        .reset_index()
+    tmp, keys, codes, starts = _sort_series(
+        data[data[series_id].notna()],
+        date_col,
+        series_id,
+        [series_id, date_col, target],
     )
-    data_tmp = data_tmp.merge(data_mode, how="left", on=series_id)
-    data_tmp["gap_uncommon"] = (
-        (data_tmp["gap"] != data_tmp["gap_mode"])
-        & (data_tmp["gap"]).notna()
-        & (data_tmp["gap_mode"]).notna()
-    ) * 1
-
-    data_agg = data_tmp.groupby(series_id).agg(
-        rows=(series_id, "count"),
-        date_col_min=(date_col, min),
-        date_col_max=(date_col, max),
-        target_mean=(target, "mean"),
-        nunique=(target, "nunique"),
-        missing=(target, lambda x: x.isna().sum()),
-        zeros=(target, lambda x: (x == 0).sum()),
-        negatives=(target, lambda x: (x < 0).sum()),
-        gap_max=("gap", max),
-        gap_mode=("gap_mode", pd.Series.mode),
-        gap_uncommon_count=("gap_uncommon", sum),
+    n_series = len(keys)
+    nat = np.iinfo(np.int64).min
+
+    values = tmp[target].to_numpy(dtype="float64")
+    is_missing = np.isnan(values)
+    filled = np.where(is_missing, 0.0, values)
+
+    dates = tmp[date_col].to_numpy(dtype="datetime64[ns]").view("int64")
+    is_nat = dates == nat
+
+    # gaps between consecutive dates of the same series
+    gaps = np.full(len(dates), nat)
+    same_series = np.r_[False, codes[1:] == codes[:-1]]
+    gap_valid = same_series & ~is_nat & ~np.r_[False, is_nat[:-1]]
+    gaps[1:] = np.where(gap_valid[1:], dates[1:] - dates[:-1], nat)
+    gap_mode = _segment_gap_mode(codes, gaps, gap_valid, n_series)
+    gap_uncommon = gap_valid & (gap_mode[codes] != nat) & (gaps != gap_mode[codes])
+
+    # number of distinct non-missing target values per series
+    order = np.lexsort((values, codes))
+    sorted_values, sorted_codes = values[order], codes[order]
+    is_new_value = np.r_[
+        True,
+        (sorted_codes[1:] != sorted_codes[:-1])
+        | (sorted_values[1:] != sorted_values[:-1]),
+    ] & ~np.isnan(sorted_values)
+
+    rows = np.diff(np.r_[starts, len(tmp)])
+    missing = np.add.reduceat(is_missing.astype("int64"), starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        target_mean = np.add.reduceat(filled, starts) / (rows - missing)
+
+    date_min = np.minimum.reduceat(
+        np.where(is_nat, np.iinfo(np.int64).max, dates), starts
+    )
+    date_min[date_min == np.iinfo(np.int64).max] = nat
+
+    data_agg = pd.DataFrame(
+        {
+            "rows": rows,
+            "date_col_min": date_min.view("datetime64[ns]"),
+            "date_col_max": np.maximum.reduceat(dates, starts).view("datetime64[ns]"),
+            "target_mean": target_mean,
+            "nunique": np.add.reduceat(is_new_value.astype("int64"), starts),
+            "missing": missing,
+            "zeros": np.add.reduceat((values == 0).astype("int64"), starts),
+            "negatives": np.add.reduceat((values < 0).astype("int64"), starts),
+            "gap_max": np.maximum.reduceat(gaps, starts).view("timedelta64[ns]"),
+            "gap_mode": gap_mode.view("timedelta64[ns]"),
+            "gap_uncommon_count": np.add.reduceat(gap_uncommon.astype("int64"), starts),
+        },
+        index=pd.Index(keys, name=series_id),
     )
 
     data_agg["duration"] = (
@@ -144,21 +213,84 @@ def make_series_stats(data, date_col, series_id, target, freq=1):
     return data_agg
 
 
-def identify_spikes(data, date_col, series_id, target, span=5, threshold=4):
-    tmp = data[[series_id, date_col, target]].copy()
-    tmp.sort_values([series_id, date_col], inplace=True)
-    tmp.reset_index(drop=True, inplace=True)
+def _segment_ewm_mean_std(values, starts, span):
+    """Exponentially weighted mean and std of every series in one pass
+
+    Matches `x.ewm(span=span).mean()` and `x.ewm(span=span).std()` applied
+    to each series. Series are processed side by side, one time step at a
+    time, so the number of Python iterations is the length of the longest
+    series rather than the number of rows.
+    """
+    decay = 1.0 - 2.0 / (span + 1.0)
+    lengths = np.diff(np.r_[starts, len(values)])
+
+    # longest series first, so the series still active at a step are a prefix
+    order = np.argsort(-lengths, kind="stable")
+    seg_starts, seg_lengths = starts[order], lengths[order]
+    n_series = len(starts)
+
+    mean = np.full(n_series, np.nan)
+    cov = np.zeros(n_series)
+    old_wt = np.ones(n_series)
+    sum_wt = np.ones(n_series)
+    sum_wt2 = np.ones(n_series)
+    nobs = np.zeros(n_series, dtype="int64")
+
+    ewm_mean = np.full(len(values), np.nan)
+    ewm_std = np.full(len(values), np.nan)
+
+    for step in range(seg_lengths.max() if n_series else 0):
+        k = np.searchsorted(-seg_lengths, -step, side="left")
+        idx = seg_starts[:k] + step
+        x = values[idx]
+        is_obs = ~np.isnan(x)
+        has_mean = ~np.isnan(mean[:k])
+
+        sum_wt[:k][has_mean] *= decay
+        sum_wt2[:k][has_mean] *= decay * decay
+        old_wt[:k][has_mean] *= decay
+
+        upd = np.flatnonzero(has_mean & is_obs)
+        old_mean, cur, wt = mean[upd], x[upd], old_wt[upd]
+        new_mean = np.where(
+            old_mean != cur, (wt * old_mean + cur) / (wt + 1.0), old_mean
+        )
+        cov[upd] = (
+            wt * (cov[upd] + (old_mean - new_mean) ** 2) + (cur - new_mean) ** 2
+        ) / (wt + 1.0)
+        mean[upd] = new_mean
+        sum_wt[upd] += 1.0
+        sum_wt2[upd] += 1.0
+        old_wt[upd] += 1.0
+
+        first = np.flatnonzero(~has_mean & is_obs)
+        mean[first] = x[first]
+        nobs[:k] += is_obs
+
+        numerator = sum_wt[:k] ** 2
+        denominator = numerator - sum_wt2[:k]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            var = np.where(denominator > 0, numerator / denominator * cov[:k], np.nan)
+        active = nobs[:k] >= 1
+        ewm_mean[idx] = np.where(active, mean[:k], np.nan)
+        ewm_std[idx] = np.where(active, np.sqrt(np.maximum(var, 0.0)), np.nan)
+
+    return ewm_mean, ewm_std
 
-    tmp["EWA"] = (
-        tmp.groupby(series_id)[target]
-        .transform(lambda x: x.ewm(span=span).mean())
-        .fillna(value=1)
+
+def identify_spikes(data, date_col, series_id, target, span=5, threshold=4):
+    tmp, _, codes, starts = _sort_series(
+        data, date_col, series_id, [series_id, date_col, target]
     )
-    tmp["SD"] = (
-        tmp.groupby(series_id)[target]
-        .transform(lambda x: x.ewm(span=span).std())
-        .fillna(value=1)
+
+    ewm_mean, ewm_std = _segment_ewm_mean_std(
+        tmp[target].to_numpy(dtype="float64"), starts, span
     )
+    # rows without a series id are not part of any series
+    ewm_mean[codes == -1] = np.nan
+    ewm_std[codes == -1] = np.nan
+    tmp["EWA"] = np.where(np.isnan(ewm_mean), 1, ewm_mean)
+    tmp["SD"] = np.where(np.isnan(ewm_std), 1, ewm_std)
     tmp["Threshold"] = threshold * tmp["SD"]
     tmp["Spike"] = np.where(tmp[target] >= tmp["Threshold"], 1, 0)
 
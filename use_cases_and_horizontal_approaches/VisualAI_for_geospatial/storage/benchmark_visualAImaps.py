@@ -0,0 +1,114 @@
+"""
+Benchmark the raster chips of the VisualAI training and scoring data
+
+Writes synthetic float32, int16 and float64 (with NaN nodata) GeoTIFFs and
+crops them to random square cells, with the previous per-cell path
+(rasterio.mask.mask and plt.imsave for every cell) and with generate_chips
+on a process pool. Reports both timings and the number of chips that are not
+pixel-identical. Files are written to a temporary folder.
+
+Usage:
+    python benchmark_visualAImaps.py [--cells 5000] [--width 3000]
+        [--height 2000] [--cell-size 50]
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+import tempfile
+import time
+
+import geopandas as gpd
+from matplotlib import pyplot as plt
+import numpy as np
+from PIL import Image
+import rasterio as rio
+from rasterio import mask
+from rasterio.transform import from_origin
+
+from visualAImaps import generate_chips
+
+PIXEL_SIZE = 100
+
+
+def write_raster(path, dtype, nodata, width, height, rng):
+    array = (rng.random((height, width)) * 1000).astype(dtype)
+    if nodata is not None and np.isnan(nodata):
+        array[rng.random(array.shape) < 0.01] = np.nan
+    with rio.open(
+        path,
+        "w",
+        driver="GTiff",
+        height=height,
+        width=width,
+        count=1,
+        dtype=dtype,
+        crs="EPSG:3857",
+        transform=from_origin(0, height * PIXEL_SIZE, PIXEL_SIZE, PIXEL_SIZE),
+        nodata=nodata,
+    ) as dst:
+        dst.write(array, 1)
+
+
+def per_cell_chips(cells, raster, fnames, cmap="viridis"):
+    """The previous path, one generate_chip call per cell"""
+    for cell, fname in zip(cells, fnames):
+        chip = mask.mask(raster, [cell], crop=True)[0][0]
+        plt.imsave(fname=fname, arr=chip, cmap=cmap)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--cells", type=int, default=5000)
+    parser.add_argument("--width", type=int, default=3000)
+    parser.add_argument("--height", type=int, default=2000)
+    parser.add_argument(
+        "--cell-size", type=int, default=50, help="cell side length in pixels"
+    )
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    half = args.cell_size * PIXEL_SIZE / 2
+    centres = gpd.points_from_xy(
+        rng.uniform(half, args.width * PIXEL_SIZE - half, args.cells),
+        rng.uniform(half, args.height * PIXEL_SIZE - half, args.cells),
+    )
+    cells = gpd.GeoSeries(centres).buffer(half, cap_style=3)
+
+    print(
+        f"{args.cells} cells of {args.cell_size}x{args.cell_size} pixels, "
+        f"{args.width}x{args.height} rasters"
+    )
+    print("raster    per-cell s  generate_chips s  mismatched chips")
+    with tempfile.TemporaryDirectory() as folder:
+        for dtype, nodata in [
+            ("float32", -9999.0),
+            ("int16", None),
+            ("float64", np.nan),
+        ]:
+            path = os.path.join(folder, f"{dtype}.tif")
+            write_raster(path, dtype, nodata, args.width, args.height, rng)
+            expected = [os.path.join(folder, f"old_{i}.png") for i in range(args.cells)]
+            fnames = [os.path.join(folder, f"new_{i}.png") for i in range(args.cells)]
+
+            with rio.open(path) as raster:
+                start = time.perf_counter()
+                per_cell_chips(cells, raster, expected)
+                per_cell_seconds = time.perf_counter() - start
+
+                start = time.perf_counter()
+                with ProcessPoolExecutor() as executor:
+                    generate_chips(cells, raster, fnames, executor=executor)
+                seconds = time.perf_counter() - start
+
+            mismatched = sum(
+                not np.array_equal(
+                    np.asarray(Image.open(old)), np.asarray(Image.open(new))
+                )
+                for old, new in zip(expected, fnames)
+            )
+            print(f"{dtype:<9} {per_cell_seconds:<11.2f} {seconds:<17.2f} {mismatched}")
+
+
+if __name__ == "__main__":
+    main()
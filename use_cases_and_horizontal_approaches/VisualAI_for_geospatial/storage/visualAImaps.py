@@ -1,3 +1,7 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import hashlib
+from itertools import islice
 import os
 from pathlib import Path
 import zipfile
@@ -7,9 +11,10 @@ import geopandas as gpd
 from matplotlib import pyplot as plt
 import numpy as np
 import pandas as pd
+from PIL import Image
 import rasterio as rio
-from rasterio import mask
 from rasterio.features import rasterize
+import shapely
 from shapely import wkt
 import yaml
 
@@ -80,33 +85,33 @@ def load_and_process_facilities(reg_dic, params, reg_outline):
 
 
 def add_raster_data_to_training_data(
-    training_data, raster_names, rasters, reg_path_images
+    training_data, raster_names, rasters, reg_path_images, processes=None
 ):
-    for j in range(len(raster_names)):
-        training_data[raster_names[j]] = ""
-        for i, row in training_data.iterrows():
-            row_index = i
-            name = raster_names[j] + str(row_index) + ".png"
-            path = reg_path_images + name
-            point = row.geometry
-            generate_chip(point, rasters[j], path)
-            training_data.at[i, raster_names[j]] = "/images/" + name
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for j in range(len(raster_names)):
+            names = [raster_names[j] + str(i) + ".png" for i in training_data.index]
+            generate_chips(
+                training_data.geometry,
+                rasters[j],
+                [reg_path_images + name for name in names],
+                executor=executor,
+            )
+            training_data[raster_names[j]] = ["/images/" + name for name in names]
 
     return training_data
 
 
 def add_raster_data_to_scoring_data(
-    training_data, raster_names, rasters, reg_path_images
+    training_data, raster_names, rasters, reg_path_images, processes=None
 ):
-    for j in range(len(raster_names)):
-        training_data[raster_names[j]] = ""
-        for i, row in training_data.iterrows():
-            row_index = i
-            name = raster_names[j] + str(row_index) + ".png"
-            path = reg_path_images + name
-            point = row.geometry
-            generate_chip(point, rasters[j], path)
-            training_data.at[i, raster_names[j]] = reg_path_images + name
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for j in range(len(raster_names)):
+            paths = [
+                reg_path_images + raster_names[j] + str(i) + ".png"
+                for i in training_data.index
+            ]
+            generate_chips(training_data.geometry, rasters[j], paths, executor=executor)
+            training_data[raster_names[j]] = paths
 
     return training_data
 
@@ -170,12 +175,10 @@ def create_scoring_data(reg_dic, sampling=1):
         reg_path_images = OUTPUT_FOLDER + str(params["reg"]) + "/images/"
         Path(reg_path_images).mkdir(parents=True, exist_ok=True)
 
-        scoring_data = make_grid(reg_outline, params["reg_chip"] * 1000)
-        scoring_data = gpd.GeoDataFrame(geometry=gpd.GeoSeries(scoring_data))
+        # only the cells fully inside the region are scored
+        scoring_data = make_grid(reg_outline, params["reg_chip"] * 1000, within=True)
+        scoring_data = gpd.GeoDataFrame(geometry=scoring_data)
         scoring_data.columns = ["geometry"]
-        scoring_data["inside_region"] = scoring_data.within(reg_outline)
-        scoring_data = scoring_data[scoring_data["inside_region"] == True]
-        scoring_data.drop(columns=["inside_region"], inplace=True)
 
         scoring_data = scoring_data.sample(int(sampling * scoring_data.shape[0]))
 
@@ -344,7 +347,10 @@ def reproject_raster(in_path, out_path, crs):
     return out_path
 
 
+@lru_cache(maxsize=None)
 def get_country_outline(country_name, crs, CHIP_SIDE_LENGTH=5):
+    # the outline is cached per (country, crs, buffer) and prepared, so
+    # repeated spatial predicates against it are fast
     world_filepath = gpd.datasets.get_path("naturalearth_lowres")
     world = gpd.read_file(world_filepath).to_crs(crs)
     country_geom = (
@@ -353,19 +359,173 @@ def get_country_outline(country_name, crs, CHIP_SIDE_LENGTH=5):
         .reset_index(drop=True)
         .loc[0]
     )
+    shapely.prepare(country_geom)
     return country_geom
 
 
-def generate_chip(point, raster, fname, cmap="viridis", **kwargs):
-    df_chip = mask.mask(raster, [point], crop=True)[0][0]
-    plt.imsave(fname=fname, arr=df_chip, cmap=cmap, **kwargs)
+# number of raster bands kept by read_raster_array, the training and scoring
+# chips of a region reuse the same few rasters
+RASTER_CACHE_SIZE = 4
+
+
+def _memmap_path(raster, memmap_dir):
+    # rasters with the same file name in different folders, or a file rewritten
+    # since it was last read, get their own memmap file
+    name = raster.name
+    key = name
+    if os.path.isfile(name):
+        name = os.path.abspath(name)
+        key = f"{name}:{os.path.getmtime(name)}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return os.path.join(memmap_dir, f"{Path(name).stem}-{digest}.npy")
+
+
+def _read_band(raster, memmap_dir=None):
+    if memmap_dir is None:
+        return raster.read(1)
+    array = np.lib.format.open_memmap(
+        _memmap_path(raster, memmap_dir),
+        mode="w+",
+        dtype=raster.dtypes[0],
+        shape=raster.shape,
+    )
+    for _, window in raster.block_windows(1):
+        array[window.toslices()] = raster.read(1, window=window)
+    return array
+
+
+@lru_cache(maxsize=RASTER_CACHE_SIZE)
+def _read_raster_file(path, mtime, memmap_dir=None):
+    # the modification time is part of the key, so a rewritten file is read again
+    with rio.open(path) as raster:
+        return _read_band(raster, memmap_dir)
+
+
+def read_raster_array(raster, memmap_dir=None):
+    """
+    Read the first band of a raster once and keep it for all the chips.
+    The last RASTER_CACHE_SIZE bands read from files are cached by path and
+    modification time. With memmap_dir, the band is stored in a memory-mapped
+    file there instead of in memory, for rasters that don't fit in RAM.
+    """
+    if not os.path.isfile(raster.name):
+        return _read_band(raster, memmap_dir)
+    return _read_raster_file(raster.name, os.path.getmtime(raster.name), memmap_dir)
+
+
+def colormap_lut(cmap="viridis"):
+    """
+    Lookup table with the colors plt.imsave uses for a colormap: the N colors
+    of the map followed by the under, over and bad (NaN) colors.
+    """
+    colormap = plt.get_cmap(cmap)
+    indices = np.r_[np.arange(colormap.N), -1, colormap.N, 0]
+    lut = colormap(indices, bytes=True)
+    lut[-1] = colormap(np.nan, bytes=True)
+    return lut
+
+
+def apply_colormap(chip, lut):
+    """
+    Colour a chip like plt.imsave: values are normalized between the chip's
+    min and max and mapped to the lookup table from colormap_lut.
+    """
+    n_colors = len(lut) - 3
+    dtype = (
+        chip.dtype
+        if chip.dtype.kind == "f"
+        else np.promote_types(chip.dtype, np.float32)
+    )
+    values = chip.astype(dtype)
+
+    # like matplotlib, any NaN in the chip makes the whole chip transparent
+    # limits are float64 and the chip is updated in place, as in matplotlib,
+    # so the colours are rounded the same way
+    vmin, vmax = np.float64(values.min()), np.float64(values.max())
+    if vmin == vmax:
+        values = np.zeros_like(values)
+    else:
+        values -= vmin
+        values /= vmax - vmin
+    values *= n_colors
+    values[values == n_colors] = n_colors - 1
+
+    with np.errstate(invalid="ignore"):
+        indices = values.astype(int)
+    indices[values < 0] = n_colors
+    indices[values >= n_colors] = n_colors + 1
+    indices[np.isnan(values)] = n_colors + 2
+    return lut[indices]
+
+
+def _save_png(args):
+    fname, rgba = args
+    Image.fromarray(rgba).save(fname, format="png")
+
+
+def generate_chips(
+    cells, raster, fnames, cmap="viridis", executor=None, memmap_dir=None
+):
+    """
+    Crop the raster to every square cell and save each chip as a PNG, with the
+    same pixels as rasterio.mask.mask(crop=True) followed by plt.imsave.
+
+    Each chip is sliced straight from the raster's pixel array with a window
+    computed from the cell bounds, pixels whose centre is outside the cell are
+    set to nodata (as rasterio.mask.mask does) and the colormap is applied
+    with a lookup table. PNGs are encoded on the executor when one is given.
+    """
+    array = read_raster_array(raster, memmap_dir)
+    nodata = raster.nodata if raster.nodata is not None else 0
+    lut = colormap_lut(cmap)
+
+    # cell bounds in pixel coordinates
+    bounds = np.asarray(gpd.GeoSeries(cells).bounds)
+    inverse = ~raster.transform
+    cols, rows = [], []
+    for x, y in [(0, 1), (2, 1), (2, 3), (0, 3)]:
+        col, row = inverse * (bounds[:, x], bounds[:, y])
+        cols.append(col)
+        rows.append(row)
+    col_min, col_max = np.min(cols, axis=0), np.max(cols, axis=0)
+    row_min, row_max = np.min(rows, axis=0), np.max(rows, axis=0)
+
+    col_start = np.clip(np.floor(col_min).astype(int), 0, raster.width)
+    col_stop = np.clip(np.ceil(col_max).astype(int), 0, raster.width)
+    row_start = np.clip(np.floor(row_min).astype(int), 0, raster.height)
+    row_stop = np.clip(np.ceil(row_max).astype(int), 0, raster.height)
+    if np.any((col_stop <= col_start) | (row_stop <= row_start)):
+        raise ValueError("Input shapes do not overlap raster.")
+
+    def chips():
+        for k, fname in enumerate(fnames):
+            chip = np.array(
+                array[row_start[k] : row_stop[k], col_start[k] : col_stop[k]]
+            )
+            centre_cols = np.arange(col_start[k], col_stop[k]) + 0.5
+            centre_rows = np.arange(row_start[k], row_stop[k]) + 0.5
+            inside = ((centre_rows >= row_min[k]) & (centre_rows < row_max[k]))[
+                :, None
+            ] & ((centre_cols >= col_min[k]) & (centre_cols < col_max[k]))
+            chip[~inside] = nodata
+            yield fname, apply_colormap(chip, lut)
+
+    if executor is None:
+        for args in chips():
+            _save_png(args)
+    else:
+        # submit in batches so only a bounded number of chips wait in memory
+        batches = iter(chips())
+        while batch := list(islice(batches, 4096)):
+            list(executor.map(_save_png, batch, chunksize=64))
 
 
 def generate_points(
     num_points, country_name, CHIP_SIDE_LENGTH, df_hospitals, EXCLUSION_ZONE_RATIO
 ):
     this_crs = df_hospitals.crs
-    bounding_box = get_country_outline(country_name, this_crs).bounds
+    outline = get_country_outline(country_name, this_crs)
+    bounding_box = outline.bounds
     # generate random points within country bounding box
     x_coords = np.random.uniform(
         low=bounding_box[0], high=bounding_box[2], size=num_points
@@ -373,13 +533,11 @@ def generate_points(
     y_coords = np.random.uniform(
         low=bounding_box[1], high=bounding_box[3], size=num_points
     )
+    points = shapely.points(x_coords, y_coords)
+    # remove points outside of country area
     df_points = gpd.GeoDataFrame(
-        crs=this_crs, geometry=gpd.points_from_xy(x=x_coords, y=y_coords)
+        crs=this_crs, geometry=points[shapely.contains(outline, points)]
     )
-    # remove points outside of country area
-    df_points = df_points[
-        df_points.within(get_country_outline(country_name, this_crs))
-    ].reset_index(drop=True)
     # remove points near existing hospitals
     df_points = exclude_points_near_hospitals(
         df_points, df_hospitals, CHIP_SIDE_LENGTH * EXCLUSION_ZONE_RATIO
@@ -431,25 +589,64 @@ def add_hospital_negatives(df_hospitals, hospital_class_feature):
     return df_hospital_w_target
 
 
-def make_grid(polygon, edge_size):
-    """
-    polygon : shapely.geometry
-    edge_size : length of the grid cell
-    """
-    from itertools import product
+def _square_cells(x, y, half):
+    # squares with the vertices of Point.buffer(half, cap_style=3), clockwise
+    # from the top right corner, so the cells' WKT is the same as before
+    rings = np.empty((len(x), 5, 2))
+    rings[:, [0, 1, 4], 0] = (x + half)[:, None]
+    rings[:, [2, 3], 0] = (x - half)[:, None]
+    rings[:, [0, 3, 4], 1] = (y + half)[:, None]
+    rings[:, [1, 2], 1] = (y - half)[:, None]
+    return shapely.polygons(rings)
 
-    import geopandas as gpd
-    import numpy as np
 
+def iter_grid(polygon, edge_size, within=False, tile_size=1_000_000):
+    """
+    Generate the grid of make_grid in tiles of about tile_size cells, so only
+    one tile of candidate cells is held in memory at a time.
+
+    Yields GeoSeries of the cells intersecting (or within) the polygon, indexed
+    by their position among all the cells intersecting the polygon.
+    """
+    shapely.prepare(polygon)
     bounds = polygon.bounds
     x_coords = np.arange(bounds[0] + edge_size / 2, bounds[2], edge_size)
     y_coords = np.arange(bounds[1] + edge_size / 2, bounds[3], edge_size)
-    combinations = np.array(list(product(x_coords, y_coords)))
-    squares = gpd.points_from_xy(combinations[:, 0], combinations[:, 1]).buffer(
-        edge_size / 2, cap_style=3
-    )
+    half = edge_size / 2
+
+    # cells are ordered by x then y; each tile covers a band of x coordinates
+    columns_per_tile = max(1, tile_size // max(len(y_coords), 1))
+    n_intersecting = 0
+    for start in range(0, len(x_coords), columns_per_tile):
+        x, y = np.meshgrid(
+            x_coords[start : start + columns_per_tile], y_coords, indexing="ij"
+        )
+        x, y = x.ravel(), y.ravel()
+        squares = _square_cells(x, y, half)
+
+        keep = shapely.intersects(polygon, squares)
+        squares = squares[keep]
+        index = np.arange(n_intersecting, n_intersecting + len(squares))
+        n_intersecting += len(squares)
+
+        if within:
+            inside = shapely.contains(polygon, squares)
+            squares, index = squares[inside], index[inside]
 
-    return gpd.GeoSeries(squares[squares.intersects(polygon)])
+        yield gpd.GeoSeries(squares, index=index)
+
+
+def make_grid(polygon, edge_size, within=False, tile_size=1_000_000):
+    """
+    polygon : shapely.geometry
+    edge_size : length of the grid cell
+    within : only keep the cells fully inside the polygon
+    tile_size : number of candidate cells checked at once
+    """
+    tiles = list(iter_grid(polygon, edge_size, within, tile_size))
+    if not tiles:
+        return gpd.GeoSeries([])
+    return pd.concat(tiles)
 
 
 def predictions_scoring_data(credentials, deployment_id, scoring_data_path):
@@ -1,3 +1,5 @@
+import os
+
 from neo4j import GraphDatabase
 import pandas as pd
 
@@ -50,10 +52,7 @@ class ClientLoanFeatureExtractor:
         # B) Query (Client–Loan–Loaner) for row expansion
         #    This query returns the row-based data for each loan, plus a
         #    "loanerRejectedCount" feature for that loaner
-        cl_loan_rows = self._fetch_client_loan_rows()
-
-        # Convert to DataFrame
-        df_loans = pd.DataFrame(cl_loan_rows)
+        df_loans = self._fetch_client_loan_rows()
 
         # C) Merge node-level features onto df_loans, matching "client_id"
         final_df = df_loans.merge(node_level_df, how="left", on="client_id")
@@ -89,176 +88,59 @@ class ClientLoanFeatureExtractor:
           client_fraud_loaner_count,
           client_rejected_loan_count,
           [other basic props like name, phone, etc. if you want]
-        """
-        # 1) Basic props
-        base_df = pd.DataFrame(self._fetch_node_properties())
-
-        # 2) degrees
-        df_degrees = pd.DataFrame(self._compute_node_degrees())
-        # rename 'degree' -> 'client_degree' to not conflict with anything
-        df_degrees.rename(columns={"degree": "client_degree"}, inplace=True)
-
-        base_df = base_df.merge(df_degrees, on="client_id", how="left")
-
-        # 3) fraud neighbors
-        df_fraud_nbr = pd.DataFrame(self._compute_fraud_neighbors())
-        df_fraud_nbr.rename(
-            columns={"fraud_neighbor_count": "client_fraud_neighbor_count"},
-            inplace=True,
-        )
-        base_df = base_df.merge(df_fraud_nbr, on="client_id", how="left")
-
-        # 4) fraud loaner links
-        df_fraud_loaner = pd.DataFrame(self._compute_fraud_loaner_links())
-        df_fraud_loaner.rename(
-            columns={"fraud_loaner_count": "client_fraud_loaner_count"}, inplace=True
-        )
-        base_df = base_df.merge(df_fraud_loaner, on="client_id", how="left")
-
-        # 5) rejected loans
-        df_rejected = pd.DataFrame(self._compute_rejected_loans())
-        df_rejected.rename(
-            columns={"rejected_loan_count": "client_rejected_loan_count"}, inplace=True
-        )
-        base_df = base_df.merge(df_rejected, on="client_id", how="left")
 
-        return base_df
-
-    def _fetch_node_properties(self):
-        """
-        For each :Client OR :FraudCase node, get basic info + Fraud=1 if labeled :FraudCase.
-        Return list of dicts with client_id, name, phone, etc.
+        Properties and all four node-level features come from a single pass
+        over the client nodes, aggregating each feature before the next
+        OPTIONAL MATCH so there is still one row per node.
         """
         cypher = """
         MATCH (n)
         WHERE n:Client OR n:FraudCase
-        RETURN
-          ID(n) as internalNeo4jId,
-          n.id as client_id,
-          n.name as client_name,
-          n.phone as client_phone,
-          n.email as client_email,
-          n.credit_score as client_credit_score,
-          n.address as client_address,
-          n.suspiciousFlag as client_suspiciousFlag,
-          n.move_in_date as client_move_in_date,
-          CASE WHEN n:FraudCase THEN 1 ELSE 0 END AS Fraud
-        """
-        rows = []
-        with self._get_session() as session:
-            for rec in session.run(cypher):
-                cid = rec["client_id"] or str(rec["internalNeo4jId"])
-                row = {
-                    "client_id": cid,
-                    "client_name": rec["client_name"],
-                    "client_phone": rec["client_phone"],
-                    "client_email": rec["client_email"],
-                    "client_credit_score": rec["client_credit_score"],
-                    "client_address": rec["client_address"],
-                    "client_suspiciousFlag": rec["client_suspiciousFlag"],
-                    "client_move_in_date": rec["client_move_in_date"],
-                    "Fraud": rec["Fraud"],
-                }
-                rows.append(row)
-        return rows
-
-    # The existing four node-level feature methods:
-
-    def _compute_node_degrees(self):
-        """
-        For each client node, compute total degree.
-        We'll store the results keyed by client_id.
-        """
-        cypher = """
-        MATCH (n)
-        WHERE n:Client OR n:FraudCase
-        WITH n, size((n)--()) AS deg
-        RETURN 
-          ID(n) AS internalNeo4jId,
-          n.id AS client_id,
-          deg AS degree
-        """
-        out = []
-        with self._get_session() as session:
-            for record in session.run(cypher):
-                cid = record["client_id"] or str(record["internalNeo4jId"])
-                out.append({"client_id": cid, "degree": record["degree"]})
-        return out
 
-    def _compute_fraud_neighbors(self):
-        """
-        Count how many adjacent nodes are labeled :FraudCase
-        (simple measure of 'proximity to fraud').
-        """
-        cypher = """
-        MATCH (n)
-        WHERE n:Client OR n:FraudCase
+        // fraud neighbors: adjacent nodes labeled :FraudCase
         OPTIONAL MATCH (n)-[]-(nbr:FraudCase)
         WITH n, count(DISTINCT nbr) AS fraudNeighbors
-        RETURN
-          ID(n) as internalNeo4jId,
-          n.id AS client_id,
-          fraudNeighbors
-        """
-        out = []
-        with self._get_session() as session:
-            for rec in session.run(cypher):
-                cid = rec["client_id"] or str(rec["internalNeo4jId"])
-                out.append(
-                    {"client_id": cid, "fraud_neighbor_count": rec["fraudNeighbors"]}
-                )
-        return out
-
-    def _compute_fraud_loaner_links(self):
-        """
-        Count distinct fraudulent loans from the same loaner.
-        i.e.
-           (n)-[:HAS_LOAN]->(loan)-[:FROM]->(ln:Loaner),
-            (ln)<-[:FROM]-(otherLoan:Loan)<-[:HAS_LOAN]-(f:FraudCase)
-        """
-        cypher = """
-        MATCH (n)
-        WHERE n:Client OR n:FraudCase
-        OPTIONAL MATCH (n)-[:HAS_LOAN]->(l:Loan)-[:FROM]->(ln:Loaner),
-                      (ln)<-[:FROM]-(otherLoan:Loan)<-[:HAS_LOAN]-(f:FraudCase)
-        WITH n, COUNT(DISTINCT otherLoan) AS fraudLoanerLinks
-        RETURN
-          ID(n) AS internalNeo4jId,
-          n.id AS client_id,
-          fraudLoanerLinks
-        """
-        out = []
-        with self._get_session() as session:
-            for rec in session.run(cypher):
-                cid = rec["client_id"] or str(rec["internalNeo4jId"])
-                out.append(
-                    {"client_id": cid, "fraud_loaner_count": rec["fraudLoanerLinks"]}
-                )
-        return out
-
-    def _compute_rejected_loans(self):
-        """
-        Count how many loans this node has with status='rejected'.
-        """
-        cypher = """
-        MATCH (n)
-        WHERE n:Client OR n:FraudCase
+
+        // rejected loans of this node
         OPTIONAL MATCH (n)-[:HAS_LOAN]->(loan:Loan)
         WHERE loan.status = 'rejected'
-        WITH n, count(DISTINCT loan) AS rejectedCount
+        WITH n, fraudNeighbors, count(DISTINCT loan) AS rejectedCount
+
+        // distinct fraudulent loans from the same loaner
+        OPTIONAL MATCH (n)-[:HAS_LOAN]->(:Loan)-[:FROM]->(ln:Loaner)
+                       <-[:FROM]-(otherLoan:Loan)<-[:HAS_LOAN]-(:FraudCase)
+        WITH n, fraudNeighbors, rejectedCount,
+             count(DISTINCT otherLoan) AS fraudLoanerLinks
+
         RETURN
           ID(n) AS internalNeo4jId,
           n.id AS client_id,
-          rejectedCount
+          n.name AS client_name,
+          n.phone AS client_phone,
+          n.email AS client_email,
+          n.credit_score AS client_credit_score,
+          n.address AS client_address,
+          n.suspiciousFlag AS client_suspiciousFlag,
+          n.move_in_date AS client_move_in_date,
+          CASE WHEN n:FraudCase THEN 1 ELSE 0 END AS Fraud,
+          size((n)--()) AS client_degree,
+          fraudNeighbors AS client_fraud_neighbor_count,
+          fraudLoanerLinks AS client_fraud_loaner_count,
+          rejectedCount AS client_rejected_loan_count
         """
-        out = []
-        with self._get_session() as session:
-            for rec in session.run(cypher):
-                cid = rec["client_id"] or str(rec["internalNeo4jId"])
-                out.append(
-                    {"client_id": cid, "rejected_loan_count": rec["rejectedCount"]}
-                )
-        return out
+        df = self._read_frame(cypher)
+        df["client_id"] = _or_default(
+            df["client_id"], df.pop("internalNeo4jId").astype(str)
+        )
+        return df.astype(
+            {
+                "Fraud": "int64",
+                "client_degree": "int64",
+                "client_fraud_neighbor_count": "int64",
+                "client_fraud_loaner_count": "int64",
+                "client_rejected_loan_count": "int64",
+            }
+        )
 
     # ----------------------------------------------------------------
     # B) Query for (Client–Loan), plus loaner RejectedCount
@@ -266,103 +148,153 @@ class ClientLoanFeatureExtractor:
     def _fetch_client_loan_rows(self):
         """
         Each row => (client, loan).
-        Also includes how many total 'rejected' loans the loaner has.
+        Also includes how many total 'rejected' loans the loaner has,
+        counted once per loaner rather than once per loan.
         """
         cypher = """
-        MATCH (c)
-        WHERE c:Client OR c:FraudCase
-        MATCH (c)-[:HAS_LOAN]->(loan:Loan)-[:FROM]->(ln:Loaner)
-        
+        MATCH (ln:Loaner)
+
         // For that loaner, how many total rejected loans exist?
         OPTIONAL MATCH (ln)<-[:FROM]-(anyLoan:Loan)
         WHERE anyLoan.status = 'rejected'
-        WITH c, loan, ln, COUNT(DISTINCT anyLoan) AS loanerRejectedCount
-        
+        WITH ln, COUNT(DISTINCT anyLoan) AS loanerRejectedCount
+
+        MATCH (c)-[:HAS_LOAN]->(loan:Loan)-[:FROM]->(ln)
+        WHERE c:Client OR c:FraudCase
+
         RETURN
           // client info
           ID(c) AS clientNeo4jId,
           c.id AS client_id,
-          
+
           // loan
           loan.id AS loan_id,
           loan.type AS loan_type,
           loan.balance AS loan_balance,
           loan.status AS loan_status,
-          
+
           // loaner feature
           loanerRejectedCount AS loaner_rejected_count
         """
-        rows = []
+        df = self._read_frame(cypher)
+        df["client_id"] = _or_default(
+            df["client_id"], df.pop("clientNeo4jId").astype(str)
+        )
+        for col in ["loan_id", "loan_type", "loan_status"]:
+            df[col] = _or_default(df[col], "")
+        df["loaner_rejected_count"] = (
+            df["loaner_rejected_count"].fillna(0).astype("int64")
+        )
+        return df
+
+    def _read_frame(self, cypher, **params):
+        """
+        Run a read query in a managed transaction, streaming its records
+        straight into the columns of a DataFrame.
+        """
+
+        def read(tx):
+            result = tx.run(cypher, **params)
+            return pd.DataFrame.from_records(iter(result), columns=result.keys())
+
         with self._get_session() as session:
-            res = session.run(cypher)
-            for rec in res:
-                row = {
-                    "client_id": rec["client_id"] or str(rec["clientNeo4jId"]),
-                    "loan_id": rec["loan_id"] or "",
-                    "loan_type": rec["loan_type"] or "",
-                    "loan_balance": rec["loan_balance"],
-                    "loan_status": rec["loan_status"] or "",
-                    "loaner_rejected_count": rec["loaner_rejected_count"] or 0,
-                }
-                rows.append(row)
-        return rows
-
-
-def update_neo4j_predictions(scored_df, best_model):
-    # Connect to Neo4j
-    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
-    session = driver.session(database=NEO4J_DATABASE)
-
-    # MERGE a single model node
+            return session.execute_read(read)
+
+
+def _or_default(values, default):
+    """Column-wise `value or default`, also treating missing values as empty."""
+    return values.where(values.notna() & values.astype(bool), default)
+
+
+NEO4J_URI = os.environ.get("NEO4J_URI", "bolt://localhost:7687")
+NEO4J_USER = os.environ.get("NEO4J_USER", "neo4j")
+NEO4J_PASSWORD = os.environ.get("NEO4J_PASSWORD", "password")
+NEO4J_DATABASE = os.environ.get("NEO4J_DATABASE")
+
+
+def _prediction_rows(scored_df, model_id):
+    """
+    Build the UNWIND parameter rows for update_neo4j_predictions, one per scored loan.
+    Values go through tolist() so the driver receives plain Python types.
+    """
+
+    columns = {
+        "loan_id": scored_df["loan_id"].tolist(),
+        "unique_key": [
+            f"{loan_id}-pred-{model_id}-{idx}"
+            for loan_id, idx in zip(scored_df["loan_id"], scored_df.index)
+        ],
+        "prob": scored_df["pred_fraud_probability"].tolist(),
+        "top_feat": _or_default(scored_df["top_feature"], "").tolist(),
+        "top_feat_val": _or_default(scored_df["top_feature_value"], 0.0).tolist(),
+        "top_feat_qual_strgth": _or_default(
+            scored_df["top_feat_qual_strgth"], ""
+        ).tolist(),
+        "flagged": scored_df["flagged_as_fraud"].astype(int).tolist(),
+    }
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def update_neo4j_predictions(
+    scored_df,
+    best_model,
+    uri=None,
+    user=None,
+    password=None,
+    database=None,
+    batch_size=1000,
+    driver=None,
+):
+    """
+    Write a PredictedFraud node per scored loan, linked to its Loan and to a
+    DataRobotModel node. Rows are sent `batch_size` at a time as a single
+    parameterized UNWIND, each batch in its own managed write transaction.
+    Pass `driver` to reuse an existing driver instead of connecting to `uri`.
+    """
+    own_driver = driver is None
+    if own_driver:
+        driver = GraphDatabase.driver(
+            uri or NEO4J_URI, auth=(user or NEO4J_USER, password or NEO4J_PASSWORD)
+        )
     model_id = best_model.id
     model_type = best_model.model_type
-    session.run(
+    rows = _prediction_rows(scored_df, model_id)
+
+    with driver.session(database=database or NEO4J_DATABASE) as session:
+        # MERGE a single model node
+        merge_model = """
+        MERGE (m:DataRobotModel {id:$model_id})
+        ON CREATE SET m.model_type=$model_type
         """
-    MERGE (m:DataRobotModel {id:$model_id})
-    ON CREATE SET m.model_type=$model_type
-    """,
-        model_id=model_id,
-        model_type=model_type,
-    )
-
-    # For each row, create PredictedFraud node + link to model + Loan
-    for idx, row in scored_df.iterrows():
-        loan_id = row["loan_id"]
-        prob = row["pred_fraud_probability"]
-        top_feat = row["top_feature"]
-        top_feat_val = row["top_feature_value"]
-        top_feat_qual_strgth = row["top_feat_qual_strgth"]
-        flagged = row["flagged_as_fraud"]
+        session.execute_write(
+            lambda tx: tx.run(
+                merge_model, model_id=model_id, model_type=model_type
+            ).consume()
+        )
 
+        # For each row, create PredictedFraud node + link to model + Loan
         cypher = """
-        MATCH (ln:Loan {id:$loan_id})
-        MERGE (pf:PredictedFraud {uniqueKey:$unique_key})
-        SET pf.score=$prob,
-            pf.topFeature=$top_feat,
-            pf.topFeatureValue=$top_feat_val,
-            pf.topFeatureQualStrgth=$top_feat_qual_strgth,
-            pf.isFlagged=$flagged,
+        MATCH (m:DataRobotModel {id:$model_id})
+        UNWIND $rows AS row
+        MATCH (ln:Loan {id:row.loan_id})
+        MERGE (pf:PredictedFraud {uniqueKey:row.unique_key})
+        SET pf.score=row.prob,
+            pf.topFeature=row.top_feat,
+            pf.topFeatureValue=row.top_feat_val,
+            pf.topFeatureQualStrgth=row.top_feat_qual_strgth,
+            pf.isFlagged=row.flagged,
             pf.createdAt=timestamp()
         MERGE (ln)-[:HAS_PREDICTION]->(pf)
-
-        WITH pf
-        MATCH (m:DataRobotModel {id:$model_id})
         MERGE (pf)-[:USING_MODEL]->(m)
         """
-        unique_key = f"{loan_id}-pred-{model_id}-{idx}"
-        session.run(
-            cypher,
-            loan_id=loan_id,
-            unique_key=unique_key,
-            prob=prob,
-            top_feat=top_feat or "",
-            top_feat_val=top_feat_val or 0.0,
-            top_feat_qual_strgth=top_feat_qual_strgth or "",
-            flagged=int(flagged),
-            model_id=model_id,
-        )
-    session.close()
-    driver.close()
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start : start + batch_size]
+            session.execute_write(
+                lambda tx: tx.run(cypher, rows=batch, model_id=model_id).consume()
+            )
+
+    if own_driver:
+        driver.close()
     print("\nNeo4j updated with predicted fraud nodes on holdout loans.")
 
 
@@ -0,0 +1,195 @@
+"""
+Round-trip counts of FraudGraphFeatureExtractor against a Bolt driver double
+
+The double stands in for neo4j.GraphDatabase.driver. It records every
+transaction and every tx.run call, so the tests check how many queries the
+feature extraction and the prediction write-back send, without a Neo4j
+server. Run with `python -m pytest` from this folder.
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import FraudGraphFeatureExtractor as extractor_module
+
+
+class FakeResult:
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+
+    def keys(self):
+        return list(self.columns)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def consume(self):
+        return None
+
+
+class FakeDriver:
+    """
+    Bolt driver double counting round-trips. `results` maps a marker found in
+    the Cypher text to the (columns, rows) returned for that query.
+    """
+
+    def __init__(self, results=None):
+        self.results = results or {}
+        self.runs = []
+        self.transactions = []
+        self.closed = False
+
+    def session(self, database=None):
+        return FakeSession(self)
+
+    def close(self):
+        self.closed = True
+
+    def run(self, cypher, **params):
+        self.runs.append((cypher, params))
+        for marker, (columns, rows) in self.results.items():
+            if marker in cypher:
+                return FakeResult(columns, rows)
+        return FakeResult([], [])
+
+
+class FakeSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute_read(self, work):
+        self.driver.transactions.append("read")
+        return work(SimpleNamespace(run=self.driver.run))
+
+    def execute_write(self, work):
+        self.driver.transactions.append("write")
+        return work(SimpleNamespace(run=self.driver.run))
+
+
+def make_scored(n):
+    scored = pd.DataFrame(
+        {
+            "loan_id": [f"L{i}" for i in range(n)],
+            "pred_fraud_probability": np.linspace(0, 1, n),
+            "top_feature": "client_degree",
+            "top_feature_value": 3.0,
+            "top_feat_qual_strgth": "+++",
+            "flagged_as_fraud": np.arange(n) % 2 == 0,
+        }
+    )
+    scored.loc[0, ["top_feature", "top_feature_value", "top_feat_qual_strgth"]] = [
+        None,
+        np.nan,
+        "",
+    ]
+    return scored
+
+
+def test_update_predictions_sends_one_unwind_per_batch():
+    driver = FakeDriver()
+    model = SimpleNamespace(id="m1", model_type="XGBoost")
+
+    extractor_module.update_neo4j_predictions(
+        make_scored(2500), model, batch_size=1000, driver=driver
+    )
+
+    # one MERGE of the model node, then one UNWIND per batch
+    assert len(driver.runs) == 4
+    assert driver.transactions == ["write"] * 4
+    batches = [params["rows"] for _, params in driver.runs[1:]]
+    assert [len(rows) for rows in batches] == [1000, 1000, 500]
+    assert [row["loan_id"] for rows in batches for row in rows] == [
+        f"L{i}" for i in range(2500)
+    ]
+    assert all(params["model_id"] == "m1" for _, params in driver.runs)
+    assert not driver.closed
+
+
+def test_prediction_rows_replace_missing_values():
+    rows = extractor_module._prediction_rows(make_scored(3), "m1")
+
+    assert rows[0] == {
+        "loan_id": "L0",
+        "unique_key": "L0-pred-m1-0",
+        "prob": 0.0,
+        "top_feat": "",
+        "top_feat_val": 0.0,
+        "top_feat_qual_strgth": "",
+        "flagged": 1,
+    }
+    assert rows[1]["top_feat"] == "client_degree"
+    assert rows[1]["top_feat_val"] == 3.0
+    assert type(rows[1]["flagged"]) is int
+
+
+def test_extract_client_loan_rows_reads_twice(monkeypatch):
+    node_columns = [
+        "internalNeo4jId",
+        "client_id",
+        "client_name",
+        "client_phone",
+        "client_email",
+        "client_credit_score",
+        "client_address",
+        "client_suspiciousFlag",
+        "client_move_in_date",
+        "Fraud",
+        "client_degree",
+        "client_fraud_neighbor_count",
+        "client_fraud_loaner_count",
+        "client_rejected_loan_count",
+    ]
+    loan_columns = [
+        "clientNeo4jId",
+        "client_id",
+        "loan_id",
+        "loan_type",
+        "loan_balance",
+        "loan_status",
+        "loaner_rejected_count",
+    ]
+    driver = FakeDriver(
+        {
+            "MATCH (n)": (
+                node_columns,
+                [
+                    (1, "C1", "Ann", None, None, 700, None, None, None, 0, 2, 0, 1, 0),
+                    (2, None, "Bob", None, None, None, None, None, None, 1, 1, 1, 0, 1),
+                ],
+            ),
+            "MATCH (ln:Loaner)": (
+                loan_columns,
+                [
+                    (1, "C1", "L1", "car", 1000.0, "approved", 2),
+                    (2, None, "L2", None, 50.0, "rejected", 0),
+                ],
+            ),
+        }
+    )
+    monkeypatch.setattr(
+        extractor_module,
+        "GraphDatabase",
+        SimpleNamespace(driver=lambda uri, auth: driver),
+    )
+
+    extractor = extractor_module.ClientLoanFeatureExtractor("bolt://fake", "u", "p")
+    df = extractor.extract_client_loan_rows()
+
+    assert len(driver.runs) == 2
+    assert driver.transactions == ["read", "read"]
+    # clients without an id fall back to their internal Neo4j id on both sides
+    assert df["client_id"].tolist() == ["C1", "2"]
+    assert df["client_name"].tolist() == ["Ann", "Bob"]
+    assert df["Fraud"].tolist() == [0, 1]
+    assert df["loan_type"].tolist() == ["car", ""]
+    assert df["client_credit_score"].tolist() == pytest.approx([700, -9999])
@@ -0,0 +1,216 @@
+"""
+Benchmark the throughput of spectrogram featurization
+
+Generates synthetic signals (tones, chirps and noise, 5 s at 44.1 kHz by
+default) and times, per signal, the previous Featurizer (librosa.feature,
+statsmodels' describe and specshow images), the current Featurizer with both
+image renderers, and featurize_signals. Reports the number of features per
+signal that differ from the previous ones by more than 1e-4 relative (a few
+modes and rolloff bins are near ties that float rounding can flip), and the
+mean and maximum absolute pixel difference between the specshow and the
+NumPy rendered images.
+
+Usage:
+    python benchmark_create_features.py [--signals 16] [--seconds 5]
+        [--sr 44100] [--workers 0]
+"""
+
+import argparse
+import base64
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import time
+
+import librosa
+from librosa import decompose, feature
+import numpy as np
+from PIL import Image
+from statsmodels.stats import descriptivestats
+
+from create_features import Featurizer, featurize_signals, SPECTROGRAM_IMAGES
+from helpers import create_spectrogram_image, generate_base64_image
+
+N_FFT = 2048
+
+DESCRIBE_STATS = [
+    "mean",
+    "std_err",
+    "ci",
+    "std",
+    "iqr",
+    "iqr_normal",
+    "mad",
+    "mad_normal",
+    "coef_var",
+    "range",
+    "max",
+    "min",
+    "skew",
+    "kurtosis",
+    "jarque_bera",
+    "mode",
+    "freq",
+    "median",
+]
+
+
+def make_signals(n_signals, seconds, sr, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    signals = []
+    for i in range(n_signals):
+        if i % 2:
+            signal = np.sin(2 * np.pi * (rng.uniform(100, 500) + 1000 * t) * t)
+        else:
+            signal = np.sin(2 * np.pi * rng.uniform(100, 4000) * t) * np.exp(-t)
+        signals.append(signal + 0.05 * rng.standard_normal(len(t)))
+    return [signal.astype(np.float32) for signal in signals]
+
+
+def describe(vec, prefix):
+    # the previous Featurizer described float32 vectors, which recent pandas
+    # versions refuse in statsmodels' describe
+    described = descriptivestats.describe(
+        np.asarray(vec, dtype=np.float64), stats=DESCRIBE_STATS
+    )[0]
+    return {prefix + str(stat): value for stat, value in described.items()}
+
+
+def previous_featurize(array, sr):
+    """The previous Featurizer, as the notebook called it for one signal"""
+    S = np.abs(librosa.stft(array, n_fft=N_FFT))
+    h, p = decompose.hpss(S=S)
+    spectrograms = {
+        "spectrogram": S,
+        "spectrogram_mel": feature.melspectrogram(S=S, sr=sr, n_fft=N_FFT),
+        "spectrogram_harmonic": h,
+        "spectrogram_percussive": p,
+    }
+    result = {
+        name: generate_base64_image(create_spectrogram_image(spectrogram, sr))
+        for name, spectrogram in spectrograms.items()
+    }
+
+    chroma = feature.chroma_stft(S=S, sr=sr, n_fft=N_FFT)
+    result.update({"chroma_" + str(i): np.mean(c) for i, c in enumerate(chroma)})
+    mfcc = feature.mfcc(S=S, n_mfcc=128)
+    width = min(S.shape[1], 9)
+    for prefix, vectors in [
+        ("feat_mfcc_", mfcc),
+        ("feat_mfcc_delta_", feature.delta(mfcc, width=width)),
+        ("feat_mfcc_accel_", feature.delta(mfcc, order=2, width=width)),
+    ]:
+        result.update({prefix + str(i): np.mean(v) for i, v in enumerate(vectors)})
+
+    centroid = feature.spectral_centroid(S=S)[0]
+    result.update(describe(centroid, "spec_centroid_"))
+    for p, prefix in [
+        (2, "spec_bandwidth_"),
+        (3, "spec_bandwidth_3_"),
+        (4, "spec_bandwidth_4_"),
+    ]:
+        result.update(describe(feature.spectral_bandwidth(S=S, p=p)[0], prefix))
+    result.update(describe(feature.spectral_rolloff(S=S)[0], "feat_spectral_rolloff_"))
+    result.update(
+        describe(feature.spectral_flatness(S=S)[0], "feat_spectral_flatness_")
+    )
+    result.update(describe(feature.delta(centroid), "feat_spectral_centroid_delta_"))
+    return result
+
+
+def featurizer_loop(signals, sr, matplotlib_images):
+    results = []
+    for array in signals:
+        featurizer = Featurizer(
+            array=array, sr=sr, n_fft=N_FFT, matplotlib_images=matplotlib_images
+        )
+        results.append(
+            {
+                **featurizer._create_all_spectrograms(),
+                **featurizer._create_all_spectral_features(),
+            }
+        )
+    return results
+
+
+def decode(image):
+    return np.asarray(Image.open(BytesIO(base64.b64decode(image))).convert("RGB"))
+
+
+def mismatched_features(expected, actual):
+    features = [name for name in expected if name not in SPECTROGRAM_IMAGES]
+    return sum(
+        not np.isclose(
+            float(actual[name]),
+            float(expected[name]),
+            rtol=1e-4,
+            atol=1e-6,
+            equal_nan=True,
+        )
+        for name in features
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--signals", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--sr", type=int, default=44100)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="processes encoding the PNGs of featurize_signals, 0 for none",
+    )
+    args = parser.parse_args()
+
+    signals = make_signals(args.signals, args.seconds, args.sr)
+    print(f"{args.signals} signals of {args.seconds} s at {args.sr} Hz")
+
+    timings, outputs = {}, {}
+    for name, run in [
+        (
+            "previous Featurizer",
+            lambda: [previous_featurize(s, args.sr) for s in signals],
+        ),
+        ("Featurizer, specshow", lambda: featurizer_loop(signals, args.sr, True)),
+        ("Featurizer, NumPy", lambda: featurizer_loop(signals, args.sr, False)),
+        (
+            "featurize_signals",
+            lambda: featurize_signals(signals, sr=args.sr, n_fft=N_FFT),
+        ),
+    ]:
+        start = time.perf_counter()
+        outputs[name] = run()
+        timings[name] = time.perf_counter() - start
+    if args.workers:
+        with ProcessPoolExecutor(args.workers) as executor:
+            start = time.perf_counter()
+            outputs["featurize_signals, pool"] = featurize_signals(
+                signals, sr=args.sr, n_fft=N_FFT, executor=executor
+            )
+            timings["featurize_signals, pool"] = time.perf_counter() - start
+
+    expected = outputs["previous Featurizer"]
+    n_features = sum(name not in SPECTROGRAM_IMAGES for name in expected[0])
+    print(f"path                     s/signal  signals/s  mismatched of {n_features}")
+    for name, seconds in timings.items():
+        mismatched = sum(map(mismatched_features, expected, outputs[name]))
+        print(
+            f"{name:<24} {seconds / args.signals:<9.3f} "
+            f"{args.signals / seconds:<10.2f} {mismatched / args.signals:.1f}"
+        )
+
+    print("image                    specshow vs NumPy mean |diff|  max |diff|")
+    for image in SPECTROGRAM_IMAGES:
+        diffs = [
+            np.abs(decode(old[image]).astype(int) - decode(new[image]).astype(int))
+            for old, new in zip(
+                outputs["Featurizer, specshow"], outputs["featurize_signals"]
+            )
+        ]
+        print(f"{image:<24} {np.mean(diffs):<31.2f} {max(d.max() for d in diffs)}")
+
+
+if __name__ == "__main__":
+    main()
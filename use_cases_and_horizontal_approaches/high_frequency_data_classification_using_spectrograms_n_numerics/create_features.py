@@ -1,9 +1,362 @@
-from helpers import create_spectrogram_image, generate_base64_image
+from functools import lru_cache
+
+from helpers import (
+    create_spectrogram_image,
+    encode_spectrogram_image,
+    generate_base64_image,
+    spectrogram_levels,
+)
 import librosa
-from librosa import decompose, feature
+from librosa import decompose, feature, filters
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import pandas as pd
-from statsmodels.stats import descriptivestats
+import scipy.fft
+from scipy import stats
+
+# Statistics produced by statsmodels' descriptivestats.describe for the
+# stats requested in Featurizer._calc_vector_features, in the same order
+VECTOR_STATS = [
+    "mean",
+    "std_err",
+    "upper_ci",
+    "lower_ci",
+    "std",
+    "iqr",
+    "mad",
+    "coef_var",
+    "range",
+    "max",
+    "min",
+    "skew",
+    "kurtosis",
+    "iqr_normal",
+    "mad_normal",
+    "jarque_bera",
+    "jarque_bera_pval",
+    "mode",
+    "mode_freq",
+    "median",
+]
+
+# Spectral vectors summarised with VECTOR_STATS, and the prefix of their features
+SPECTRAL_VECTORS = [
+    ("centroid", "spec_centroid_"),
+    ("bandwidth_2", "spec_bandwidth_"),
+    ("bandwidth_3", "spec_bandwidth_3_"),
+    ("bandwidth_4", "spec_bandwidth_4_"),
+    ("rolloff", "feat_spectral_rolloff_"),
+    ("flatness", "feat_spectral_flatness_"),
+    ("centroid_delta", "feat_spectral_centroid_delta_"),
+]
+
+SPECTROGRAM_IMAGES = [
+    "spectrogram",
+    "spectrogram_mel",
+    "spectrogram_harmonic",
+    "spectrogram_percussive",
+]
+
+
+def describe_vectors(X):
+    """
+    Row-wise equivalent of statsmodels' descriptivestats.describe
+    :param X: 2d array, one vector per row
+    returns: dictionary of VECTOR_STATS to arrays with one value per row
+    """
+    X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+    n = X.shape[1]
+
+    mean = X.mean(axis=1)
+    deviation = X - mean[:, None]
+    squared = deviation**2
+    m2 = squared.mean(axis=1)
+    m3 = (squared * deviation).mean(axis=1)
+    m4 = (squared**2).mean(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        std = np.sqrt(m2 * n / (n - 1)) if n > 1 else np.full_like(mean, np.nan)
+        std_err = std / np.sqrt(n)
+        coef_var = np.where(mean != 0, std / mean, np.nan)
+        # scipy.stats.skew and kurtosis are undefined for constant vectors
+        constant = m2 <= (np.finfo(np.float64).eps * mean) ** 2
+        skew = np.where(constant, np.nan, m3 / m2**1.5)
+        kurtosis = np.where(constant, np.nan, m4 / m2**2)
+    if n < 2:
+        skew = kurtosis = np.full_like(mean, np.nan)
+    jarque_bera = n / 6 * (skew**2 + (kurtosis - 3) ** 2 / 4)
+
+    q = stats.norm.ppf([0.25, 0.75, 0.975])
+    q25, median, q75 = np.quantile(X, [0.25, 0.5, 0.75], axis=1)
+    iqr = q75 - q25
+    mad = np.abs(deviation).mean(axis=1)
+
+    # the mode is the smallest of the most frequent values
+    ordered = np.sort(X, axis=1)
+    position = np.arange(n)
+    run_start = np.ones_like(ordered, dtype=bool)
+    run_start[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    run_start = np.maximum.accumulate(np.where(run_start, position, 0), axis=1)
+    run_length = position - run_start + 1
+    run_end = np.ones_like(ordered, dtype=bool)
+    run_end[:, :-1] = ordered[:, 1:] != ordered[:, :-1]
+    run_length = np.where(run_end, run_length, 0)
+    mode_index = run_length.argmax(axis=1)
+    rows = np.arange(len(X))
+
+    return {
+        "mean": mean,
+        "std_err": std_err,
+        "upper_ci": mean + q[2] * std_err,
+        "lower_ci": mean - q[2] * std_err,
+        "std": std,
+        "iqr": iqr,
+        "mad": mad,
+        "coef_var": coef_var,
+        "range": ordered[:, -1] - ordered[:, 0],
+        "max": ordered[:, -1],
+        "min": ordered[:, 0],
+        "skew": skew,
+        "kurtosis": kurtosis,
+        "iqr_normal": iqr / (q[1] - q[0]),
+        "mad_normal": mad / np.sqrt(2 / np.pi),
+        "jarque_bera": jarque_bera,
+        # chi-squared survival function with two degrees of freedom
+        "jarque_bera_pval": np.exp(-jarque_bera / 2),
+        "mode": ordered[rows, mode_index],
+        "mode_freq": run_length[rows, mode_index] / n,
+        "median": median,
+    }
+
+
+@lru_cache(maxsize=8)
+def dct_basis(n_bins, n_mfcc):
+    # Rows of the orthonormal DCT-II used by librosa.feature.mfcc
+    return scipy.fft.dct(np.eye(n_bins), type=2, norm="ortho", axis=0)[:n_mfcc]
+
+
+@lru_cache(maxsize=32)
+def delta_mean_weights(n_frames, width, order):
+    # librosa.feature.delta is linear in time, so the mean of a delta is a
+    # weighted sum of the frames
+    return feature.delta(np.eye(n_frames), width=width, order=order).mean(axis=1)
+
+
+@lru_cache(maxsize=128)
+def chroma_filters(sr, n_fft, tuning):
+    return filters.chroma(sr=sr, n_fft=n_fft, tuning=tuning)
+
+
+@lru_cache(maxsize=8)
+def mel_filters(sr, n_fft):
+    return filters.mel(sr=sr, n_fft=n_fft)
+
+
+def median_filter(S, width, axis):
+    """
+    scipy.ndimage.median_filter(mode="reflect") along a single axis, selecting
+    the median of every window with one partition instead of a generic rank filter
+    """
+    pad = [(0, 0)] * S.ndim
+    pad[axis] = (width // 2, width // 2)
+    windows = sliding_window_view(np.pad(S, pad, mode="symmetric"), width, axis=axis)
+    return np.partition(windows, width // 2, axis=-1)[..., width // 2]
+
+
+def hpss(S, kernel_size=31):
+    """
+    Harmonic and percussive components of a stack of spectrograms, matching
+    decompose.hpss with its default margins and power
+    :param S: magnitude spectrograms, shape (signals, bins, frames)
+    returns: harmonic and percussive arrays shaped like S
+    """
+    harmonic, percussive = np.empty_like(S), np.empty_like(S)
+    # one signal at a time keeps the sliding windows small
+    for i, spectrogram in enumerate(S):
+        harm = median_filter(spectrogram, kernel_size, axis=-1)
+        perc = median_filter(spectrogram, kernel_size, axis=-2)
+        harmonic[i] = spectrogram * librosa.util.softmask(
+            harm, perc, power=2, split_zeros=True
+        )
+        percussive[i] = spectrogram * librosa.util.softmask(
+            perc, harm, power=2, split_zeros=True
+        )
+    return harmonic, percussive
+
+
+def chroma_means(S, sr=22050, n_fft=2048):
+    """
+    Frame means of feature.chroma_stft for a stack of spectrograms
+    :param S: magnitude spectrograms, shape (signals, bins, frames)
+    returns: array of shape (signals, 12)
+    """
+    n_fft = 2 * (S.shape[-2] - 1)
+    means = []
+    for spectrogram in S:
+        # tuning is estimated per signal, exactly as chroma_stft does
+        tuning = librosa.estimate_tuning(S=spectrogram, sr=sr, bins_per_octave=12)
+        chroma = chroma_filters(sr, n_fft, float(tuning)) @ spectrogram
+        chroma = librosa.util.normalize(chroma, norm=np.inf, axis=-2)
+        means.append(chroma.mean(axis=-1))
+    return np.array(means)
+
+
+def mfcc_means(S, number_of_mfcc=128):
+    """
+    Frame means of the mfcc of S and, when there are enough frames, of its
+    delta and acceleration, without materialising any of them
+    :param S: magnitude spectrograms, shape (signals, bins, frames)
+    returns: dictionary of arrays of shape (signals, number_of_mfcc)
+    """
+    n_frames = S.shape[-1]
+    weights = [np.full(n_frames, 1 / n_frames)]
+    names = ["feat_mfcc_"]
+    width = min(n_frames, 9)
+    if width >= 3:
+        weights += [
+            delta_mean_weights(n_frames, width, 1),
+            delta_mean_weights(n_frames, width, 2),
+        ]
+        names += ["feat_mfcc_delta_", "feat_mfcc_accel_"]
+
+    basis = dct_basis(S.shape[-2], number_of_mfcc)
+    means = basis @ (S @ np.stack(weights, axis=-1))
+    return {name: means[..., i] for i, name in enumerate(names)}
+
+
+def spectral_vectors(S, freqs=None):
+    """
+    Per frame spectral centroid, bandwidths (p = 2, 3, 4), rolloff, flatness
+    and centroid delta, sharing one normalised spectrum between them
+    :param S: magnitude spectrograms, shape (signals, bins, frames)
+    :param freqs: centre frequency of each bin, librosa's default when None
+    returns: dictionary of arrays of shape (signals, frames)
+    """
+    if freqs is None:
+        freqs = librosa.fft_frequencies(n_fft=2 * (S.shape[-2] - 1))
+    freqs = np.asarray(freqs)[:, None]
+    # sums over the bins of a stack are accumulated sequentially rather than
+    # pairwise, so they run in float64 to not depend on the number of signals
+    dtype, S = S.dtype, S.astype(np.float64)
+
+    S_norm = librosa.util.normalize(S, norm=1, axis=-2)
+    centroid = np.sum(freqs * S_norm, axis=-2)
+    deviation = np.abs(freqs - centroid[..., None, :])
+    squared = deviation**2
+    vectors = {
+        "centroid": centroid,
+        "bandwidth_2": np.sum(S_norm * squared, axis=-2) ** (1 / 2),
+        "bandwidth_3": np.sum(S_norm * squared * deviation, axis=-2) ** (1 / 3),
+        "bandwidth_4": np.sum(S_norm * squared**2, axis=-2) ** (1 / 4),
+    }
+
+    # first bin holding 85% of the cumulative energy
+    energy = np.cumsum(S, axis=-2)
+    reached = energy >= 0.85 * energy[..., -1:, :]
+    vectors["rolloff"] = freqs[reached.argmax(axis=-2), 0]
+
+    power = np.maximum(1e-10, S**2)
+    vectors["flatness"] = np.exp(np.mean(np.log(power), axis=-2)) / np.mean(
+        power, axis=-2
+    )
+
+    if S.shape[-2] > 9:
+        vectors["centroid_delta"] = feature.delta(centroid.astype(dtype))
+    return {name: vector.astype(dtype) for name, vector in vectors.items()}
+
+
+def spectral_features(S, sr=22050, n_fft=2048, freqs=None):
+    """
+    Compute all spectral features for a stack of spectrograms
+    :param S: magnitude spectrograms, shape (signals, bins, frames)
+    returns: list with one dictionary of features per signal
+    """
+    columns = {}
+
+    chroma = chroma_means(S, sr=sr, n_fft=n_fft)
+    columns.update({"chroma_" + str(i): chroma[:, i] for i in range(chroma.shape[1])})
+
+    if S.shape[-2] > 9:
+        for prefix, means in mfcc_means(S).items():
+            columns.update(
+                {prefix + str(i): means[:, i] for i in range(means.shape[1])}
+            )
+
+    vectors = spectral_vectors(S, freqs=freqs)
+    names = [name for name, _ in SPECTRAL_VECTORS if name in vectors]
+    described = describe_vectors(
+        np.concatenate([vectors[name] for name in names], axis=0)
+    )
+    suffixes = dict(SPECTRAL_VECTORS)
+    for i, name in enumerate(names):
+        rows, suffix = slice(i * len(S), (i + 1) * len(S)), suffixes[name]
+        columns.update({suffix + stat: described[stat][rows] for stat in VECTOR_STATS})
+
+    return pd.DataFrame(columns).to_dict("records")
+
+
+def spectrogram_images(
+    S, sr=22050, n_fft=2048, names=SPECTROGRAM_IMAGES, executor=None
+):
+    """
+    Render the spectrogram, mel, harmonic and percussive images of a stack
+    of spectrograms as base64 encoded PNGs
+    :param S: magnitude spectrograms, shape (signals, bins, frames)
+    :param names: which of SPECTROGRAM_IMAGES to render
+    :param executor: optional concurrent.futures executor to encode PNGs in
+    returns: list with one dictionary of images per signal
+    """
+    spectrograms = {"spectrogram": S}
+    if "spectrogram_mel" in names:
+        spectrograms["spectrogram_mel"] = mel_filters(sr, n_fft) @ S
+    if "spectrogram_harmonic" in names or "spectrogram_percussive" in names:
+        (
+            spectrograms["spectrogram_harmonic"],
+            spectrograms["spectrogram_percussive"],
+        ) = hpss(S)
+
+    levels = [spectrogram_levels(spectrograms[name], sr) for name in names]
+    levels = [image for signal_levels in zip(*levels) for image in signal_levels]
+    if executor is None:
+        images = list(map(encode_spectrogram_image, levels))
+    else:
+        images = list(executor.map(encode_spectrogram_image, levels, chunksize=16))
+    return [
+        dict(zip(names, images[i : i + len(names)]))
+        for i in range(0, len(images), len(names))
+    ]
+
+
+def featurize_signals(
+    arrays, sr=22050, n_fft=2048, freqs=None, batch_size=32, executor=None
+):
+    """
+    Spectrogram images and spectral features for many signals, stacking
+    signals of the same length and computing them together
+    :param arrays: iterable of 1d signals
+    :param batch_size: number of signals stacked at once
+    :param executor: optional concurrent.futures executor to encode PNGs in,
+        e.g. a ProcessPoolExecutor
+    returns: list with one dictionary of images and features per signal
+
+    Images are rendered with spectrogram_images. They look like the
+    specshow images of the default Featurizer but are not pixel-identical
+    (see benchmark_create_features.py), so do not mix the two in one project.
+    """
+    arrays = [np.asarray(array) for array in arrays]
+    by_length = {}
+    for i, array in enumerate(arrays):
+        by_length.setdefault(len(array), []).append(i)
+
+    results = [None] * len(arrays)
+    for indices in by_length.values():
+        for start in range(0, len(indices), batch_size):
+            batch = indices[start : start + batch_size]
+            S = np.abs(librosa.stft(np.stack([arrays[i] for i in batch]), n_fft=n_fft))
+            images = spectrogram_images(S, sr=sr, n_fft=n_fft, executor=executor)
+            features = spectral_features(S, sr=sr, n_fft=n_fft, freqs=freqs)
+            for i, signal_images, signal_features in zip(batch, images, features):
+                results[i] = {**signal_images, **signal_features}
+    return results
 
 
 class Featurizer:
@@ -11,28 +364,52 @@ class Featurizer:
     Class that compute features on a numpy array
     """
 
-    def __init__(self, array=None, sr=22050, n_fft=2048, freqs=None):
+    def __init__(
+        self, array=None, sr=22050, n_fft=2048, freqs=None, matplotlib_images=True
+    ):
         """
         Initialize the message parser, parsing the gram message information.
         :param gram_df: A list of outlog messages
+        :param matplotlib_images: render images with librosa.display.specshow,
+            as earlier versions of this accelerator did. False renders them
+            with spectrogram_images, several times faster, but the images are
+            sampled rather than resampled by matplotlib and PIL, so they are
+            not pixel-identical to the specshow ones
         """
 
         self.sr = sr
         self.n_fft = n_fft
         self.freqs = freqs
+        self.matplotlib_images = matplotlib_images
 
         self.features = {}
         self.spec_features = {}
 
         if array is not None:
             self.S = np.abs(librosa.stft(array, n_fft=self.n_fft))
-            self.spec_features.update(
-                {
-                    "spectrogram": generate_base64_image(
-                        create_spectrogram_image(self.S, self.sr)
-                    )
-                }
-            )
+            self.spec_features.update(self._render_spectrograms(["spectrogram"]))
+
+    def _render_spectrograms(self, names):
+        if self.matplotlib_images:
+            spectrograms = {"spectrogram": self.S}
+            if "spectrogram_mel" in names:
+                spectrograms["spectrogram_mel"] = feature.melspectrogram(
+                    S=self.S, sr=self.sr, n_fft=self.n_fft
+                )
+            if "spectrogram_harmonic" in names:
+                (
+                    spectrograms["spectrogram_harmonic"],
+                    spectrograms["spectrogram_percussive"],
+                ) = decompose.hpss(S=self.S)
+            return {
+                name: generate_base64_image(
+                    create_spectrogram_image(spectrograms[name], self.sr)
+                )
+                for name in names
+            }
+        return spectrogram_images(
+            self.S[None], sr=self.sr, n_fft=self.n_fft, names=names
+        )[0]
 
     def _calc_vector_features(self, vec, suffix=None):
         """
@@ -42,28 +419,8 @@ class Featurizer:
         if vec is None:
             return {}
 
-        stats_to_compute = [
-            "mean",
-            "std_err",
-            "ci",
-            "std",
-            "iqr",
-            "iqr_normal",
-            "mad",
-            "mad_normal",
-            "coef_var",
-            "range",
-            "max",
-            "min",
-            "skew",
-            "kurtosis",
-            "jarque_bera",
-            "mode",
-            "freq",
-            "median",
-        ]
-        features = descriptivestats.describe(vec, stats=stats_to_compute)
-        features = features[0]
+        described = describe_vectors(vec)
+        features = {stat: described[stat][0] for stat in VECTOR_STATS}
         if suffix:
             features = self.add_suffix(features, suffix=suffix)
         return features
@@ -89,127 +446,34 @@ class Featurizer:
         Requires a spectrogram at with at least 3 rows
         returns: dictionary of features
         """
-        # chroma features
-        chroma_features = self._extract_chroma_features()
-        self.features.update(chroma_features)
-
-        if len(self.S) > 9:
-            mfcc = self._extract_mfcc_feature_means(number_of_mfcc=128)
-            self.features.update(mfcc)
-
-        # Spectral Centroid
-        feat_spectral_centroid = feature.spectral_centroid(S=self.S, freq=self.freqs)[0]
-        feat_spectral_centroid = self._calc_vector_features(
-            feat_spectral_centroid, suffix="spec_centroid_"
-        )
-        self.features.update(feat_spectral_centroid)
-
-        feat_spectral_bandwidth = feature.spectral_bandwidth(S=self.S, freq=self.freqs)[
-            0
-        ]
-        feat_spectral_bandwidth = self._calc_vector_features(
-            feat_spectral_bandwidth, suffix="spec_bandwidth_"
+        self.features.update(
+            spectral_features(
+                self.S[None], sr=self.sr, n_fft=self.n_fft, freqs=self.freqs
+            )[0]
         )
-        self.features.update(feat_spectral_bandwidth)
-
-        feat_spectral_bandwidth_3 = feature.spectral_bandwidth(
-            S=self.S, freq=self.freqs, p=3
-        )[0]
-        feat_spectral_bandwidth_3 = self._calc_vector_features(
-            feat_spectral_bandwidth_3, suffix="spec_bandwidth_3_"
-        )
-        self.features.update(feat_spectral_bandwidth_3)
-
-        feat_spectral_bandwidth_4 = feature.spectral_bandwidth(
-            S=self.S, freq=self.freqs, p=4
-        )[0]
-        feat_spectral_bandwidth_4 = self._calc_vector_features(
-            feat_spectral_bandwidth_4, suffix="spec_bandwidth_4_"
-        )
-        self.features.update(feat_spectral_bandwidth_4)
-
-        feat_spectral_rolloff = feature.spectral_rolloff(S=self.S, freq=self.freqs)[0]
-        feat_spectral_rolloff = self._calc_vector_features(
-            feat_spectral_rolloff, suffix="feat_spectral_rolloff_"
-        )
-        self.features.update(feat_spectral_rolloff)
-
-        feat_spectral_flatness = feature.spectral_flatness(S=self.S)[0]
-        feat_spectral_flatness = self._calc_vector_features(
-            feat_spectral_flatness, suffix="feat_spectral_flatness_"
-        )
-        self.features.update(feat_spectral_flatness)
-
-        # compute the delta of the spectral centroid
-        if len(self.S) > 9:
-            feat_spectral_centroid_delta = feature.delta(
-                feature.spectral_centroid(S=self.S, freq=self.freqs)[0]
-            )
-            feat_spectral_centroid_delta = self._calc_vector_features(
-                feat_spectral_centroid_delta, suffix="feat_spectral_centroid_delta_"
-            )
-            self.features.update(feat_spectral_centroid_delta)
-
         return self.features
 
     def _create_all_spectrograms(self):
-        # now lets get array features
-        array_melspectrogram = feature.melspectrogram(
-            S=self.S, sr=self.sr, n_fft=self.n_fft
-        )
         self.spec_features.update(
-            {
-                "spectrogram_mel": generate_base64_image(
-                    create_spectrogram_image(array_melspectrogram, self.sr)
-                )
-            }
-        )
-
-        h, p = decompose.hpss(S=self.S)
-        self.spec_features.update(
-            {
-                "spectrogram_harmonic": generate_base64_image(
-                    create_spectrogram_image(h, self.sr)
-                )
-            }
-        )
-        self.spec_features.update(
-            {
-                "spectrogram_percussive": generate_base64_image(
-                    create_spectrogram_image(p, self.sr)
-                )
-            }
+            self._render_spectrograms(
+                [
+                    "spectrogram_mel",
+                    "spectrogram_harmonic",
+                    "spectrogram_percussive",
+                ]
+            )
         )
-
         return self.spec_features
 
     def _extract_chroma_features(self):
-        chroma = feature.chroma_stft(S=self.S, sr=self.sr, n_fft=self.n_fft)
-        feat = {"chroma_" + str(i): np.mean(chroma[i]) for i in range(len(chroma))}
+        chroma = chroma_means(self.S[None], sr=self.sr, n_fft=self.n_fft)[0]
+        feat = {"chroma_" + str(i): chroma[i] for i in range(len(chroma))}
 
         return feat
 
     def _extract_mfcc_feature_means(self, number_of_mfcc=8):
-        mfcc_alt = librosa.feature.mfcc(S=self.S, n_mfcc=number_of_mfcc)
-        feat_1 = {
-            "feat_mfcc_" + str(i): np.mean(mfcc_alt[i]) for i in range(len(mfcc_alt))
-        }
-
-        if min(self.S.shape[1], 9) >= 3:
-            delta = librosa.feature.delta(mfcc_alt, width=min(self.S.shape[1], 9))
-            feat_2 = {
-                "feat_mfcc_delta_" + str(i): np.mean(delta[i])
-                for i in range(len(delta))
-            }
-            feat_1.update(feat_2)
-
-            accelerate = librosa.feature.delta(
-                mfcc_alt, order=2, width=min(self.S.shape[1], 9)
-            )
-            feat_3 = {
-                "feat_mfcc_accel_" + str(i): np.mean(accelerate[i])
-                for i in range(len(accelerate))
-            }
-            feat_1.update(feat_3)
+        feat_1 = {}
+        for prefix, means in mfcc_means(self.S[None], number_of_mfcc).items():
+            feat_1.update({prefix + str(i): means[0, i] for i in range(len(means[0]))})
 
         return feat_1
@@ -1,4 +1,5 @@
 import base64
+from functools import lru_cache
 from io import BytesIO
 
 from PIL import Image
@@ -60,6 +61,74 @@ def create_spectrogram_image(
     return img_pil
 
 
+# Perceptually uniform colours used by librosa.display.specshow for dB spectrograms
+SPECTROGRAM_COLORS = np.round(
+    plt.get_cmap("magma")(np.linspace(0, 1, 256))[:, :3] * 255
+).astype(np.uint8)
+
+
+def symlog_frequency(freqs: np.ndarray) -> np.ndarray:
+    # Same y scale as specshow(y_axis="log"): symlog, base 2, linear below C2
+    linthresh = librosa.note_to_hz("C2")
+    linscale = 0.5 / (1 - 1 / 2)
+    return np.where(
+        freqs <= linthresh,
+        freqs * linscale,
+        linthresh * (linscale + np.log2(np.maximum(freqs, linthresh) / linthresh)),
+    )
+
+
+@lru_cache(maxsize=32)
+def spectrogram_pixel_index(
+    n_bins: int,
+    n_frames: int,
+    sr: int = 22050,
+    width: int = 224,
+    height: int = 224,
+    log: bool = True,
+):
+    # Rows and columns of a spectrogram sampled at the centre of every output pixel
+    freqs = librosa.fft_frequencies(sr=sr, n_fft=2 * (n_bins - 1))
+    edges = np.concatenate([freqs[:1], (freqs[1:] + freqs[:-1]) / 2, freqs[-1:]])
+    if log:
+        edges = symlog_frequency(edges)
+    centers = edges[0] + (np.arange(height) + 0.5) * (edges[-1] - edges[0]) / height
+    rows = np.clip(np.searchsorted(edges, centers, side="right") - 1, 0, n_bins - 1)
+    cols = ((np.arange(width) + 0.5) * n_frames / width).astype(np.intp)
+    # Image rows run top to bottom, so the highest frequency comes first
+    return rows[::-1, None], cols[None, :]
+
+
+def spectrogram_levels(
+    S: np.ndarray,
+    sr: int = 22050,
+    resize_width: int = 224,
+    resize_height: int = 224,
+    log: bool = True,
+    amin: float = 1e-5,
+    top_db: float = 80.0,
+) -> np.ndarray:
+    # Colour indices of amplitude_to_db(S, ref=np.max) for one or a stack of spectrograms,
+    # scaled between each spectrogram's own min and max the way specshow does
+    rows, cols = spectrogram_pixel_index(
+        *S.shape[-2:], sr=sr, width=resize_width, height=resize_height, log=log
+    )
+    axes = (-2, -1)
+    ref_db = 20 * np.log10(np.maximum(amin, S.max(axis=axes, keepdims=True)))
+    min_db = 20 * np.log10(np.maximum(amin, S.min(axis=axes, keepdims=True)))
+    min_db = np.maximum(min_db - ref_db, -top_db)
+
+    S_db = 20 * np.log10(np.maximum(amin, S[..., rows, cols])) - ref_db
+    S_db = np.maximum(S_db, -top_db)
+    span = np.where(min_db < 0, -min_db, 1.0)
+    return np.round((S_db - min_db) / span * 255).astype(np.uint8)
+
+
+def encode_spectrogram_image(levels: np.ndarray) -> str:
+    # From the colour indices of spectrogram_levels, return a base64 encoded PNG image
+    return generate_base64_image(Image.fromarray(SPECTROGRAM_COLORS[levels]))
+
+
 def plot_feature_impacts(model, top_n=100):
     feature_impacts = model.get_or_request_feature_impact()
     percent_tick_fmt = mtick.PercentFormatter(xmax=1.0)
@@ -336,26 +336,90 @@ def delayed_adstock_transformation(
     - https://towardsdatascience.com/python-stan-implementation-of-multiplicative-marketing-mix-model-with-deep-dive-into-adstock-a7320865b334
     """
 
+    weights = adstock_weights(L=L, P=P, D=D)
+
+    # Apply the adstock effect
+    # The weight at l=0 is applied to x_t, the weight at l to x_(t-l); values
+    # before the start of the series are treated as 0
+    x = np.asarray(x, dtype=float)
+    values = np.convolve(x, weights)[: len(x)]
+
+    # Apply min value
+    values[values < min_value] = 0
+
+    return values
+
+
+def adstock_weights(L: int = 7, P: float = 1, D: float = 0.8) -> np.array:
+    """
+    Compute the normalized weights of the delayed adstock transformation.
+
+    Parameters:
+    ----------
+    L: Length of the media effect in time periods.
+    P: Peak delay of the media effect.
+    D: Decay or retention rate of the media effect.
+
+    Returns:
+    -------
+    Array of length L where the weight at index l is applied to the value l time periods ago.
+    """
     # According to the paper, asserting bounds
     assert L > 0, "L > 0 must be satisfied!"
     assert (P < L) & (P >= 0), "0 <= P < L must be satisfied!"
     assert (D < 1) & (D > 0), "0 < D < 1 must be satisfied!"
 
-    # Extend the input array to handle the initial lag
-    x = np.append(np.zeros(L - 1), x)
+    weights = D ** ((np.arange(L) - P) ** 2)
+    return weights / weights.sum()  # Normalize the weights to ensure they sum to 1
 
-    # Create the weights for the adstock effect
-    weights = np.array([D ** ((l - P) ** 2) for l in range(L)])
-    weights /= weights.sum()  # Normalize the weights to ensure they sum to 1
 
-    # Apply the adstock effect
-    # Reversing weights order because the weight at l=0 should be applied to x_t
-    adstocked_x = [
-        np.dot(x[i - L + 1 : i + 1], weights[::-1]) for i in range(L - 1, len(x))
+def delayed_adstock_grid(
+    X: np.array,
+    param_sets: List[Dict[str, Union[int, float]]],
+    min_value: int = 1,
+) -> np.array:
+    """
+    Applies the delayed adstock transformation to several media variables for
+    several parameter sets at once.
+
+    All convolutions are computed in the frequency domain in a single pass,
+    which is much faster than calling `delayed_adstock_transformation` for
+    every (channel, parameter set) pair when grid-searching adstock parameters.
+
+    Parameters:
+    ----------
+    X: 2-D array of shape (n_periods, n_channels) with the original media variables.
+    param_sets: List of dictionaries containing 'L', 'P' and 'D' parameters.
+        Example: [{'L': 7, 'P': 1, 'D': 0.8}, {'L': 14, 'P': 3, 'D': 0.5}]
+    min_value: Smallest non-zero value allowed after transformation.
+
+    Returns:
+    -------
+    3-D array of shape (n_periods, n_channels, n_param_sets) where
+    [:, c, k] equals `delayed_adstock_transformation(X[:, c], **param_sets[k])`
+    up to floating point precision.
+    """
+    X = np.asarray(X, dtype=float)
+    if X.ndim == 1:
+        X = X[:, None]
+    n_periods = X.shape[0]
+
+    weights = [
+        adstock_weights(L=p["L"], P=p.get("P", 1), D=p.get("D", 0.8))
+        for p in param_sets
     ]
+    max_L = max(len(w) for w in weights)
+    W = np.zeros((max_L, len(weights)))
+    for k, w in enumerate(weights):
+        W[: len(w), k] = w
+
+    n_fft = 1 << int(np.ceil(np.log2(n_periods + max_L - 1)))
+    X_f = np.fft.rfft(X, n=n_fft, axis=0)
+    W_f = np.fft.rfft(W, n=n_fft, axis=0)
+    values = np.fft.irfft(X_f[:, :, None] * W_f[:, None, :], n=n_fft, axis=0)
+    values = values[:n_periods]
 
     # Apply min value
-    values = np.array(adstocked_x)
     values[values < min_value] = 0
 
     return values
@@ -394,19 +458,33 @@ def add_lag_features(
     - Creates new columns with the naming convention: "{target_col} ({period} {time_unit} ago)"
     - The function preserves the original index if date_col is already set as index
     """
-    # Make a copy of the input dataframe to avoid modifying the original
-    result_df = df.copy()
-
     # Set the date as index if it's not already
+    result_df = df
     if date_col in result_df.columns:
         result_df = result_df.set_index(date_col)
 
     # Apply lags
-    for lag in lag_periods:
+    values = result_df[target_col].to_numpy(dtype=float)
+    lags = np.full((len(values), len(lag_periods)), np.nan)
+    lag_names = []
+    for i, lag in enumerate(lag_periods):
+        if abs(lag) >= len(values):
+            # the series is too short for this lag, leave the column empty
+            pass
+        elif lag >= 0:
+            lags[lag:, i] = values[: len(values) - lag]
+        else:
+            lags[:lag, i] = values[-lag:]
+
         # Use singular or plural form based on the lag value
         time_unit_formatted = time_unit if lag == 1 else f"{time_unit}s"
-        lag_name = f"{target_col} ({lag} {time_unit_formatted} ago)"
-        result_df[lag_name] = result_df[target_col].shift(periods=lag)
+        lag_names.append(f"{target_col} ({lag} {time_unit_formatted} ago)")
+
+    # Add all lags at once
+    result_df = pd.concat(
+        [result_df, pd.DataFrame(lags, index=result_df.index, columns=lag_names)],
+        axis=1,
+    )
 
     # Reset index if it was set in this function
     if date_col in df.columns:
@@ -484,15 +562,20 @@ def add_rolling_means(
             f"Unsupported time_unit: {time_unit}. Supported values are: {list(time_shifts.keys())}"
         )
 
-    # Add means
-    for window in rolling_windows:
-        result_df = result_df.join(
-            result_df[target_col]
-            .shift(freq=time_shifts[time_unit])
-            .rolling(window=f"{window*time_windows[time_unit]}D", min_periods=window)
+    # Add all means with a single join
+    shifted = result_df[target_col].shift(freq=time_shifts[time_unit])
+    rolling_means = pd.concat(
+        [
+            shifted.rolling(
+                window=f"{window*time_windows[time_unit]}D", min_periods=window
+            )
             .mean()
             .rename(f"{target_col} ({window} {time_unit} average)")
-        )
+            for window in rolling_windows
+        ],
+        axis=1,
+    )
+    result_df = result_df.join(rolling_means)
 
     # Reset index if it was set in this function
     if not had_date_index:
@@ -646,10 +729,8 @@ def add_adstock_features(
     - Default min_value of 1 is used if not specified in the parameters
     - See delayed_adstock_transformation function documentation for detailed explanation
     """
-    # Make a copy of the input dataframe
-    result_df = df.copy()
-
     # Transform each marketing column
+    adstock_columns = {}
     for col, params in adstock_params.items():
         # Extract parameters with defaults
         L = params.get("L", 7)
@@ -664,11 +745,15 @@ def add_adstock_features(
         col_name = f"{col} (L={L}, P={P}, D={D_value})"
 
         # Apply transformation
-        result_df[col_name] = delayed_adstock_transformation(
-            x=result_df[col].values, L=L, P=P, D=D, min_value=min_value
+        adstock_columns[col_name] = delayed_adstock_transformation(
+            x=df[col].values, L=L, P=P, D=D, min_value=min_value
         )
 
-    return result_df
+    # Add all adstock features at once
+    return pd.concat(
+        [df, pd.DataFrame(adstock_columns, index=df.index)],
+        axis=1,
+    )
 
 
 def extract_channel_name(string: str) -> str:
@@ -1,10 +1,15 @@
 import argparse
 import base64
+from collections import deque
 from io import BytesIO
+import queue
+import threading
+import time
 
 from PIL import Image
 import cv2 as cv
 import requests
+from requests.adapters import HTTPAdapter
 import streamlit as st
 
 
@@ -27,12 +32,13 @@ def image_to_bytes(image, image_quality):
     return final_bytes.getvalue()
 
 
-def prepare_data_for_prediction(image_b64):
-    body = f"image\n{image_b64}"
+def prepare_data_for_prediction(*images_b64):
+    # one CSV row per image, so several frames can be scored in one request
+    body = "image\n" + "\n".join(images_b64)
     return body
 
 
-def make_datarobot_deployment_predictions(image_b64, deployment_id):
+def make_datarobot_deployment_predictions(image_b64, deployment_id, session=None):
     data = prepare_data_for_prediction(image_b64)
     API_URL = st.secrets["API_URL"]
 
@@ -44,7 +50,7 @@ def make_datarobot_deployment_predictions(image_b64, deployment_id):
 
     url = API_URL.format(deployment_id=deployment_id)
 
-    predictions_response = requests.post(
+    predictions_response = (session or requests).post(
         url,
         data=data,
         headers=headers,
@@ -53,6 +59,190 @@ def make_datarobot_deployment_predictions(image_b64, deployment_id):
     return predictions_response.json()
 
 
+def make_session():
+    """Pooled HTTP session with the deployment headers, reused for every request."""
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+    session.headers.update(
+        {
+            "Content-Type": "text/plain; charset=UTF-8",
+            "Authorization": "Bearer {}".format(st.secrets["API_TOKEN"]),
+            "DataRobot-Key": st.secrets["DR_KEY"],
+        }
+    )
+    return session
+
+
+def make_batch_predictions(session, url, images_b64):
+    predictions_response = session.post(
+        url, data=prepare_data_for_prediction(*images_b64)
+    )
+    predictions_response.raise_for_status()
+    return predictions_response.json()["data"]
+
+
+def put_latest(q, item):
+    """
+    Put an item on a bounded queue, dropping the oldest queued item when
+    the queue is full (latest-wins). Returns the number of dropped items.
+    """
+    dropped = 0
+    while True:
+        try:
+            q.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                q.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                pass
+
+
+class FramePipeline:
+    """
+    Capture, encoding and scoring run in their own threads connected by
+    bounded queues, so a slow prediction request never blocks the capture.
+    When a stage falls behind, the stale frames are dropped and only the
+    most recent ones are scored.
+
+    Frames to display are taken from `frames` and scored frames from
+    `results` as (capture time, prediction row) tuples.
+    """
+
+    def __init__(
+        self,
+        cap,
+        url,
+        session,
+        batch_size=1,
+        queue_size=2,
+        image_quality=80,
+        realtime=False,
+    ):
+        self.cap = cap
+        self.url = url
+        self.session = session
+        self.batch_size = batch_size
+        self.image_quality = image_quality
+        # throttle video files to their frame rate, cameras are paced already
+        fps = cap.get(cv.CAP_PROP_FPS) if realtime else 0
+        self.frame_interval = 1 / fps if fps > 0 else 0
+        self.frames = queue.Queue(maxsize=1)
+        self.to_encode = queue.Queue(maxsize=queue_size)
+        self.to_score = queue.Queue(maxsize=queue_size * batch_size)
+        self.results = queue.Queue()
+        # each counter is only updated by its own stage's thread
+        self.dropped_at_capture = 0
+        self.dropped_at_encode = 0
+        self.errors = 0
+        self.finished = threading.Event()
+        self.stopped = threading.Event()
+        self.encoder = threading.Thread(target=self._encode, daemon=True)
+        self.threads = [
+            threading.Thread(target=self._capture, daemon=True),
+            self.encoder,
+            threading.Thread(target=self._score, daemon=True),
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join(timeout=5)
+
+    def _capture(self):
+        try:
+            while not self.stopped.is_set() and self.cap.isOpened():
+                started = time.perf_counter()
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                frame = cv.cvtColor(frame, cv.COLOR_BGR2RGB)
+                put_latest(self.frames, frame)
+                self.dropped_at_capture += put_latest(
+                    self.to_encode, (time.time(), frame)
+                )
+                remaining = self.frame_interval - (time.perf_counter() - started)
+                if remaining > 0:
+                    time.sleep(remaining)
+        finally:
+            self.finished.set()
+
+    def _encode(self):
+        while not self.stopped.is_set():
+            try:
+                captured_at, frame = self.to_encode.get(timeout=0.1)
+            except queue.Empty:
+                if self.finished.is_set():
+                    break
+                continue
+            image_b64 = get_image_as_b64(Image.fromarray(frame), self.image_quality)
+            self.dropped_at_encode += put_latest(
+                self.to_score, (captured_at, image_b64)
+            )
+
+    def _score(self):
+        while not self.stopped.is_set():
+            try:
+                batch = [self.to_score.get(timeout=0.1)]
+            except queue.Empty:
+                if self.finished.is_set() and not self.encoder.is_alive():
+                    break
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.to_score.get_nowait())
+                except queue.Empty:
+                    break
+            captured_at, images_b64 = zip(*batch)
+            try:
+                rows = make_batch_predictions(self.session, self.url, images_b64)
+            except requests.RequestException:
+                self.errors += 1
+                continue
+            for row in zip(captured_at, rows):
+                self.results.put(row)
+
+    @property
+    def dropped(self):
+        return self.dropped_at_capture + self.dropped_at_encode
+
+    @property
+    def done(self):
+        return not any(thread.is_alive() for thread in self.threads)
+
+
+class ThroughputMeter:
+    """FPS and end-to-end latency over the last `window` scored frames."""
+
+    def __init__(self, window=30):
+        self.completed = deque(maxlen=window)
+        self.latencies = deque(maxlen=window)
+
+    def update(self, captured_at):
+        now = time.time()
+        self.completed.append(now)
+        self.latencies.append(now - captured_at)
+
+    @property
+    def fps(self):
+        if len(self.completed) < 2:
+            return 0.0
+        return (len(self.completed) - 1) / (self.completed[-1] - self.completed[0])
+
+    @property
+    def latency(self):
+        if not self.latencies:
+            return 0.0
+        return sum(self.latencies) / len(self.latencies)
+
+
 def parse_arguments():
     parser = argparse.ArgumentParser(
         description="This is a DataRobot Glasses Detection Application"
@@ -60,15 +250,89 @@ def parse_arguments():
     parser.add_argument(
         "--deployment_id", action="store", default=[], help="Add the deployment ID"
     )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="Capture, encode and score frames in separate threads",
+    )
+    parser.add_argument(
+        "--batch_size",
+        action="store",
+        type=int,
+        default=1,
+        help="Maximum number of frames sent per prediction request (pipelined mode)",
+    )
+    parser.add_argument(
+        "--video",
+        action="store",
+        default=None,
+        help="Read frames from a video file instead of the camera",
+    )
     args = parser.parse_args()
 
     return {
         "deployment_id": args.deployment_id,
+        "pipelined": args.pipelined,
+        "batch_size": args.batch_size,
+        "video": args.video,
     }
 
 
+def show_prediction(prediction, pred_placeholder, bar_placeholder):
+    pred = prediction["prediction"]
+    pred_placeholder.text("Predicted class: " + pred)
+
+    prediction_values = prediction["predictionValues"]
+    value_glasses = prediction_values[1]["value"]
+    progress_text = f"Glasses: probability = {round(value_glasses * 100, 2)} %"
+    bar_placeholder.progress(value_glasses, text=progress_text)
+
+
+def run_pipelined(cap, session, args, placeholders):
+    frame_placeholder, pred_placeholder, bar_placeholder, stats_placeholder = (
+        placeholders
+    )
+    url = st.secrets["API_URL"].format(deployment_id=args["deployment_id"])
+    pipeline = FramePipeline(
+        cap,
+        url,
+        session,
+        batch_size=args["batch_size"],
+        realtime=args["video"] is not None,
+    ).start()
+    meter = ThroughputMeter()
+    try:
+        while not pipeline.done:
+            try:
+                frame_placeholder.image(
+                    pipeline.frames.get(timeout=0.1), channels="RGB"
+                )
+            except queue.Empty:
+                pass
+
+            prediction = None
+            while True:
+                try:
+                    captured_at, prediction = pipeline.results.get_nowait()
+                except queue.Empty:
+                    break
+                meter.update(captured_at)
+            if prediction is not None:
+                show_prediction(prediction, pred_placeholder, bar_placeholder)
+                stats_placeholder.text(
+                    f"{meter.fps:.1f} FPS scored, "
+                    f"latency {meter.latency * 1000:.0f} ms, "
+                    f"{pipeline.dropped} frames dropped, "
+                    f"{pipeline.errors} failed requests"
+                )
+    finally:
+        pipeline.stop()
+    st.write("Video has been stopped.")
+
+
 def main():
-    deployment_id = parse_arguments()["deployment_id"]
+    args = parse_arguments()
+    deployment_id = args["deployment_id"]
 
     st.set_page_config(page_title="DataRobot Glasses Detection App")
     st.title("DataRobot Glasses Detection App 👓")
@@ -77,9 +341,28 @@ def main():
     frame_placeholder = st.empty()
     pred_placeholder = st.empty()
     bar_placeholder = st.empty()
+    stats_placeholder = st.empty()
     stop = st.button("Stop")
 
-    cap = cv.VideoCapture(0)
+    cap = cv.VideoCapture(args["video"] if args["video"] else 0)
+    session = make_session()
+    if args["pipelined"]:
+        try:
+            run_pipelined(
+                cap,
+                session,
+                args,
+                (
+                    frame_placeholder,
+                    pred_placeholder,
+                    bar_placeholder,
+                    stats_placeholder,
+                ),
+            )
+        finally:
+            cap.release()
+        return
+
     while cap.isOpened() and not stop:
         ret, frame = cap.read()
         if not ret:
@@ -89,15 +372,9 @@ def main():
         frame_placeholder.image(frame, channels="RGB")
 
         prediction = make_datarobot_deployment_predictions(
-            get_image_as_b64(Image.fromarray(frame), 80), deployment_id
+            get_image_as_b64(Image.fromarray(frame), 80), deployment_id, session
         )
-        pred = prediction["data"][0]["prediction"]
-        pred_placeholder.text("Predicted class: " + pred)
-
-        prediction_values = prediction["data"][0]["predictionValues"]
-        value_glasses = prediction_values[1]["value"]
-        progress_text = f"Glasses: probability = {round(value_glasses * 100, 2)} %"
-        bar_placeholder.progress(value_glasses, text=progress_text)
+        show_prediction(prediction["data"][0], pred_placeholder, bar_placeholder)
 
         if cv.waitKey(1) == ord("q") or stop:
             break
@@ -0,0 +1,145 @@
+"""
+FramePipeline against a local stub prediction server and a recorded video
+
+The stub server answers the deployment's CSV requests with one prediction row
+per image and records the size of every request, so the tests check batching,
+frame dropping and failed requests without a DataRobot deployment or a camera.
+The video is written with OpenCV before the tests. Run with
+`python -m pytest` from this folder.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+import cv2 as cv
+import numpy as np
+import pytest
+import requests
+
+from app import FramePipeline
+
+N_FRAMES = 40
+
+
+class StubDeployment(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        images = body.split("\n")[1:]
+        with server.lock:
+            server.requests.append(len(images))
+            status = server.statuses.pop(0) if server.statuses else 200
+        time.sleep(server.delay)
+        if status != 200:
+            self.send_error(status)
+            return
+        rows = [
+            {
+                "rowId": i,
+                "prediction": "glasses",
+                "predictionValues": [
+                    {"label": "no glasses", "value": 0.1},
+                    {"label": "glasses", "value": 0.9},
+                ],
+            }
+            for i in range(len(images))
+        ]
+        payload = json.dumps({"data": rows}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def deployment():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubDeployment)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.statuses = []
+    server.delay = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/predictions"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("video") / "recorded.avi")
+    writer = cv.VideoWriter(path, cv.VideoWriter_fourcc(*"MJPG"), 25, (64, 48))
+    for i in range(N_FRAMES):
+        frame = np.full((48, 64, 3), i * 6, dtype=np.uint8)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def run(pipeline, timeout=30):
+    pipeline.start()
+    deadline = time.monotonic() + timeout
+    while not pipeline.done:
+        assert time.monotonic() < deadline, "the pipeline did not finish"
+        time.sleep(0.01)
+    results = []
+    while not pipeline.results.empty():
+        results.append(pipeline.results.get_nowait())
+    return results
+
+
+def test_pipeline_scores_every_frame_in_batches(deployment, video):
+    cap = cv.VideoCapture(video)
+    pipeline = FramePipeline(
+        cap, deployment.url, requests.Session(), batch_size=4, queue_size=N_FRAMES
+    )
+
+    results = run(pipeline)
+    cap.release()
+
+    assert len(results) == N_FRAMES
+    assert pipeline.dropped == 0
+    assert pipeline.errors == 0
+    assert sum(deployment.requests) == N_FRAMES
+    assert max(deployment.requests) <= 4
+    # results come back in capture order
+    captured_at = [captured_at for captured_at, _ in results]
+    assert captured_at == sorted(captured_at)
+    assert all(row["prediction"] == "glasses" for _, row in results)
+
+
+def test_pipeline_drops_stale_frames_for_a_slow_deployment(deployment, video):
+    deployment.delay = 0.05
+    cap = cv.VideoCapture(video)
+    pipeline = FramePipeline(cap, deployment.url, requests.Session(), queue_size=1)
+
+    results = run(pipeline)
+    cap.release()
+
+    assert pipeline.dropped > 0
+    assert pipeline.dropped == pipeline.dropped_at_capture + pipeline.dropped_at_encode
+    # every frame is either scored or dropped by one of the stages
+    assert len(results) + pipeline.dropped == N_FRAMES
+    assert len(deployment.requests) == len(results)
+
+
+def test_pipeline_counts_failed_requests(deployment, video):
+    deployment.statuses = [503, 200, 502]
+    cap = cv.VideoCapture(video)
+    pipeline = FramePipeline(
+        cap, deployment.url, requests.Session(), batch_size=2, queue_size=N_FRAMES
+    )
+
+    results = run(pipeline)
+    cap.release()
+
+    assert pipeline.errors == 2
+    failed = deployment.requests[0] + deployment.requests[2]
+    assert len(results) + failed == N_FRAMES
@@ -0,0 +1,135 @@
+"""
+Benchmark the slice aggregation and neighbour features of prepare_data
+
+Builds synthetic minute data (5,000 symbols x 250 trading days x 390 minutes
+by default) and times aggregate_slices and add_neighbours on it. Symbols are
+aggregated independently, so the data is generated and processed in chunks
+of --chunk-symbols symbols to keep the memory bounded, and the timings are
+summed over the chunks. On the first chunk, the previous groupby aggregation
+is timed too and both aggregations are checked to be equal.
+
+Usage:
+    python benchmark_helper.py [--symbols 5000] [--days 250] [--minutes 390]
+        [--chunk-symbols 50] [--slice-size 5] [--radius 3]
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from helper import add_neighbours, aggregate_slices, DEFAULT_AGGREGATION_DICTIONARY
+
+
+def make_minutes(symbols, days, minutes, seed=0):
+    """Minute data of the given symbols, with the time columns already parsed"""
+    rng = np.random.default_rng(seed)
+    n_symbols = len(symbols)
+    dates = pd.bdate_range("2018-04-16", periods=days).to_numpy()
+    offsets = pd.timedelta_range("09:30:00", periods=minutes, freq="min").to_numpy()
+    symbol = np.repeat(np.arange(n_symbols), days * minutes)
+    date = np.tile(np.repeat(dates, minutes), n_symbols)
+    minute = np.tile(offsets, n_symbols * days)
+    n_rows = len(symbol)
+
+    data = pd.DataFrame(
+        {
+            "Symbol": np.asarray(symbols)[symbol],
+            "Sector": np.array(["Energy", "Finance", "Tech"])[symbol % 3],
+            "Security_Type": "Stock",
+            "Cap": "Large",
+            "Style": "Growth",
+            "Exchange": "NYSE",
+            "date_time": date + minute,
+            "date": date,
+            "minute": minute,
+            "TradeVolume": rng.integers(0, 1000, n_rows),
+            "TradePrice": rng.random(n_rows) * 100,
+            "NumTrades": rng.integers(0, 50, n_rows),
+        }
+    )
+    data.loc[rng.random(n_rows) < 0.01, "TradePrice"] = np.nan
+    return data
+
+
+def groupby_slices(data, slice_size, aggregation_dictionary):
+    """The previous aggregation, still used for unsupported statistics"""
+    aggregate = (
+        data.groupby(
+            [pd.Grouper(key="date_time", freq=str(slice_size) + "min")]
+            + ["Symbol", "Sector", "Security_Type", "Cap", "Style", "Exchange"]
+        )
+        .agg(aggregation_dictionary)
+        .reset_index()
+    )
+    aggregate.columns = ["_".join(a) for a in aggregate.columns.to_flat_index()]
+    return aggregate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--symbols", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=250)
+    parser.add_argument("--minutes", type=int, default=390)
+    parser.add_argument("--chunk-symbols", type=int, default=50)
+    parser.add_argument("--slice-size", type=int, default=5)
+    parser.add_argument("--radius", type=int, default=3)
+    args = parser.parse_args()
+
+    symbols = [f"S{i:05d}" for i in range(args.symbols)]
+    rows = slices = 0
+    aggregate_seconds = neighbour_seconds = 0.0
+    for first in range(0, args.symbols, args.chunk_symbols):
+        data = make_minutes(
+            symbols[first : first + args.chunk_symbols],
+            args.days,
+            args.minutes,
+            seed=first,
+        )
+        start = time.perf_counter()
+        aggregate = aggregate_slices(
+            data, args.slice_size, DEFAULT_AGGREGATION_DICTIONARY
+        )
+        aggregate_seconds += time.perf_counter() - start
+
+        if first == 0:
+            start = time.perf_counter()
+            expected = groupby_slices(
+                data, args.slice_size, DEFAULT_AGGREGATION_DICTIONARY
+            )
+            groupby_seconds = time.perf_counter() - start
+            pd.testing.assert_frame_equal(
+                expected, aggregate, check_dtype=False, rtol=1e-9
+            )
+            print(
+                f"first chunk, {len(data)} rows: aggregate_slices "
+                f"{aggregate_seconds:.2f}s, previous groupby {groupby_seconds:.2f}s"
+            )
+
+        aggregate.sort_values(
+            ["Symbol_", "date_time_"], ascending=True, inplace=True, kind="stable"
+        )
+        start = time.perf_counter()
+        add_neighbours(
+            aggregate,
+            args.radius,
+            args.slice_size,
+            data["date_time"].min(),
+            data["date_time"].max(),
+        )
+        neighbour_seconds += time.perf_counter() - start
+        rows += len(data)
+        slices += len(aggregate)
+        del data, aggregate
+
+    print(
+        f"{args.symbols} symbols x {args.days} days x {args.minutes} minutes: "
+        f"{rows} rows, {slices} slices of {args.slice_size} minutes"
+    )
+    print(f"aggregate_slices: {aggregate_seconds:.1f}s")
+    print(f"add_neighbours, radius {args.radius}: {neighbour_seconds:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
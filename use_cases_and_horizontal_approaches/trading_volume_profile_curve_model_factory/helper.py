@@ -3,6 +3,7 @@
 # Useful functions for creating a multi window time series
 
 
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 from datetime import timedelta
 from os.path import join
@@ -12,23 +13,201 @@ import datarobot as dr
 import numpy as np
 import pandas as pd
 
+SLICE_KEYS = ["Symbol", "Sector", "Security_Type", "Cap", "Style", "Exchange"]
+DEFAULT_AGGREGATION_DICTIONARY = {
+    "date": "first",
+    "minute": "min",
+    "TradeVolume": ["sum", "min", "max", "std"],
+    "TradePrice": ["mean", "min", "max", "std"],
+    "NumTrades": ["sum", "min", "max", "std"],
+}
+
+
+def _parse_time_columns(data):
+    # dates and minutes repeat a lot, so we only parse each distinct value once
+    for col in ["date", "date_time"]:
+        if not pd.api.types.is_datetime64_any_dtype(data[col]):
+            data[col] = pd.to_datetime(data[col], cache=True)
+    if not pd.api.types.is_timedelta64_dtype(data["minute"]):
+        codes, uniques = pd.factorize(data["minute"])
+        minutes = pd.to_timedelta(uniques + ":00").to_numpy()
+        data["minute"] = np.where(codes >= 0, minutes[codes], np.timedelta64("NaT"))
+    return data
+
+
+def _reduce_segments(values, starts, func):
+    # aggregates the sorted values of each segment in a single reduceat pass,
+    # skipping missing values like pandas does
+    if func == "first":
+        valid = pd.notna(values)
+        positions = np.where(valid, np.arange(len(values)), len(values))
+        first = np.minimum.reduceat(positions, starts)
+        result = pd.Series(values).reindex(first).to_numpy()
+        return result
+
+    if np.issubdtype(values.dtype, np.datetime64) or np.issubdtype(
+        values.dtype, np.timedelta64
+    ):
+        if func not in ("min", "max"):
+            raise NotImplementedError(func)
+        ints = values.view("int64")
+        valid = ~np.isnat(values)
+        if func == "min":
+            result = np.minimum.reduceat(
+                np.where(valid, ints, np.iinfo(np.int64).max), starts
+            )
+            result[result == np.iinfo(np.int64).max] = np.iinfo(np.int64).min
+        else:
+            result = np.maximum.reduceat(ints, starts)
+        return result.view(values.dtype)
+
+    if values.dtype == bool:
+        values = values.astype("int64")
+    valid = ~np.isnan(values) if values.dtype.kind == "f" else None
+    if func in ("min", "max"):
+        reduce = np.fmin if func == "min" else np.fmax
+        return reduce.reduceat(values, starts)
+    if func == "sum":
+        return np.add.reduceat(
+            values if valid is None else np.where(valid, values, 0), starts
+        )
+
+    counts = np.diff(np.r_[starts, len(values)])
+    if valid is not None:
+        counts = np.add.reduceat(valid.astype("int64"), starts)
+    totals = np.add.reduceat(
+        np.where(valid, values, 0.0) if valid is not None else values.astype(float),
+        starts,
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = totals / counts
+        if func == "mean":
+            return means
+        if func == "std":
+            # two-pass variance for numerical stability
+            group = np.repeat(
+                np.arange(len(starts)), np.diff(np.r_[starts, len(values)])
+            )
+            deviations = values - means[group]
+            if valid is not None:
+                deviations = np.where(valid, deviations, 0.0)
+            squares = np.add.reduceat(deviations * deviations, starts)
+            return np.sqrt(np.where(counts > 1, squares / (counts - 1), np.nan))
+    raise NotImplementedError(func)
+
+
+def aggregate_slices(data, slice_size, aggregation_dictionary):
+    # aggregates the minute data of each symbol into slices of slice_size minutes
+    # equivalent to grouping on pd.Grouper(key="date_time", freq=...) and the
+    # symbol columns, but done with one sort and one reduceat per statistic
+
+    # slices start at midnight of the first day, like pd.Grouper
+    date_time = data["date_time"].to_numpy()
+    origin = data["date_time"].min().normalize().to_datetime64()
+    slice_ns = np.timedelta64(slice_size, "m").astype("timedelta64[ns]").astype("int64")
+    slice_index = (date_time - origin).astype("timedelta64[ns]").astype(
+        "int64"
+    ) // slice_ns
+
+    # integer encode the group keys and combine them in a single sort key
+    key = slice_index
+    valid = ~np.isnat(date_time)
+    key_levels = []
+    for col in SLICE_KEYS:
+        codes, uniques = pd.factorize(data[col], sort=True)
+        valid &= codes >= 0
+        key = key * len(uniques) + codes
+        key_levels.append((col, codes, uniques))
+
+    rows = np.flatnonzero(valid)
+    rows = rows[np.argsort(key[rows], kind="stable")]
+    sorted_key = key[rows]
+    starts = np.flatnonzero(np.r_[True, sorted_key[1:] != sorted_key[:-1]])
+    first_rows = rows[starts]
+
+    aggregate = {
+        "date_time_": origin
+        + (slice_index[first_rows] * slice_ns).astype("timedelta64[ns]")
+    }
+    for col, codes, uniques in key_levels:
+        aggregate[col + "_"] = uniques.take(codes[first_rows])
+    for col, funcs in aggregation_dictionary.items():
+        values = data[col].to_numpy()[rows]
+        for func in [funcs] if isinstance(funcs, str) else funcs:
+            aggregate[col + "_" + func] = _reduce_segments(values, starts, func)
+
+    return pd.DataFrame(aggregate)
+
+
+def _can_reduce(data, aggregation_dictionary):
+    # the reduceat engine only supports the most common statistics
+    for col, funcs in aggregation_dictionary.items():
+        for func in [funcs] if isinstance(funcs, str) else funcs:
+            if func == "first":
+                continue
+            if func not in ("min", "max", "sum", "mean", "std"):
+                return False
+            if not pd.api.types.is_numeric_dtype(data[col]) and func not in (
+                "min",
+                "max",
+            ):
+                return False
+            if pd.api.types.is_object_dtype(data[col]):
+                return False
+    return True
+
+
+def add_neighbours(aggregate, interest_radius, slice_size, start, end):
+    # adds the numeric columns of the slices before and after each slice
+    # all the neighbours are written into a single array, one block per offset
+    numeric_cols = list(
+        aggregate.select_dtypes(include="number").drop(columns=["minute_min"]).columns
+    )
+    values = aggregate[numeric_cols].to_numpy(dtype=float)
+    date_time = aggregate["date_time_"].to_numpy()
+    n_rows, n_cols = values.shape
+
+    neighbours = np.full((n_rows, 2 * interest_radius * n_cols), np.nan)
+    names = []
+    for n in range(1, interest_radius + 1):
+        offset = np.timedelta64(n * slice_size, "m")
+
+        # n slices fwd
+        fwd = neighbours[:, (2 * n - 2) * n_cols : (2 * n - 1) * n_cols]
+        fwd[: n_rows - n] = values[n:]
+        fwd[date_time > end - offset] = np.nan
+        names += [col + "_fwd_" + str(n) for col in numeric_cols]
 
-def prepare_data(data, modelling_choice, aggregation_dictionary=None):
+        # n slices bwd
+        bwd = neighbours[:, (2 * n - 1) * n_cols : 2 * n * n_cols]
+        bwd[n:] = values[: n_rows - n]
+        bwd[date_time < start + offset] = np.nan
+        names += [col + "_bwd_" + str(n) for col in numeric_cols]
+
+    appendage = pd.DataFrame(neighbours, index=aggregate.index, columns=names)
+    return pd.concat([aggregate, appendage], axis=1)
+
+
+def prepare_data(data, modelling_choice, aggregation_dictionary=None, output_path=None):
     # this function aggregates the minute data according to the slice size
     # furthermore, it add features based on the neighbouring slices
     # with the neighbourhood size defined by the interest radius:
     # how many slices before and after should be considered
     # we can choose whether we target percentage of daily volume
     # or the volume itself
+    # data can be a dataframe or the path to a parquet file, and the prepared
+    # data is also written to output_path (parquet) when provided
 
     slice_size = modelling_choice["window_length"]
     interest_radius = int(modelling_choice["window_radius"])
     percentage = modelling_choice["percentage"]
 
     # first we make sure that the time features have the correct type:
-    data = data.copy()
-    data[["date", "date_time"]] = data[["date", "date_time"]].apply(pd.to_datetime)
-    data.minute = pd.to_timedelta(data.minute + ":00")
+    if isinstance(data, str):
+        data = pd.read_parquet(data)
+    else:
+        data = data.copy()
+    data = _parse_time_columns(data)
 
     # we also get the endpoints of the time period
     start = data.date_time.min()
@@ -44,89 +223,41 @@ def prepare_data(data, modelling_choice, aggregation_dictionary=None):
     # Now we aggregate according to the slice size
 
     if aggregation_dictionary == None:
-        aggregation_dictionary = {
-            "date": "first",
-            "minute": "min",
-            "TradeVolume": ["sum", "min", "max", "std"],
-            "TradePrice": ["mean", "min", "max", "std"],
-            "NumTrades": ["sum", "min", "max", "std"],
-        }
-
-    aggregate = (
-        data.groupby(
-            [
-                pd.Grouper(key="date_time", freq=str(slice_size) + "min"),
-                "Symbol",
-                "Sector",
-                "Security_Type",
-                "Cap",
-                "Style",
-                "Exchange",
-            ]
+        aggregation_dictionary = DEFAULT_AGGREGATION_DICTIONARY
+
+    if _can_reduce(data, aggregation_dictionary):
+        aggregate = aggregate_slices(data, slice_size, aggregation_dictionary)
+    else:
+        aggregate = (
+            data.groupby(
+                [pd.Grouper(key="date_time", freq=str(slice_size) + "min")] + SLICE_KEYS
+            )
+            .agg(aggregation_dictionary)
+            .reset_index()
         )
-        .agg(aggregation_dictionary)
-        .reset_index()
-    )
-    aggregate.columns = ["_".join(a) for a in aggregate.columns.to_flat_index()]
+        aggregate.columns = ["_".join(a) for a in aggregate.columns.to_flat_index()]
 
     if percentage == True:
-        # we add column with daily total for each symbol/date pair
-        aggregate = pd.merge(
-            aggregate,
-            aggregate[["Symbol_", "date_first", "TradeVolume_sum"]]
-            .groupby(["Symbol_", "date_first"])
-            .sum()
-            .reset_index(),
-            on=["Symbol_", "date_first"],
-        )
-        # we calculate percentage volume by diving by daily total
-        aggregate["TradeVolume_sum"] = (
-            aggregate["TradeVolume_sum_x"] / aggregate["TradeVolume_sum_y"]
-        )
-        # we drop the volumen and daily volume columns, we only keep the percentage one
-        aggregate.drop(columns=["TradeVolume_sum_x", "TradeVolume_sum_y"], inplace=True)
+        # we calculate percentage volume by diving by the daily total of each symbol/date pair
+        daily_total = aggregate.groupby(["Symbol_", "date_first"])[
+            "TradeVolume_sum"
+        ].transform("sum")
+        percentage_volume = aggregate.pop("TradeVolume_sum") / daily_total
+        # we only keep the percentage column, instead of the volume
+        aggregate["TradeVolume_sum"] = percentage_volume
 
     # Finally, we add columns to reflect the radius at which we would like to look
     # Note that we are happy to look at the previous and following trading days when adding the neighbours
     # It makes sense but the logic can be easily changed if we want to only look within the day
 
-    aggregate.sort_values(["Symbol_", "date_time_"], ascending=True, inplace=True)
-
-    neighbours = []
-
-    for n in range(interest_radius):
-        # n slices fwd
-        suffix = "_fwd_" + str(n + 1)
-        fwd = (
-            aggregate.select_dtypes(include="number")
-            .drop(columns=["minute_min"])
-            .shift(-1)
-            .add_suffix(suffix)
-        )
-        fwd = pd.concat([aggregate[["Symbol_", "date_time_"]], fwd], axis=1)
-        fwd_cols = [col for col in fwd.columns if "fwd" in col]
-        fwd.loc[
-            (fwd.date_time_ > end - (n + 1) * timedelta(minutes=slice_size)), fwd_cols
-        ] = None
-        neighbours.append(fwd.drop(columns=["Symbol_", "date_time_"]))
+    aggregate.sort_values(
+        ["Symbol_", "date_time_"], ascending=True, inplace=True, kind="stable"
+    )
 
-        # n slices bwd
-        suffix = "_bwd_" + str(n + 1)
-        bwd = (
-            aggregate.select_dtypes(include="number")
-            .drop(columns=["minute_min"])
-            .shift(1)
-            .add_suffix(suffix)
-        )
-        bwd = pd.concat([aggregate[["Symbol_", "date_time_"]], bwd], axis=1)
-        bwd_cols = [col for col in bwd.columns if "bwd" in col]
-        bwd.loc[
-            (bwd.date_time_ < start + (n + 1) * timedelta(minutes=slice_size)), bwd_cols
-        ] = None
-        neighbours.append(bwd.drop(columns=["Symbol_", "date_time_"]))
+    prepared_data = add_neighbours(aggregate, interest_radius, slice_size, start, end)
 
-    appendage = pd.concat(neighbours, axis=1)
-    prepared_data = pd.concat([aggregate, appendage], axis=1)
+    if output_path is not None:
+        prepared_data.to_parquet(output_path)
 
     return prepared_data
 
@@ -255,22 +386,54 @@ def run_ts_project_with_dictionary(source_data, project_name, datetime_dict):
     return project, url
 
 
-def run_all_projects(prepared_data, slices, modelling_choice, datetime_dict):
-    # this function just loops through all the time windows (specified by slices)
+def wait_for_projects(projects, poll_interval=60):
+    # this function polls all the projects together until autopilot is done
+    # and returns how long each project took, from the start of the polling
+
+    polling_start = time.time()
+    pending = {project.id: project for project in projects}
+    elapsed = {}
+
+    while pending:
+        for project_id, project in list(pending.items()):
+            if project.get_status()["autopilot_done"]:
+                elapsed[project_id] = time.time() - polling_start
+                del pending[project_id]
+        if pending:
+            time.sleep(poll_interval)
+
+    return elapsed
+
+
+def run_all_projects(
+    prepared_data,
+    slices,
+    modelling_choice,
+    datetime_dict,
+    max_workers=8,
+    wait_for_autopilot=False,
+    poll_interval=60,
+):
+    # this function launches a project for each time window (specified by slices)
     # and collects all the projects created in a dataframe
+    # up to max_workers projects are uploaded and set up at the same time,
+    # and autopilot runs in the background unless wait_for_autopilot is True
 
     today = datetime.datetime.now().strftime("%Y-%m-%d")
-    project_ids = []
-    projects = []
-    urls = []
-    project_time_window_starts = []
 
     percentage_str = "percentage"
     if modelling_choice["percentage"] == False:
         percentage_str = "sum"
 
-    for i, s in slices.iterrows():
-        df_filtered = prepared_data[prepared_data["minute_min"] == s[0]]
+    # we split the data by slice once, instead of filtering it for every slice
+    partitions = {
+        minute: df_slice
+        for minute, df_slice in prepared_data.groupby("minute_min", sort=False)
+    }
+
+    def launch_project(s):
+        setup_start = time.time()
+        df_filtered = partitions.get(s[0], prepared_data.iloc[0:0])
 
         project_name = (
             "VolPred_"
@@ -291,26 +454,53 @@ def run_all_projects(prepared_data, slices, modelling_choice, datetime_dict):
             df_filtered, project_name, datetime_dict
         )
 
-        project_time_window_starts.append(str(s["hours"]) + ":" + str(s["minutes"]))
-        project_ids.append(project.id)
-        projects.append(project)
-        urls.append(url)
+        return project, url, time.time() - setup_start
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(launch_project, s) for _, s in slices.iterrows()]
+        launched = [future.result() for future in futures]
 
     projects_df = pd.DataFrame(
-        list(zip(project_ids, project_time_window_starts, urls, projects))
+        [
+            (project.id, str(s["hours"]) + ":" + str(s["minutes"]), url, project, t)
+            for (_, s), (project, url, t) in zip(slices.iterrows(), launched)
+        ],
+        columns=["project_id", "slice", "url", "project", "setup_time"],
     )
-    projects_df.columns = ["project_id", "slice", "url", "project"]
+
+    if wait_for_autopilot:
+        autopilot_time = wait_for_projects(projects_df["project"], poll_interval)
+        projects_df["autopilot_time"] = projects_df["project_id"].map(autopilot_time)
 
     return projects_df
 
 
-def prepare_data_for_predictions(data, modelling_choice, aggregation_dictionary=None):
+def prepare_data_for_predictions(
+    data, modelling_choice, aggregation_dictionary=None, history_days=16
+):
     # We prepare data for prediction.
+    # Only the last history_days days are returned, so they need to cover the
+    # feature derivation window of the projects (14 days in the starter code)
+    # plus the day to predict.
 
-    start = data.date.min()
-    end = data.date.max()
+    if isinstance(data, str):
+        data = pd.read_parquet(data)
+
+    start = str(data.date.min())
+    end = str(data.date.max())
 
     # First we replicate what we did for the training data
+    # older days are only needed for the backward neighbours of the first
+    # returned slices: each trading day has at least one slice, so keeping
+    # window_radius earlier trading days is enough, however long the weekends
+    end_date = pd.Timestamp(end)
+    dates = pd.to_datetime(data.date, cache=True)
+    history_start = end_date - timedelta(days=history_days)
+    earlier_days = np.sort(dates[dates < history_start].unique())
+    interest_radius = int(modelling_choice["window_radius"])
+    if interest_radius > 0 and len(earlier_days) > 0:
+        history_start = earlier_days[-min(interest_radius, len(earlier_days))]
+    data = data[dates >= history_start]
     prepared_data = prepare_data(data, modelling_choice, aggregation_dictionary=None)
 
     # We identify the numeric columns, which won't be know at prediction time
@@ -326,7 +516,7 @@ def prepare_data_for_predictions(data, modelling_choice, aggregation_dictionary=
     # We make sure that the rows which we want to predict have blanks on the numeric data
 
     recent_data = prepared_data[
-        prepared_data.date_time_ > (end - (16) * timedelta(days=1))
+        prepared_data.date_time_ > (end - history_days * timedelta(days=1))
     ].copy()
     recent_data.loc[
         (recent_data.date_first > end - timedelta(days=1)), numeric_cols
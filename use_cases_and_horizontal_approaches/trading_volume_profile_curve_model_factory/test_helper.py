@@ -0,0 +1,185 @@
+"""
+Launching and polling of the per-slice projects in helper against a stubbed client
+
+run_ts_project_with_dictionary is replaced by a double, so the tests check
+that run_all_projects uploads at most max_workers slices at once, returns the
+same projects_df as the previous one-by-one loop plus the per-slice timings,
+and that wait_for_projects polls all the projects in one loop, without a
+DataRobot connection. Run with `python -m pytest` from this folder.
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import helper
+
+
+class FakeProject:
+    def __init__(self, pid, polls_until_done=1):
+        self.id = pid
+        self.polls_until_done = polls_until_done
+        self.status_calls = 0
+
+    def get_status(self):
+        self.status_calls += 1
+        return {"autopilot_done": self.status_calls >= self.polls_until_done}
+
+
+class FakeClient:
+    """
+    Stands in for run_ts_project_with_dictionary, recording the data of every
+    upload and the largest number of concurrent uploads.
+    """
+
+    def __init__(self, setup_seconds):
+        self.setup_seconds = setup_seconds
+        self.uploads = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def run_ts_project_with_dictionary(self, source_data, project_name, datetime_dict):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            slice_name = project_name.split("_")[4]
+            threading.Event().wait(self.setup_seconds[slice_name])
+            with self.lock:
+                self.uploads[slice_name] = source_data
+            project = FakeProject("p" + slice_name.replace(":", ""))
+            return project, "https://app.datarobot.com/projects/" + project.id + "/eda"
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+def make_slices(n_slices=12, slice_size=5):
+    prepared_data = pd.DataFrame(
+        {
+            "minute_min": np.tile(
+                pd.timedelta_range(
+                    "09:30:00", periods=n_slices, freq=f"{slice_size}min"
+                ),
+                3,
+            ),
+            "Symbol_": np.repeat(["A", "B", "C"], n_slices),
+            "TradeVolume_sum": np.arange(3 * n_slices, dtype=float),
+        }
+    )
+    slices = pd.DataFrame(prepared_data.minute_min.unique()[:-1])
+    slices = pd.concat(
+        [
+            slices,
+            slices[0].dt.components["hours"],
+            slices[0].dt.components["minutes"],
+        ],
+        axis=1,
+    )
+    return prepared_data, slices
+
+
+MODELLING_CHOICE = {"window_length": 5, "window_radius": 1, "percentage": True}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    _, slices = make_slices()
+    names = [f"{s['hours']}:{s['minutes']}" for _, s in slices.iterrows()]
+    client = FakeClient({name: 0.01 * (i % 4 + 1) for i, name in enumerate(names)})
+    monkeypatch.setattr(
+        helper,
+        "run_ts_project_with_dictionary",
+        client.run_ts_project_with_dictionary,
+    )
+    return client
+
+
+def test_run_all_projects_bounds_concurrent_uploads(client):
+    prepared_data, slices = make_slices()
+
+    projects_df = helper.run_all_projects(
+        prepared_data, slices, MODELLING_CHOICE, {}, max_workers=3
+    )
+
+    assert 1 < client.max_in_flight <= 3
+    assert len(client.uploads) == len(slices)
+    # every project gets exactly the rows of its slice
+    for _, s in slices.iterrows():
+        pd.testing.assert_frame_equal(
+            client.uploads[f"{s['hours']}:{s['minutes']}"],
+            prepared_data[prepared_data["minute_min"] == s[0]],
+        )
+    assert "autopilot_time" not in projects_df
+
+
+def test_run_all_projects_returns_the_same_projects_df(client):
+    prepared_data, slices = make_slices()
+
+    projects_df = helper.run_all_projects(
+        prepared_data, slices, MODELLING_CHOICE, {}, max_workers=4
+    )
+
+    # the frame of the previous one-by-one loop, in slice order
+    names = [f"{s['hours']}:{s['minutes']}" for _, s in slices.iterrows()]
+    ids = ["p" + name.replace(":", "") for name in names]
+    expected = pd.DataFrame(
+        {
+            "project_id": ids,
+            "slice": names,
+            "url": [f"https://app.datarobot.com/projects/{pid}/eda" for pid in ids],
+        }
+    )
+    assert list(projects_df.columns) == [
+        "project_id",
+        "slice",
+        "url",
+        "project",
+        "setup_time",
+    ]
+    pd.testing.assert_frame_equal(projects_df[expected.columns], expected)
+    assert [p.id for p in projects_df["project"]] == ids
+    # each slice is timed on its own, not as a share of the whole launch
+    for name, setup_time in zip(names, projects_df["setup_time"]):
+        assert client.setup_seconds[name] <= setup_time < 1
+
+
+def test_run_all_projects_waits_for_autopilot_in_one_loop(client, monkeypatch):
+    prepared_data, slices = make_slices(n_slices=4)
+    sleeps = []
+    monkeypatch.setattr(helper.time, "sleep", sleeps.append)
+
+    projects_df = helper.run_all_projects(
+        prepared_data,
+        slices,
+        MODELLING_CHOICE,
+        {},
+        max_workers=2,
+        wait_for_autopilot=True,
+        poll_interval=7,
+    )
+
+    # the stub projects are done at the first status check
+    assert sleeps == []
+    assert projects_df["autopilot_time"].notna().all()
+    assert [p.status_calls for p in projects_df["project"]] == [1, 1, 1]
+
+
+def test_wait_for_projects_polls_all_projects_together(monkeypatch):
+    clock = iter(range(0, 1000, 10))
+    monkeypatch.setattr(helper.time, "time", lambda: next(clock))
+    sleeps = []
+    monkeypatch.setattr(helper.time, "sleep", sleeps.append)
+    projects = [FakeProject("a", 3), FakeProject("b", 1), FakeProject("c", 2)]
+
+    elapsed = helper.wait_for_projects(projects, poll_interval=30)
+
+    # one sleep per polling round, not one per project
+    assert sleeps == [30, 30]
+    assert [p.status_calls for p in projects] == [3, 1, 2]
+    # the clock ticks on every time.time() call: the polling start, then each
+    # project found done
+    assert elapsed == {"b": 10, "c": 20, "a": 30}